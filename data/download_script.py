@@ -1,40 +1,266 @@
+"""
+download the product images of the export csv.
+
+    python data/download_script.py --csv data/Products-Export-2025-February-16-1830-full.csv --out data --resize 336
+
+- a fixed number of workers (and pooled connections) fetch the rows, the csv is streamed so memory stays flat
+- bodies are streamed to a temp file in chunks off the event loop and renamed when complete
+- connection errors, 429 and 5xx are retried with exponential backoff (Retry-After is honoured)
+- ETag / Last-Modified of every image are kept in {out}/.fetch_state.json (saved every few hundred images and
+  when the run stops), re-runs send conditional requests and unchanged images are not downloaded again (304)
+- the updated csv keeps the order of the input csv, rows repeating an id share one download
+- with --resize, a copy downscaled to that short side (about the model input resolution) is written to
+  --resized-dir as {id}.jpg. nothing reads it by default: pass it as the catalog loader's --images-dir to
+  embed from the small copies instead of decoding the multi-megapixel originals. a failed resize is counted
+  in resize_failed, the original is still downloaded
+"""
 import os
-import aiohttp
+import csv
+import json
+import time
+import random
 import asyncio
-import pandas as pd
-from tqdm.asyncio import tqdm_asyncio
-print('started')
-# Load CSV
-csv_file = 'data\Products-Export-2025-February-16-1830-full.csv'
-df = pd.read_csv(csv_file).head(1000)
+import argparse
+from collections import deque
+import aiohttp
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class ConfigFetch:
+    def __init__(self):
+        self.concurrency = 16  # workers and pooled connections
+        self.per_host = 8  # connections per host
+        self.retries = 4
+        self.backoff_s = 0.5  # first retry delay, doubled every attempt (+ jitter)
+        self.timeout_s = 60
+        self.chunk_bytes = 1 << 16
+        self.save_every = 500  # fetch state is saved after this many finished rows, and at the end
+        self.resize = 0  # short side of the downscaled copy, 0 disables it
+        self.resized_dir = None
+        self.quality = 90
+
+
+def resize_copy(src: str, dst: str, side: int, quality: int):
+    """downscaled jpeg copy with the short side = side (never upscaled)"""
+    from PIL import Image
+    with Image.open(src) as img:
+        # jpeg draft decodes at 1/2, 1/4, 1/8 scale directly, much cheaper than a full decode + resize
+        img.draft('RGB', (side, side))
+        img = img.convert('RGB')
+        scale = side / min(img.size)
+        if scale < 1:
+            img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.BICUBIC)
+        tmp = f'{dst}.part'
+        img.save(tmp, 'JPEG', quality=quality)
+    os.replace(tmp, dst)
+
+
+class Fetcher:
+
+    def __init__(self, out_dir: str, config: ConfigFetch):
+        self.out_dir = out_dir
+        self.config = config
+        self.state_path = os.path.join(out_dir, '.fetch_state.json')
+        self.state = {}  # id -> {url, etag, last_modified}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                self.state = json.load(f)
+        self.stats = {'downloaded': 0, 'not_modified': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'resize_failed': 0}
+
+    def save_state(self):
+        tmp = f'{self.state_path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    def _conditional_headers(self, img_id: str, url: str, path: str) -> dict:
+        known = self.state.get(img_id)
+        if not known or known.get('url') != url or not os.path.exists(path):
+            return {}
+        headers = {}
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+        return headers
+
+    async def _stream_to_file(self, response, path: str):
+        loop = asyncio.get_running_loop()
+        tmp = f'{path}.part'
+        f = await loop.run_in_executor(None, open, tmp, 'wb')
+        try:
+            async for chunk in response.content.iter_chunked(self.config.chunk_bytes):
+                await loop.run_in_executor(None, f.write, chunk)
+                self.stats['bytes'] += len(chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        os.replace(tmp, path)
+
+    async def fetch(self, session, img_id: str, url: str) -> str | None:
+        """filename of the image (downloaded or unchanged), None when it failed"""
+        filename = f'{img_id}.jpg'
+        path = os.path.join(self.out_dir, filename)
+        headers = self._conditional_headers(img_id, url, path)
+
+        for attempt in range(self.config.retries + 1):
+            delay = self.config.backoff_s * 2 ** attempt * (1 + random.random())
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        self.stats['not_modified'] += 1
+                        await self._resize(path, filename)
+                        return filename
+                    if response.status == 200:
+                        await self._stream_to_file(response, path)
+                        self.state[img_id] = {'url': url, 'etag': response.headers.get('ETag'),
+                                              'last_modified': response.headers.get('Last-Modified')}
+                        self.stats['downloaded'] += 1
+                        await self._resize(path, filename, force=True)
+                        return filename
+                    if response.status not in RETRY_STATUS:
+                        print(f"Failed: {url} -> HTTP {response.status}")
+                        break
+                    retry_after = response.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = max(delay, float(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.config.retries:
+                    print(f"Failed: {url} -> {type(e).__name__}: {e}")
+                    break
+            if attempt < self.config.retries:
+                self.stats['retries'] += 1
+                await asyncio.sleep(delay)
+        self.stats['failed'] += 1
+        return None
+
+    async def _resize(self, path: str, filename: str, force: bool = False):
+        if not self.config.resize or not self.config.resized_dir:
+            return
+        dst = os.path.join(self.config.resized_dir, filename)
+        if force or not os.path.exists(dst):
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, resize_copy, path, dst,
+                                                                 self.config.resize, self.config.quality)
+            except Exception as e:
+                # the original is fine, only its copy is missing
+                print(f"Resize failed: {path} -> {type(e).__name__}: {e}")
+                self.stats['resize_failed'] += 1
+
+    async def run(self, rows, on_done):
+        """
+        rows: iterable of (id, url), on_done(id, filename or None) is called as rows finish.
+        the fetch state is saved every save_every rows and when the run ends, also on an error or ctrl-c.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.config.resize and self.config.resized_dir:
+            os.makedirs(self.config.resized_dir, exist_ok=True)
+        connector = aiohttp.TCPConnector(limit=self.config.concurrency, limit_per_host=self.config.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.config.timeout_s)
+        pending = asyncio.Queue(maxsize=2 * self.config.concurrency)  # bounded, the csv is read as workers free up
+        in_flight = {}  # id -> future of its filename, while a worker fetches it
+        finished = 0
+
+        async def feed():
+            for row in rows:
+                await pending.put(row)
+            for _ in range(self.config.concurrency):
+                await pending.put(None)
+
+        async def fetch_once(session, img_id, url):
+            # a row whose id is already being fetched waits for that fetch instead of writing the same .part file
+            shared = in_flight.get(img_id)
+            if shared is not None:
+                return await asyncio.shield(shared)
+            shared = in_flight[img_id] = asyncio.get_running_loop().create_future()
+            filename = None
+            try:
+                filename = await self.fetch(session, img_id, url)
+            except Exception as e:
+                print(f"Failed: {url} -> {type(e).__name__}: {e}")
+                self.stats['failed'] += 1
+            finally:
+                del in_flight[img_id]
+                shared.set_result(filename)
+            return filename
+
+        async def worker(session):
+            nonlocal finished
+            while True:
+                row = await pending.get()
+                if row is None:
+                    return
+                img_id, url = row
+                on_done(img_id, await fetch_once(session, img_id, url))
+                finished += 1
+                if finished % self.config.save_every == 0:
+                    self.save_state()
+
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                # the feeder is a task too, so a failing worker stops the run instead of blocking the feeder
+                tasks = [asyncio.create_task(feed()),
+                         *(asyncio.create_task(worker(session)) for _ in range(self.config.concurrency))]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+        finally:
+            self.save_state()
+
 
-# Ensure save directory exists
-save_dir = "data"
-os.makedirs(save_dir, exist_ok=True)
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default=os.path.join('data', 'Products-Export-2025-February-16-1830-full.csv'))
+    parser.add_argument('--out', default='data', help='where {id}.jpg are saved')
+    parser.add_argument('--updated-csv', default='updated_images.csv', help='the csv with a filename column')
+    parser.add_argument('--limit', type=int, default=None, help='only the first N rows')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=8)
+    parser.add_argument('--retries', type=int, default=4)
+    parser.add_argument('--resize', type=int, default=0, help='short side of a downscaled copy, e.g. 336')
+    parser.add_argument('--resized-dir', default=os.path.join('data', 'resized'))
+    args = parser.parse_args()
 
+    config = ConfigFetch()
+    config.concurrency, config.per_host, config.retries = args.concurrency, args.per_host, args.retries
+    config.resize, config.resized_dir = args.resize, args.resized_dir
+    fetcher = Fetcher(args.out, config)
 
-async def download_image(session, img_id, url):
-    filename = f"{img_id}.jpg"
-    path = os.path.join(save_dir, filename)
+    t0 = time.perf_counter()
+    with open(args.csv, encoding='utf-8-sig', newline='') as src, \
+            open(args.updated_csv, 'w', encoding='utf-8', newline='') as dst:
+        reader = csv.DictReader(src)
+        writer = csv.DictWriter(dst, fieldnames=[*reader.fieldnames, 'filename'])
+        writer.writeheader()
+        # rows in csv order, [row, filename] with filename None until fetched. the head is written as soon as it
+        # finishes, so only the rows that finished ahead of a slower one are held back
+        rows = deque()
+        in_flight = {}  # id -> its entries in rows, oldest first
 
-    try:
-        async with session.get(url) as response:
-            if response.status == 200:
-                with open(path, "wb") as f:
-                    f.write(await response.read())
-                return filename  # Return filename if successful
-    except Exception as e:
-        print(f"Failed: {url} -> {e}")
-    return None  # Return None if failed
+        def read_rows():
+            for i, row in enumerate(reader):
+                if args.limit is not None and i >= args.limit:
+                    break
+                entry = [row, None]
+                rows.append(entry)
+                in_flight.setdefault(row['id'], deque()).append(entry)
+                yield row['id'], row['url']
 
+        def on_done(img_id, filename):
+            entries = in_flight[img_id]
+            entries.popleft()[1] = filename or ''
+            if not entries:
+                del in_flight[img_id]
+            while rows and rows[0][1] is not None:
+                row, filename = rows.popleft()
+                writer.writerow({**row, 'filename': filename})
 
-async def main():
-    async with aiohttp.ClientSession() as session:
-        tasks = [download_image(session, img_id, url) for img_id, url in zip(df["id"], df["url"])]
-        return await tqdm_asyncio.gather(*tasks)
+        asyncio.run(fetcher.run(read_rows(), on_done))
 
+    print(json.dumps({**fetcher.stats, 'seconds': round(time.perf_counter() - t0, 2)}))
 
-df["filename"] = asyncio.run(main())  # Store downloaded filenames in CSV
 
-# Save updated CSV
-df.to_csv("updated_images.csv", index=False)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
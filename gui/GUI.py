@@ -1,9 +1,12 @@
 import streamlit as st
 from pathlib import Path
-from PIL import Image, ImageOps
+import sys
 import math
+import atexit
 import random
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # the repo root, gui_logic imports src.v1.product_export
 from gui_logic import GuiLogic
+from thumbnails import ThumbnailAtlas, ConfigThumbnails
 
 class ConfigGui:
     def __init__(self):
@@ -12,6 +15,17 @@ class ConfigGui:
         self.padding_color = (100, 100, 100)
 
 
+@st.cache_resource
+def load_thumbnails(images_folder, image_size, padding_color):
+    """one atlas per server process, shared by every session and rerun. missing / stale thumbnails are built once here"""
+    config = ConfigThumbnails()
+    config.image_size, config.padding_color = image_size, padding_color
+    atlas = ThumbnailAtlas(config)
+    atlas.build(sorted(Path(images_folder).glob("*.jpg")))
+    atexit.register(atlas.close)  # thumbnails built by get() since the last index write
+    return atlas
+
+
 class GUI:
     def __init__(self):
         config = ConfigGui()
@@ -24,6 +38,7 @@ class GUI:
             'padding_color': padding_color,
             'images_per_row': 4
         }
+        self.thumbnails = load_thumbnails(images_folder, image_size, padding_color)
 
         # Initialize session states if needed
         if "logic_instance" not in st.session_state:
@@ -41,10 +56,9 @@ class GUI:
         if "user_description" not in st.session_state:
             st.session_state.user_description = ""
 
-    def process_image(self, image_path):
-        """Standardize image size with padding"""
-        img = Image.open(image_path).convert("RGB")
-        return ImageOps.pad(img, self.config['image_size'], color=self.config['padding_color'])
+    def process_image(self, image_path, img_id=None):
+        """Standardize image size with padding, served from the thumbnail atlas (decoded only when new or changed)"""
+        return self.thumbnails.get(img_id if img_id is not None else Path(image_path).stem, image_path)
 
     def load_images(self, max_images=20):
         """Load images from the specified folder"""
@@ -84,14 +98,13 @@ class GUI:
     def display_selectable_image(self, image_path):
         """Display a single image with like and dislike buttons"""
         img = self.process_image(image_path)
-        str_path = str(image_path)
-        img_id = str_path.split("\\")[-1].split(".")[0]  # Extract the image ID from the file name
+        img_id = Path(image_path).stem  # Extract the image ID from the file name
 
         # Display the image
         st.image(img, use_container_width=True)
 
-        # Create like/dislike buttons
-        col1, col2 = st.columns([1, 1])
+        # Create like/dislike/delete buttons
+        col1, col2, col3 = st.columns([1, 1, 1])
 
         # Like button
         with col1:
@@ -107,12 +120,37 @@ class GUI:
                 st.session_state.liked_ids.discard(img_id)
                 st.rerun()
 
+        # Delete button
+        with col3:
+            if st.button(f"Delete", key=f"delete_{img_id}"):
+                self.delete_image(image_path)
+                st.rerun()
+
+    def delete_image(self, image_path):
+        """Delete the art from the collection and forget its thumbnail"""
+        img_id = Path(image_path).stem
+        try:
+            st.session_state.logic_instance.delete([int(img_id)])
+        except Exception as e:
+            st.error(f"Failed to delete {img_id}: {e}")
+            return
+        self.thumbnails.discard([img_id])
+        st.session_state.liked_ids.discard(img_id)
+        st.session_state.disliked_ids.discard(img_id)
+        st.session_state.predicted_images = [art_id for art_id in st.session_state.predicted_images or []
+                                             if str(art_id) != img_id]
+        st.session_state.all_available_images = [img for img in st.session_state.all_available_images
+                                                 if img.stem != img_id]
+        st.session_state.current_images = [img for img in st.session_state.current_images if img.stem != img_id]
+
     def predict_images(self):
         """Prediction logic with liked and disliked image IDs."""
-        if len(st.session_state.liked_ids) > 0 or len(st.session_state.disliked_ids) > 0:
+        description = st.session_state.user_description.strip()
+        if len(st.session_state.liked_ids) > 0 or len(st.session_state.disliked_ids) > 0 or description:
             return st.session_state.logic_instance.similarity(
                 list(st.session_state.liked_ids),
-                list(st.session_state.disliked_ids)
+                list(st.session_state.disliked_ids),
+                description
             )
         else:
             return []
@@ -121,11 +159,14 @@ class GUI:
         """Display the predicted/ordered images"""
         if st.session_state.predicted_images:
             st.subheader("Predicted Images")
-            cols = st.columns(len(list(set(st.session_state.predicted_images))))
-            for idx, img_id in enumerate(list(set(st.session_state.predicted_images))):
+            predicted = list(dict.fromkeys(st.session_state.predicted_images))
+            arts_data = st.session_state.logic_instance.arts_data(predicted, fields=["url"])
+            cols = st.columns(len(predicted))
+            for idx, img_id in enumerate(predicted):
                 with cols[idx]:
-                    img_path = Path(self.config['images_folder']) / f"{img_id}.jpg"
-                    img = self.process_image(img_path)
+                    # stored url when the server knows the art, the data folder naming otherwise
+                    img_path = arts_data.get(img_id, {}).get("url") or Path(self.config['images_folder']) / f"{img_id}.jpg"
+                    img = self.process_image(img_path, img_id)
                     st.image(img, use_container_width=True)
 
     def display_selected_images(self):
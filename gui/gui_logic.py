@@ -1,47 +1,183 @@
 import os
+import gzip
+import json
+import time
+import random
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
+from requests.adapters import HTTPAdapter
+from src.v1.product_export import read_product_export
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
 class GuiLogic:
 
-    def __init__(self, insert_endpoint='http://localhost:8000/insert_arts', similarity_endpoint='http://localhost:8000/get_similar_arts', images_dir='data'):
+    def __init__(self, insert_endpoint='http://localhost:8000/upsert_arts', similarity_endpoint='http://localhost:8000/get_similar_arts', images_dir='data',
+                 arts_data_endpoint='http://localhost:8000/get_arts_data', search_endpoint='http://localhost:8000/search_arts',
+                 products_csv='data/Products-Export-2025-February-16-1830-full.csv',
+                 delete_endpoint='http://localhost:8000/delete_arts',
+                 chunk_size=500, parallel=4, compression='gzip', retries=4, timeout=120):
         self.image_dir = images_dir
-        self.data = []
-        self.insert_endpoint = insert_endpoint
+        self.insert_endpoint = insert_endpoint  # upsert: a retried chunk the server already took replaces, not duplicates
         self.similarity_endpoint = similarity_endpoint
+        self.arts_data_endpoint = arts_data_endpoint
+        self.search_endpoint = search_endpoint
+        self.delete_endpoint = delete_endpoint
+        self.products_csv = products_csv
+        self.chunk_size = chunk_size  # records per insert request
+        self.parallel = parallel  # chunks in flight
+        self.compression = compression  # 'gzip' | 'zstd' | None
+        if compression == 'zstd' and zstandard is None:
+            print("zstandard is not installed, insert bodies are sent gzip compressed")
+            self.compression = 'gzip'
+        self.retries = retries
+        self.timeout = timeout
 
-        for filename in os.listdir(self.image_dir):
-            if filename.endswith(".jpg"):  # Ensure it's an image file
-                img_id = os.path.splitext(filename)[0]  # Extract ID from filename (without extension)
-                image_path = os.path.join(self.image_dir, filename)
+        # one keep-alive connection per chunk in flight, shared by every call of the gui
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(parallel, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
-                self.data.append({
+    def records(self):
+        """insert records of the images in images_dir, yielded as the directory is scanned"""
+        products = read_product_export(self.products_csv) if self.products_csv and os.path.exists(self.products_csv) else {}
+        with os.scandir(self.image_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".jpg"):  # Ensure it's an image file
+                    continue
+                img_id = os.path.splitext(entry.name)[0]  # Extract ID from filename (without extension)
+                if not img_id.isdigit():
+                    continue
+                product = products.get(int(img_id), {})
+                yield {
                     "id": int(img_id),  # Convert ID to integer
-                    "url": image_path,  # FastAPI expects 'url' to be the filename
+                    "url": entry.path,  # FastAPI expects 'url' to be the filename
                     "img_name": "string",  # Placeholder name, update as needed
-                    "size": [0, 0]
-                })
+                    "size": [int(product.get("width", 0)), int(product.get("height", 0))],
+                    **product,  # typed fields (width, height, depth, technique, medium, style) for filtering
+                }
+
+    def _encode(self, chunk):
+        """(body, headers) of one chunk, json compressed with self.compression"""
+        body = json.dumps(chunk, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.compression == "gzip":
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        elif self.compression == "zstd":
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+            headers["Content-Encoding"] = "zstd"
+        return body, headers
+
+    def _post_chunk(self, chunk):
+        """
+        insert one chunk, connection errors, 429 and 5xx are retried with exponential backoff.
+        a timed out attempt may still have been queued by the server, so chunks go to the idempotent upsert endpoint.
+        """
+        body, headers = self._encode(chunk)
+        error = None
+        for attempt in range(self.retries + 1):
+            delay = 0.5 * 2 ** attempt * (1 + random.random())
+            try:
+                response = self.session.post(self.insert_endpoint, data=body, headers=headers, timeout=self.timeout)
+                if response.status_code == 200:
+                    return response.json()
+                error = f"{response.status_code}, {response.text[:200]}"
+                if response.status_code == 415 and self.compression:
+                    # server without support for this encoding, fall back to plain json
+                    body, headers = json.dumps(chunk, ensure_ascii=False).encode("utf-8"), {"Content-Type": "application/json"}
+                    continue
+                if response.status_code not in RETRY_STATUS:
+                    break
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.retries:
+                time.sleep(delay)
+        raise RuntimeError(error)
 
+    def delete(self, ids):
+        response = self.session.post(self.delete_endpoint, json=[int(art_id) for art_id in ids], timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
 
     def insert(self):
+        """
+        send the records in chunks of chunk_size, up to `parallel` chunks in flight.
+        a failed chunk doesn't stop the others, its ids are returned in "failed_ids".
+        """
+        t0 = time.perf_counter()
+        records = iter(self.records())
+        result = {"job_ids": [], "sent": 0, "failed_ids": [], "errors": []}
+        in_flight = {}
+
+        def done(future):
+            chunk = in_flight.pop(future)
+            try:
+                result["job_ids"].append(future.result()["job_id"])
+                result["sent"] += len(chunk)
+            except Exception as e:
+                result["failed_ids"].extend(record["id"] for record in chunk)
+                result["errors"].append(str(e))
+                print(f"Failed to send {len(chunk)} records: {e}")
+
+        with ThreadPoolExecutor(max_workers=max(self.parallel, 1)) as pool:
+            while True:
+                chunk = list(itertools.islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                if len(in_flight) >= self.parallel:  # bounded, the directory is read as chunks complete
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done(future)
+                in_flight[pool.submit(self._post_chunk, chunk)] = chunk
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done(future)
+
+        result["seconds"] = round(time.perf_counter() - t0, 2)
+        print(f"Data sent to FastAPI: {result['sent']} records in {len(result['job_ids'])} insert jobs, "
+              f"{len(result['failed_ids'])} failed ({result['seconds']}s)")
+        return result
+
+
+    def similarity(self, liked_ids, disliked_ids, description=None):
+        payload = {"liked_ids": liked_ids, "disliked_ids": disliked_ids}
+        endpoint = self.similarity_endpoint
+        if description:
+            # text (+ likes) query
+            payload["description"] = description
+            endpoint = self.search_endpoint
         try:
-            response = requests.post(self.insert_endpoint, json=self.data)
+            response = self.session.post(endpoint, json=payload)
             if response.status_code == 200:
                 print("Data successfully sent to FastAPI")
+                return response.json()
             else:
                 print(f"Error: {response.status_code}, {response.text}")
         except Exception as e:
             print(f"Failed to send data: {e}")
 
 
-    def similarity(self, liked_ids, disliked_ids):
-        payload = {"liked_ids": liked_ids, "disliked_ids": disliked_ids}
+    def arts_data(self, ids, fields=None):
+        """metadata of many arts in one call, {id: {field: value}}"""
+        payload = {"ids": [int(art_id) for art_id in ids], "fields": fields}
         try:
-            response = requests.post(self.similarity_endpoint, json=payload)
+            response = self.session.post(self.arts_data_endpoint, json=payload)
             if response.status_code == 200:
-                print("Data successfully sent to FastAPI")
-                return response.json()
+                return {row["id"]: row for row in response.json()}
             else:
                 print(f"Error: {response.status_code}, {response.text}")
         except Exception as e:
             print(f"Failed to send data: {e}")
-
+        return {}
@@ -0,0 +1,175 @@
+"""
+padded thumbnails of the catalog images, built once and served by id from a memory-mapped atlas.
+
+the atlas is one [capacity, height, width, 3] uint8 .npy file plus a json index id -> (slot, source size,
+source mtime). a thumbnail is rebuilt only when its source image changed, so the store follows ingestion
+(new or re-downloaded images) without a full rebuild. the index is written after every save_every new
+thumbnails and on close(), a thumbnail missing from it is simply rebuilt. prebuild after an ingest with:
+
+    python gui/thumbnails.py --images-dir data
+"""
+import os
+import json
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageOps
+
+
+class ConfigThumbnails:
+    def __init__(self):
+        self.cache_dir = os.path.join('volumes', 'thumbnails')
+        self.image_size = (150, 150)
+        self.padding_color = (100, 100, 100)
+        self.workers = os.cpu_count() or 1
+        self.save_every = 100  # thumbnails built on demand by get() between two index writes
+
+
+class ThumbnailAtlas:
+
+    def __init__(self, config: ConfigThumbnails):
+        self.config = config
+        self.width, self.height = config.image_size
+        os.makedirs(config.cache_dir, exist_ok=True)
+        # the padding is baked into the pixels, another colour is another atlas
+        color = config.padding_color
+        color_tag = ''.join(f'{c:02x}' for c in color) if isinstance(color, (tuple, list)) else str(color)
+        size_tag = f'{self.width}x{self.height}_{color_tag}'
+        self.atlas_path = os.path.join(config.cache_dir, f'atlas_{size_tag}.npy')
+        self.index_path = os.path.join(config.cache_dir, f'index_{size_tag}.json')
+        self._lock = threading.Lock()
+        self._unsaved = 0  # index changes since the last save
+
+        self.index = {}  # id -> [slot, source size, source mtime_ns]
+        self.atlas = None
+        if os.path.exists(self.atlas_path) and os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+            self.atlas = np.load(self.atlas_path, mmap_mode='r+')
+        self._free = sorted(set(range(self._capacity())) - {entry[0] for entry in self.index.values()})
+
+    def _capacity(self) -> int:
+        return 0 if self.atlas is None else len(self.atlas)
+
+    def _grow(self, needed: int):
+        """
+        double the atlas file, the old slots are copied over.
+        get() only hands out copies, so self.atlas is the last reference to the old map: dropping it unmaps
+        the old file before it is replaced (windows refuses to replace a mapped file).
+        """
+        capacity = max(needed, 2 * self._capacity(), 256)
+        tmp = f'{self.atlas_path}.tmp.npy'
+        atlas = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8,
+                                          shape=(capacity, self.height, self.width, 3))
+        old, self.atlas = self.atlas, None
+        if old is not None:
+            atlas[:len(old)] = old
+            self._free.extend(range(len(old), capacity))
+            del old
+        else:
+            self._free.extend(range(capacity))
+        atlas.flush()
+        del atlas
+        os.replace(tmp, self.atlas_path)
+        self.atlas = np.load(self.atlas_path, mmap_mode='r+')
+
+    def render(self, source) -> np.ndarray:
+        """decode (at a reduced jpeg scale when possible) and pad to the thumbnail size"""
+        with Image.open(source) as img:
+            img.draft('RGB', (self.width, self.height))
+            img = ImageOps.pad(img.convert('RGB'), (self.width, self.height), color=self.config.padding_color)
+        return np.asarray(img, dtype=np.uint8)
+
+    @staticmethod
+    def _stamp(source) -> list[int]:
+        stat = os.stat(source)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _fresh(self, img_id: str, source) -> bool:
+        stamp = self._stamp(source)
+        with self._lock:
+            entry = self.index.get(img_id)
+            return entry is not None and entry[1:] == stamp
+
+    def _store(self, img_id: str, source, pixels: np.ndarray):
+        with self._lock:
+            entry = self.index.get(img_id)
+            if entry is None:
+                if not self._free:
+                    self._grow(self._capacity() + 1)
+                slot = self._free.pop(0)
+            else:
+                slot = entry[0]
+            self.atlas[slot] = pixels
+            self.index[img_id] = [slot, *self._stamp(source)]
+            self._unsaved += 1
+
+    def get(self, img_id, source) -> np.ndarray:
+        """
+        thumbnail of the image, built and stored first if missing or stale.
+        a copy, not a view: a view would keep the atlas mapped past a _grow and show another image once its
+        slot is reused.
+        """
+        img_id = str(img_id)
+        while True:
+            stamp = self._stamp(source)
+            with self._lock:
+                # checked and read under one lock hold, a discard can't slip in between
+                entry = self.index.get(img_id)
+                if entry is not None and entry[1:] == stamp:
+                    return self.atlas[entry[0]].copy()
+            # missing or stale (or discarded again before the read above): render outside the lock and store
+            self._store(img_id, source, self.render(source))
+            if self._unsaved >= self.config.save_every:
+                self.save()
+
+    def build(self, sources) -> int:
+        """(re)build the missing / stale thumbnails of many images on a thread pool, return how many were built"""
+        stale = [(Path(source).stem, source) for source in sources if not self._fresh(Path(source).stem, source)]
+        if not stale:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.config.workers) as pool:
+            for (img_id, source), pixels in zip(stale, pool.map(lambda item: self.render(item[1]), stale)):
+                self._store(img_id, source, pixels)
+        self.save()
+        return len(stale)
+
+    def discard(self, ids):
+        """forget deleted arts, their slots are reused"""
+        with self._lock:
+            for img_id in ids:
+                entry = self.index.pop(str(img_id), None)
+                if entry is not None:
+                    self._free.append(entry[0])
+                    self._unsaved += 1
+        self.save()
+
+    def save(self):
+        with self._lock:
+            if self.atlas is not None:
+                self.atlas.flush()
+            tmp = f'{self.index_path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp, self.index_path)
+            self._unsaved = 0
+
+    def close(self):
+        """write the index if get() built thumbnails since the last save"""
+        if self._unsaved:
+            self.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images-dir', default='data')
+    args = parser.parse_args()
+    atlas = ThumbnailAtlas(ConfigThumbnails())
+    built = atlas.build(sorted(Path(args.images_dir).glob('*.jpg')))
+    print(f'{built} thumbnails built, {len(atlas.index)} in {atlas.atlas_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,28 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from src.v1.art_matching import ArtMatching
 from src.v1.art_image import ArtImage
+from src.v1 import metrics
+from src.v1.compression import DecompressMiddleware
+from src.v1 import vector_transport
+from src.v1.vector_transport import EncodedVectors
+from src.db.filters import Filter
 from pathlib import Path
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal, Optional
 from urllib.parse import urlparse
+import os
+import logging
 
 from gui.gui_logic import GuiLogic
 
 
+# LOG_LEVEL=DEBUG also logs every search result
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 app = FastAPI()
+app.add_middleware(DecompressMiddleware)  # gzip / zstd request bodies of bulk insert clients
 art_matching = ArtMatching()
 gui_logic = GuiLogic()
 
@@ -18,32 +30,148 @@ gui_logic = GuiLogic()
 class SimilarityRequest(BaseModel):
     liked_ids: List[int]
     disliked_ids: List[int]
+    filters: List[Filter] = []  # e.g. [{"field": "width", "op": "<", "value": 80}], all must hold
+
+
+class TextSearchRequest(BaseModel):
+    description: str = ''
+    liked_ids: List[int] = []
+    disliked_ids: List[int] = []
+    top_n: int = 6
+    filters: List[Filter] = []
+
+
+class EmbeddingsRequest(BaseModel):
+    ids: List[int]
+    dtype: Literal['float32', 'float16'] = 'float32'
+
+
+class EmbeddingSearchRequest(BaseModel):
+    embeddings: EncodedVectors  # base64 [n, dim] query vectors
+    top_n: int = 6
+    filters: List[Filter] = []
+
+
+class ArtsDataRequest(BaseModel):
+    ids: List[int]
+    fields: Optional[List[str]] = None  # url, img_name, artist, size, tags, created_at (default: all)
 
 
 @app.post('/insert_arts')
-def insert_arts(images: list[ArtImage]) -> bool:
-    # should return bool
+def insert_arts(images: list[ArtImage]) -> dict:
+    # runs in the background, poll /insert_jobs/{job_id} for progress
+    for image in images:
+        image.url = str(Path(image.url).resolve())  # Normalize for all OS
+    return art_matching.submit_insert_arts(images)
+
+
+@app.get('/insert_jobs')
+def insert_jobs() -> list[dict]:
+    return art_matching.list_insert_jobs()
+
+
+@app.get('/insert_jobs/{job_id}')
+def insert_job_status(job_id: str) -> dict:
+    job = art_matching.get_insert_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f'unknown job {job_id}')
+    return job
+
+
+@app.post('/upsert_arts')
+def upsert_arts(images: list[ArtImage]) -> dict:
+    # like /insert_arts, existing ids are replaced
     for image in images:
         image.url = str(Path(image.url).resolve())  # Normalize for all OS
-    return art_matching.insert_arts(images)
+    return art_matching.submit_insert_arts(images, upsert=True)
 
 
 @app.post('/del_image')
-def del_image(image_id) -> bool:
-    return art_matching.del_image(image_id)
+def del_image(image_id: int) -> bool:
+    return art_matching.del_arts([image_id])
+
+
+@app.post('/delete_arts')
+def delete_arts(images_id: list[int]) -> bool:
+    return art_matching.del_arts(images_id)
 
 
 @app.post('/get_similar_arts')
 def get_similar_arts(data: SimilarityRequest):
     # should return list of ids
-    return art_matching.get_similar_arts(data)
+    try:
+        return art_matching.get_similar_arts(data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post('/search_arts')
+def search_arts(data: TextSearchRequest) -> list[int]:
+    # free text description, optionally steered by liked / disliked ids
+    try:
+        return art_matching.search_arts(data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.get('/ready')
+def ready():
+    # 503 until the embedding model is loaded, searches are served before that
+    readiness = art_matching.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness['ready'] else 503)
+
+
+@app.get('/metrics')
+def prometheus_metrics():
+    # stage latency histograms, batch sizes and cache hit counters in the prometheus text format
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/collection_stats')
+def collection_stats() -> dict:
+    return art_matching.collection_stats()
+
+
+@app.get('/cache_stats')
+def cache_stats() -> dict:
+    return art_matching.cache_stats()
 
 
 @app.post('/get_arts_data')
-def get_image_data(images_id):
-    return art_matching.get_arts_data(images_id)
+def get_image_data(data: ArtsDataRequest) -> list[dict]:
+    try:
+        return art_matching.get_arts_data(data.ids, data.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post('/get_embeddings')
+def get_embeddings(data: EmbeddingsRequest, request: Request):
+    # Accept: application/octet-stream -> int64 ids then the [n, dim] vectors as raw bytes, json otherwise
+    ids, vectors = art_matching.get_embeddings(data.ids)
+    if 'application/octet-stream' in request.headers.get('accept', ''):
+        body = ids.astype('<i8').tobytes() + vector_transport.to_bytes(vectors, data.dtype)
+        return Response(body, media_type='application/octet-stream',
+                        headers={'X-Count': str(len(ids)), 'X-Dim': str(vectors.shape[1]), 'X-Dtype': data.dtype})
+    return {'ids': ids.tolist(), 'embeddings': EncodedVectors.from_array(vectors, data.dtype).model_dump()}
+
+
+@app.post('/search_embeddings')
+async def search_embeddings(request: Request, top_n: int = 6, dtype: str = 'float32') -> list[list[int]]:
+    # json EmbeddingSearchRequest, or the raw query vectors as application/octet-stream (?top_n=&dtype=)
+    dim = art_matching.logic.db_api.config_db.img_embed_dim
+    body = await request.body()
+    try:
+        if request.headers.get('content-type', '').startswith('application/octet-stream'):
+            embeddings, filters = vector_transport.from_bytes(body, dim, dtype), []
+        else:
+            data = EmbeddingSearchRequest.model_validate_json(body)
+            embeddings, top_n, filters = data.embeddings.to_array(dim), data.top_n, data.filters
+        return await run_in_threadpool(art_matching.search_embeddings, embeddings, top_n, filters)
+    except ValueError as e:  # also pydantic's ValidationError
+        raise HTTPException(status_code=422, detail=str(e))
 
 
 @app.post('/local_insert')
 def local_insert():
-    gui_logic.insert()
+    return gui_logic.insert()
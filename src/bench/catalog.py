@@ -0,0 +1,30 @@
+import os
+import numpy as np
+from PIL import Image
+
+
+def random_unit_vectors(n: int, dim: int, seed: int = 0, n_clusters: int = 64) -> np.ndarray:
+    """clustered random unit vectors, closer to real embeddings than uniform noise (which has no neighbours)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_jpegs(n: int, out_dir: str, seed: int = 0, min_side: int = 400, max_side: int = 1200) -> list[str]:
+    """
+    n jpegs named {id}.jpg like the data folder, random sizes and aspect ratios (smooth color noise, so
+    jpeg decode costs about what a photo of a painting costs). files already there are reused.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for art_id in range(n):
+        width, height = rng.integers(min_side, max_side + 1, 2)
+        noise = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        path = os.path.join(out_dir, f'{art_id}.jpg')
+        if not os.path.exists(path):
+            img = Image.fromarray(noise).resize((int(width), int(height)), Image.Resampling.BICUBIC)
+            img.save(path, quality=85)
+        paths.append(path)
+    return paths
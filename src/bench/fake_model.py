@@ -0,0 +1,34 @@
+import hashlib
+import torch
+import numpy as np
+from src.v1.embed_model import EmbedModel
+
+
+class FakeEmbedModel(EmbedModel):
+    """
+    deterministic stand-in for ClipEmbed: the real EmbedModel.preprocessing (decode, resize, pad),
+    then a fixed random projection of the pooled pixels. same image -> same vector, no weights to download.
+    """
+    name = 'fake'
+    preprocess_version = 1
+
+    def __init__(self, dim: int = 768, seed: int = 0, pool: int = 8):
+        super().__init__()
+        self.dim = dim
+        self.pool = pool
+        self.input_shape = (3, 224, 224)
+        self.device = 'cpu'
+        rng = np.random.default_rng(seed)
+        self.projection = rng.standard_normal((3 * pool * pool, dim)).astype(np.float32)
+
+    def encode_imgs(self, imgs: torch.Tensor) -> np.ndarray:
+        pooled = torch.nn.functional.adaptive_avg_pool2d(imgs.float(), self.pool).flatten(1).numpy()
+        embeddings = (pooled - pooled.mean(axis=1, keepdims=True)) @ self.projection
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def predict_text(self, texts: list[str]) -> np.ndarray:
+        embeddings = np.stack([
+            np.random.default_rng(int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'little'))
+            .standard_normal(self.dim) for text in texts
+        ]).astype(np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
@@ -0,0 +1,192 @@
+"""
+offline benchmark of the pipeline stages, no CLIP weights and no milvus needed:
+a deterministic fake embedding model, synthetic jpegs / vectors and the in-process numpy backend.
+
+    python -m src.bench.run --n 20000 --images 256 --json bench.json
+
+every stage is timed on its own and the report is written as JSON, so runs can be diffed across releases.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+from src.bench.fake_model import FakeEmbedModel
+from src.bench.catalog import random_unit_vectors, synthetic_jpegs
+from src.db.db_api import DBApi, ConfigDB
+from src.db.numpy_manager import NumpyManager
+from src.v1.art_image import ArtImage, ArtBatch, GenArtImages
+from src.v1 import fusion
+
+
+def timed(fn, repeat: int, items: int = 1) -> dict:
+    """call fn `repeat` times, `items` is how many images / rows / queries one call handles"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times = np.asarray(times)
+    return {
+        'calls': repeat,
+        'items_per_call': items,
+        'total_s': round(float(times.sum()), 4),
+        'mean_ms': round(float(times.mean()) * 1000, 3),
+        'p50_ms': round(float(np.percentile(times, 50)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(times, 95)) * 1000, 3),
+        'items_per_s': round(items * repeat / float(times.sum()), 1) if times.sum() > 0 else None,
+    }
+
+
+def bench_config(**overrides):
+    """ConfigDB with overrides, for the managers that take their config as an argument"""
+    return type('BenchConfigDB', (ConfigDB,), overrides)
+
+
+def bench_preprocess(model: FakeEmbedModel, paths: list[str], batch_size: int, repeat: int) -> dict:
+    batches = [paths[i: i + batch_size] for i in range(0, len(paths), batch_size)]
+    return timed(lambda: [model.preprocessing(batch) for batch in batches], repeat, len(paths))
+
+
+def bench_gen_object(model: FakeEmbedModel, paths: list[str], batch_size: int, repeat: int) -> dict:
+    report = {}
+    for workers in sorted({0, os.cpu_count() or 1}):
+        gen = GenArtImages(model, batch_size, cache=None, num_workers=workers, prefetch=2 * max(workers, 1))
+
+        def run():
+            arts = [ArtImage(id=i, url=path, img_name=str(i), size=(0, 0)) for i, path in enumerate(paths)]
+            for _ in gen.gen_object(arts):
+                pass
+
+        report[f'workers_{workers}'] = timed(run, repeat, len(paths))
+    return report
+
+
+def bench_insert(vectors: np.ndarray, batch_size: int, repeat: int) -> dict:
+    # an in-memory numpy backend, set on this instance only
+    config_db = ConfigDB()
+    config_db.backend, config_db.numpy_dir, config_db.coalesce_window_ms = 'numpy', None, 0
+    config_db.img_embed_dim = vectors.shape[1]
+    db_api = DBApi(init=True, config_db=config_db)
+
+    def batches_of(first_id: int) -> list[ArtBatch]:
+        arts = [ArtImage(id=first_id + i, url=f'{i}.jpg', img_name=str(i), size=(60, 80), width=60.0, height=80.0,
+                         medium='קנבס') for i in range(len(vectors))]
+        # the ingest path: vectors stay in the encoder's array
+        return [ArtBatch(arts[i: i + batch_size], vectors[i: i + batch_size]) for i in range(0, len(arts), batch_size)]
+
+    # every repeat inserts new ids, re-using them would time the replace path
+    insert_rounds = iter([batches_of(r * len(vectors)) for r in range(repeat)])
+    batches = batches_of(0)
+    return {
+        'rows': timed(lambda: [db_api._rows(batch) for batch in batches], repeat, len(vectors)),
+        'insert_arts': timed(lambda: [db_api.insert_arts(batch) for batch in next(insert_rounds)], repeat, len(vectors)),
+    }
+
+
+def bench_search(vectors: np.ndarray, n_queries: int, top_k: int, repeat: int, seed: int,
+                 pq_subspaces: int = 96) -> tuple[dict, np.ndarray]:
+    """every numpy backend representation, single query and a batch. returns (report, liked / disliked rankings)"""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), n_queries, replace=False)]
+    ids = np.arange(len(vectors))
+    report, rankings = {}, None
+
+    for quantization in (None, 'float16', 'int8', 'pq'):
+        manager = NumpyManager(bench_config(numpy_dir=None, img_embed_dim=vectors.shape[1],
+                                            numpy_quantization=quantization, numpy_pq_subspaces=pq_subspaces),
+                               init=True)
+        manager.set([{'id': int(art_id), 'img_embedding': vector} for art_id, vector in zip(ids, vectors)])
+        manager.flush()
+        name = quantization or 'float32'
+        report[name] = {
+            'single': timed(lambda: manager.search(queries[:1], top_k=top_k), repeat, 1),
+            'batch': timed(lambda: manager.search(queries, top_k=top_k), repeat, n_queries),
+        }
+        if quantization is None:
+            rankings, _ = manager.search(queries, top_k=top_k)
+    return report, rankings
+
+
+def bench_fusion(rankings: np.ndarray, n_liked: int, repeat: int) -> dict:
+    liked, disliked = rankings[:n_liked], rankings[n_liked:]
+    liked_lists = [row[row >= 0].tolist() for row in liked]
+    disliked_lists = [row[row >= 0].tolist() for row in disliked]
+    report = {
+        # what Logic.borda_count runs for callers that pass ragged python lists
+        'borda_count': timed(lambda: fusion.fuse(fusion.pad_rankings(liked_lists),
+                                                 disliked_ids=fusion.pad_rankings(disliked_lists),
+                                                 n=None, method='borda'), repeat, len(rankings)),
+    }
+    scores = np.linspace(1, 0, rankings.shape[1], dtype=np.float32)[None].repeat(len(rankings), axis=0)
+    for method in fusion.FUSION_METHODS:
+        report[f'fuse_{method}'] = timed(lambda: fusion.fuse(liked, scores[:n_liked], disliked, scores[n_liked:],
+                                                             n=6, method=method), repeat, len(rankings))
+    return report
+
+
+def environment() -> dict:
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = None
+    import torch
+    return {
+        'git_rev': rev or None,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, default=20_000, help='catalog size for insert / search / fusion')
+    parser.add_argument('--images', type=int, default=256, help='synthetic jpegs for preprocess / gen_object')
+    parser.add_argument('--images-dir', default='volumes/bench/images')
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--batch-size', type=int, default=16, help='encode batch size')
+    parser.add_argument('--insert-batch-size', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=8, help='query vectors in a batched search')
+    parser.add_argument('--top-k', type=int, default=1000)
+    parser.add_argument('--liked', type=int, default=5, help='of the queries, how many are likes in fusion')
+    parser.add_argument('--pq-subspaces', type=int, default=96, help='must divide --dim')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', default=['preprocess', 'gen_object', 'insert', 'search', 'fusion'])
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    model = FakeEmbedModel(dim=args.dim, seed=args.seed)
+    vectors = random_unit_vectors(args.n, args.dim, seed=args.seed)
+    paths = synthetic_jpegs(args.images, args.images_dir, seed=args.seed) \
+        if {'preprocess', 'gen_object'} & set(args.stages) else []
+
+    report = {'config': vars(args), 'environment': environment(), 'stages': {}}
+    stages = report['stages']
+    if 'preprocess' in args.stages:
+        stages['preprocess'] = bench_preprocess(model, paths, args.batch_size, args.repeat)
+    if 'gen_object' in args.stages:
+        stages['gen_object'] = bench_gen_object(model, paths, args.batch_size, args.repeat)
+    if 'insert' in args.stages:
+        stages['insert'] = bench_insert(vectors, args.insert_batch_size, args.repeat)
+    if 'search' in args.stages or 'fusion' in args.stages:
+        search, rankings = bench_search(vectors, args.queries, args.top_k, args.repeat, args.seed, args.pq_subspaces)
+        if 'search' in args.stages:
+            stages['search'] = search
+        if 'fusion' in args.stages:
+            stages['fusion'] = bench_fusion(rankings, min(args.liked, args.queries), args.repeat)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
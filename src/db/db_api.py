@@ -1,58 +1,273 @@
-from src.v1.art_image import ArtImage
-from src.db.db_manager import DBManager
+from src.v1.art_image import ArtImage, ArtBatch
+from src.db import filters as search_filters
+from src.db.search_batcher import SearchBatcher
+from src.db.tombstones import Tombstones
+from src.db.metadata_store import MetadataStore
+import os
+import ast
+import logging
+import threading
+import numpy as np
+from src.v1 import metrics
+
+logger = logging.getLogger(__name__)
 
 class ConfigDB:
     img_embed_dim = 768
     prompt_embed_dim = 2
-    collection_name = 'v1'
+    use_prompt_embedding = False  # the placeholder prompt_embedding field (and its index) only exists when True
+    collection_name = 'v2'  # typed scalar schema, 'v1' collections have size / tags serialized as strings
     db_name = 'db.db'
     host = "localhost"
     port = 19530
+    backend = 'milvus'  # 'milvus' | 'numpy' (in-process exact search, no milvus server needed)
+    numpy_dir = 'volumes/numpy'  # where the numpy backend persists its matrix, None keeps it in memory only
+    numpy_mmap = None  # keep the float32 rows in a memory map of their file, None: only when quantized
+    numpy_save_delay_s = 5  # inserts are written to disk at most this long after a flush, 0 saves on every flush
+    numpy_quantization = None  # None (exact float32) | 'float16' | 'int8' | 'pq', see src/db/quantization.py
+    numpy_rerank_k = 256  # candidates from the compressed codes re-ranked with exact float32 scores
+    numpy_pq_subspaces = 96  # pq code bytes per vector, must divide img_embed_dim
+    numpy_codec_sample = 100_000  # rows the codec is fitted on, a random sample of the collection
+    vector_cache_size = 10_000  # id -> img_embedding cache used to build query vectors (milvus backend)
+    coalesce_window_ms = 2  # gather concurrent searches for up to this long into one search, 0 disables
+    coalesce_max_batch = 64  # ... or until this many query vectors are waiting
+    delete_batch_size = 1000  # ids per delete call
+    compact_delay_s = 30  # compact this long after the last delete, so a burst of deletes compacts once
 
 
 class DBApi:
 
-    def __init__(self, init: bool):
-        self.config_db = ConfigDB()
-        self.db_manager = DBManager(config=self.config_db, init=init)
+    def __init__(self, init: bool, config_db: ConfigDB | None = None):
+        self.config_db = config_db or ConfigDB()
+        if self.config_db.backend == 'numpy':
+            from src.db.numpy_manager import NumpyManager
+            self.db_manager = NumpyManager(config=self.config_db, init=init)
+        else:
+            from src.db.db_manager import DBManager
+            self.db_manager = DBManager(config=self.config_db, init=init)
+
+        if self.config_db.coalesce_window_ms > 0:
+            # wrap the instance's search so every path (search_by_ids, get_similarity_*) is coalesced
+            self.search_batcher = SearchBatcher(self.db_manager.search, self.config_db.coalesce_window_ms,
+                                                self.config_db.coalesce_max_batch)
+            self.db_manager.search = self.search_batcher.search
+
+        # deleted ids are masked out of search results right away, compaction purges them later
+        self.tombstones = Tombstones()
+        self._compact_timer = None
+        self._compact_lock = threading.Lock()
+
+        # url / name / artist / size / tags served from memory, kept in sync on insert and delete
+        self.metadata = MetadataStore()
+        if init:
+            self._remove_metadata()
+        else:
+            self._load_metadata()
+
+    @property
+    def _metadata_path(self) -> str | None:
+        if self.config_db.backend != 'numpy' or self.config_db.numpy_dir is None:
+            return None
+        return os.path.join(self.config_db.numpy_dir, f'{self.config_db.collection_name}_metadata.json')
+
+    def _remove_metadata(self):
+        # a file left by the dropped collection would be loaded back on the next warm start
+        if self._metadata_path is not None:
+            for path in (self._metadata_path, f'{self._metadata_path}.tmp'):
+                if os.path.exists(path):
+                    os.remove(path)
 
-    def insert_arts(self, arts: list[ArtImage]):
-        # process ArtImage to match the db
-        batch = []
-        for art in arts:
-            batch.append({
+    def _load_metadata(self):
+        if self.config_db.backend == 'numpy':
+            # the numpy backend only keeps vectors, the metadata has its own file next to them
+            if self._metadata_path is not None:
+                self.metadata.load(self._metadata_path)
+            return
+        rows = self.db_manager.scan(["id", *self.metadata.fields])
+        self.metadata.upsert([{
+            **row,
+            "size": list(ast.literal_eval(row["size"])) if row.get("size") else None,
+            "tags": row["tags"].split(',') if row.get("tags") else [],
+        } for row in rows])
+        logger.info("metadata store loaded: %d arts", len(self.metadata))
+
+    @staticmethod
+    def _metadata_rows(arts: list[ArtImage]) -> list[dict]:
+        return [{
+            "id": art.id,
+            "url": art.url,
+            "img_name": art.img_name,
+            "artist": art.artist,
+            "size": list(art.size),
+            "tags": list(art.tags or []),
+            "created_at": str(art.created_at),
+            "width": art.width,
+            "height": art.height,
+            "depth": art.depth,
+            "technique": art.technique,
+            "medium": art.medium,
+            "style": art.style,
+        } for art in arts]
+
+    def _rows(self, batch: ArtBatch) -> list[dict]:
+        # process ArtImage to match the db, the vectors are rows (views) of the batch array
+        rows = []
+        for i, art in enumerate(batch.arts):
+            row = {
                 "id": art.id,
                 "url": art.url,
                 "img_name": art.img_name,
-                "img_embedding": art.img_embeddings,
+                "img_embedding": batch.img_embeddings[i],
                 "created_at": str(art.created_at),
-                "prompt": art.prompt or "",
-                "prompt_embedding": art.prompt_embeddings or [0, 0],
-                "artist": art.artist or "",
+                "prompt": batch.prompts[i] or "",
                 "size": str(art.size),
                 "extracted_features": str(art.extracted_features) or "",
                 "tags": ','.join(art.tags or ''),
-            })
+                # typed filter fields, missing numbers are null and missing text is ''
+                "width": art.width,
+                "height": art.height,
+                "depth": art.depth,
+                "artist": art.artist or "",
+                "technique": art.technique or "",
+                "medium": art.medium or "",
+                "style": art.style or "",
+            }
+            if self.config_db.use_prompt_embedding:
+                row["prompt_embedding"] = batch.prompt_embeddings[i] if batch.prompt_embeddings is not None \
+                    else [0] * self.config_db.prompt_embed_dim
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _columns(batch: ArtBatch) -> dict:
+        """filter field -> values of the batch, for backends that take whole columns"""
+        return {field: [getattr(art, field) for art in batch.arts] for field in search_filters.FILTER_FIELDS}
 
-        self.db_manager.set(batch)
+    def _write(self, batch: ArtBatch, upsert: bool):
+        with metrics.stage('db_insert'):
+            if hasattr(self.db_manager, 'set_columns'):
+                # the numpy backend takes the batch array as is, set replaces existing ids
+                self.db_manager.set_columns(batch.ids, batch.img_embeddings, self._columns(batch))
+            elif upsert:
+                self.db_manager.upsert(self._rows(batch))
+            else:
+                self.db_manager.set(self._rows(batch))
+        metrics.batch_size.observe(len(batch), kind='insert')
+        self.metadata.upsert(self._metadata_rows(batch.arts))
+
+    def insert_arts(self, arts: ArtBatch | list[ArtImage]):
+        batch = ArtBatch.of(arts)
+        self._write(batch, upsert=False)
+        self.tombstones.remove(art.id for art in batch.arts)  # a deleted id inserted again is visible
+
+    def upsert_arts(self, arts: ArtBatch | list[ArtImage]):
+        """insert or replace by id, a previously deleted id becomes visible again"""
+        batch = ArtBatch.of(arts)
+        self._write(batch, upsert=True)
+        self.tombstones.remove(art.id for art in batch.arts)
 
     def index(self):
         self.db_manager.index()
 
-    def delete_arts(self, arts_ids):
-        pass
+    def flush(self):
+        self.db_manager.flush()
+        if self._metadata_path is not None:
+            self.metadata.save(self._metadata_path)
+
+    def stats(self) -> dict:
+        return {'collection': self.config_db.collection_name, 'backend': self.config_db.backend,
+                'arts': len(self.metadata)}
+
+    def startup_timings(self) -> dict:
+        return dict(self.db_manager.timings)
+
+    def delete_arts(self, arts_ids: list[int]):
+        arts_ids = list(dict.fromkeys(int(art_id) for art_id in arts_ids))
+        self.tombstones.add(arts_ids)
+        self.metadata.delete(arts_ids)
+        batch_size = self.config_db.delete_batch_size
+        for i in range(0, len(arts_ids), batch_size):
+            self.db_manager.delete(arts_ids[i: i + batch_size])
+        if self._metadata_path is not None:
+            self.metadata.save(self._metadata_path)  # durable now, not only after the compaction
+        self._schedule_compaction()
+
+    def _schedule_compaction(self):
+        with self._compact_lock:
+            if self._compact_timer is not None:
+                self._compact_timer.cancel()
+            self._compact_timer = threading.Timer(self.config_db.compact_delay_s, self.compact)
+            self._compact_timer.daemon = True
+            self._compact_timer.start()
 
-    def get_arts_data(self, arts_ids: list):
-        pass
+    def compact(self):
+        """purge deleted rows in the backend, then forget their tombstones"""
+        compacted = self.tombstones.ids()
+        try:
+            self.db_manager.compact()
+        except Exception as e:
+            logger.warning("compaction failed, tombstones are kept: %s", e)
+            return
+        self.tombstones.remove(compacted)
+        if self._metadata_path is not None:
+            self.metadata.save(self._metadata_path)
+
+    def get_arts_data(self, arts_ids: list[int], fields: list[str] | None = None) -> list[dict]:
+        """metadata of many arts at once from the in-memory store, only the requested fields"""
+        return self.metadata.get(arts_ids, fields)
 
     def get_similar_arts(self, arts: list[ArtImage] | list[int], top_k: int):
         """or list of art object, or list pf ids"""
         if isinstance(arts[0], ArtImage):
-            arts_embeddings = [arts.img_embeddings for art in arts]
+            arts_embeddings = [art.img_embeddings for art in arts]
             arts = self.db_manager.get_similarity_by_embeddings(arts_embeddings)
             return arts
         elif isinstance(arts[0], int):
             arts = self.db_manager.get_similarity_by_ids(arts)
             return arts
 
-        
\ No newline at end of file
+    def get_similar_arts_by_ids(self, liked_ids: list[int], disliked_ids: list[int], top_k: int, filters=()):
+        """
+        liked and disliked ids go to the db in one batched search.
+        return ((liked_ids, liked_scores), (disliked_ids, disliked_scores)), each an array of shape [n, top_k]
+        aligned with the input ids and padded with id -1 / score -inf.
+        """
+        ids, scores = self.search_by_ids(list(liked_ids) + list(disliked_ids), top_k=top_k, filters=filters)
+        n_liked = len(liked_ids)
+        return (ids[:n_liked], scores[:n_liked]), (ids[n_liked:], scores[n_liked:])
+
+    def search_by_ids(self, ids: list[int], top_k: int, filters=()):
+        """
+        top_k (ids, scores) rows for every id in one search, rows aligned with ids and padded with -1 / -inf.
+        filters (normalized, see src/db/filters.py) are applied by the backend during the search.
+        """
+        # over-fetch by the number of tombstones so masking deleted hits still leaves top_k
+        fetch_k = top_k + min(len(self.tombstones), top_k)
+        found_ids, found_scores = self.db_manager.search_by_ids(ids, top_k=fetch_k, filters=filters)
+        found_ids[self.tombstones.mask(ids)] = -1  # a deleted query id has no neighbours
+        return self.drop_deleted(found_ids, found_scores, top_k)
+
+    def get_vectors(self, ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """(found_ids, img_embedding vectors) of the ids that exist and aren't deleted"""
+        found_ids, vectors = self.db_manager.get_vectors(ids)
+        alive = ~self.tombstones.mask(found_ids)
+        return found_ids[alive], vectors[alive]
+
+    def search_embeddings(self, embeddings, top_k: int, filters=()):
+        """top_k (ids, scores) rows for every query vector in one search, deleted ids masked out"""
+        fetch_k = top_k + min(len(self.tombstones), top_k)
+        found_ids, found_scores = self.db_manager.search(np.asarray(embeddings, dtype=np.float32), top_k=fetch_k,
+                                                         filters=filters)
+        return self.drop_deleted(found_ids, found_scores, top_k)
+
+    def drop_deleted(self, ids: np.ndarray, scores: np.ndarray, top_k: int):
+        """move deleted ids out of each row (keeping the order of the rest) and cut the rows to top_k"""
+        dead = self.tombstones.mask(ids) | (ids < 0)
+        if not dead.any():
+            return ids[:, :top_k], scores[:, :top_k]
+        order = np.argsort(dead, axis=1, kind='stable')  # alive cells first, original order kept
+        ids = np.take_along_axis(ids, order, axis=1)[:, :top_k]
+        scores = np.take_along_axis(scores, order, axis=1)[:, :top_k]
+        dead = np.take_along_axis(dead, order, axis=1)[:, :top_k]
+        ids[dead], scores[dead] = -1, -np.inf
+        return ids, scores
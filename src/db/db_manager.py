@@ -1,6 +1,13 @@
+import time
+import logging
 import numpy as np
 from pymilvus import connections
 from pymilvus import MilvusClient, DataType, Collection, FieldSchema, CollectionSchema, utility
+from src.db.vector_cache import VectorCache, stack_vectors
+from src.db import filters as search_filters
+from src.v1 import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class DBManager:
@@ -9,13 +16,29 @@ class DBManager:
         self.config = config
         self.img_embed_dim = config.img_embed_dim
         self.prompt_embed_dim = config.prompt_embed_dim
+        self.use_prompt_embedding = config.use_prompt_embedding
         self.collection_name = config.collection_name
+        self.vector_cache = VectorCache(config.img_embed_dim, config.vector_cache_size)
+        self.timings = {}  # startup phase -> seconds
+
+        t0 = time.perf_counter()
         self.conn = connections.connect(alias="default", host=config.host, port=config.port)
         # self.client = MilvusClient(config.db_name)
-        if init:
+        self.timings['connect'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        if init or not utility.has_collection(self.collection_name):
             self._create_collection()
         else:
+            # warm start, keep the data
             self.collection = Collection(name=self.collection_name)
+            missing = set(search_filters.FILTER_FIELDS) - self._field_names()
+            if missing:
+                raise RuntimeError(f"collection {self.collection_name} has the old untyped schema (no {sorted(missing)}), "
+                                   f"start with init=True or point ConfigDB.collection_name at a new collection")
+            logger.info("Collection %s attached (%d entities)", self.collection_name, self.collection.num_entities)
+        self.timings['collection'] = time.perf_counter() - t0
+
         self.index()
 
 
@@ -31,19 +54,44 @@ class DBManager:
             FieldSchema(name="url", dtype=DataType.VARCHAR, max_length=64000),
             FieldSchema(name="created_at", dtype=DataType.VARCHAR, max_length=64000),
             FieldSchema(name="prompt", dtype=DataType.VARCHAR, max_length=64000),
-            FieldSchema(name="prompt_embedding", dtype=DataType.FLOAT_VECTOR, dim=self.prompt_embed_dim),
             FieldSchema(name="extracted_features", dtype=DataType.VARCHAR, max_length=64000),
-            FieldSchema(name='artist', dtype=DataType.VARCHAR, max_length=64000),
             FieldSchema(name='tags', dtype=DataType.VARCHAR, max_length=64000),
             FieldSchema(name='size', dtype=DataType.VARCHAR, max_length=64000),
+            # typed fields, filters on them are pushed down into the vector search
+            FieldSchema(name='width', dtype=DataType.FLOAT, nullable=True),
+            FieldSchema(name='height', dtype=DataType.FLOAT, nullable=True),
+            FieldSchema(name='depth', dtype=DataType.FLOAT, nullable=True),
+            FieldSchema(name='artist', dtype=DataType.VARCHAR, max_length=512),
+            FieldSchema(name='technique', dtype=DataType.VARCHAR, max_length=512),
+            FieldSchema(name='medium', dtype=DataType.VARCHAR, max_length=512),
+            FieldSchema(name='style', dtype=DataType.VARCHAR, max_length=512),
         ]
+        if self.use_prompt_embedding:
+            fields.append(FieldSchema(name="prompt_embedding", dtype=DataType.FLOAT_VECTOR, dim=self.prompt_embed_dim))
 
         schema = CollectionSchema(fields, description="Art Matching Collection")
 
         self.collection = Collection(name=self.collection_name, schema=schema)
-        print(f"Collection {self.collection_name} created!")
+        logger.info("Collection %s created!", self.collection_name)
+
+    def _field_names(self) -> set[str]:
+        return {field.name for field in self.collection.schema.fields}
+
+    def _ensure_index(self, field_name: str, index_params: dict):
+        """create the index unless a compatible one (same metric and type) already exists, e.g. on a warm start"""
+        for index in self.collection.indexes:
+            if index.field_name != field_name:
+                continue
+            if (index.params.get("metric_type") == index_params.get("metric_type")
+                    and index.params.get("index_type") == index_params["index_type"]):
+                return
+            # incompatible index on the field, it must be dropped before building the new one
+            self.collection.release()
+            self.collection.drop_index(index_name=index.index_name)
+        self.collection.create_index(field_name=field_name, index_params=index_params)
 
     def index(self):
+        t0 = time.perf_counter()
 
         # Create index for the first embedding field
         index_params_1 = {
@@ -51,36 +99,95 @@ class DBManager:
             "index_type": "AUTOINDEX",
             "params": {}
         }
-        self.collection.create_index(
-            field_name="img_embedding",  # Your first embedding field
-            index_params=index_params_1
-        )
-
-        # Create index for the second embedding field
-        index_params_2 = {
-            "metric_type": "COSINE",  # Can use different metric type if needed
-            "index_type": "AUTOINDEX", 
-            "params": {}
-        }
-        self.collection.create_index(
-            field_name="prompt_embedding",  # Your second embedding field
-            index_params=index_params_2
-        )
+        self._ensure_index("img_embedding", index_params_1)  # Your first embedding field
+
+        # every vector field needs an index before load, the placeholder prompt_embedding only exists when enabled
+        # (or in a collection created before it became optional)
+        if "prompt_embedding" in self._field_names():
+            index_params_2 = {
+                "metric_type": "COSINE",  # Can use different metric type if needed
+                "index_type": "AUTOINDEX",
+                "params": {}
+            }
+            self._ensure_index("prompt_embedding", index_params_2)  # Your second embedding field
+
+        # inverted indexes on the filter fields, so a filtered search doesn't scan the scalar columns
+        for field_name in search_filters.FILTER_FIELDS:
+            self._ensure_index(field_name, {"index_type": "INVERTED"})
+        self.timings['index'] = time.perf_counter() - t0
 
         # Load the collection to use both indexes
+        t0 = time.perf_counter()
         self.collection.load()
+        self.timings['load'] = time.perf_counter() - t0
 
     def set(self, batch):
         self.collection.insert(data=batch)
+        self.vector_cache.discard(row["id"] for row in batch)
 
-    def delete(self, ids):
-        self.collection.delete(ids=ids)
+    def flush(self):
+        self.collection.flush()
 
-    def get_similarity_by_embeddings(self, embeddings: list[list[float]], anns_field="img_embedding", top_k=1000): 
+    def upsert(self, batch):
+        self.collection.upsert(data=batch)
+        self.vector_cache.discard(row["id"] for row in batch)
+
+    def delete(self, ids):
+        id_list = ", ".join(str(int(art_id)) for art_id in ids)
+        self.collection.delete(expr=f"id in [{id_list}]")
+        self.vector_cache.discard(ids)
+
+    def compact(self):
+        """merge segments and purge the deleted rows (milvus only marks them deleted)"""
+        self.collection.compact()
+        self.collection.wait_for_compaction_completed()
+
+    def scan(self, output_fields: list[str], batch_size: int = 1000):
+        """iterate over every row of the collection (only output_fields), used to warm the metadata store"""
+        iterator = self.collection.query_iterator(batch_size=batch_size, expr="id >= 0", output_fields=output_fields)
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            iterator.close()
+
+    def get_vectors(self, ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
         """
-        Return the top_k vectors in the db that are most similar to the given embeddings.
+        Return (ids, vectors) for the given ids that exist in the collection.
+        vectors come from the local id->vector cache, only the misses are fetched from milvus (one query).
+        """
+        unique = list(dict.fromkeys(ids))
+        found = self.vector_cache.get_many(unique)
+        missing = [art_id for art_id in unique if art_id not in found]
+        metrics.cache_lookup('vector', len(found), len(missing))
+        if missing:
+            id_list = ", ".join(str(art_id) for art_id in missing)
+            with metrics.stage('vector_fetch'):
+                entities = self.collection.query(
+                    expr=f"id in [{id_list}]",
+                    output_fields=["id", "img_embedding"]
+                )
+            fetched = {entity["id"]: entity["img_embedding"] for entity in entities}
+            self.vector_cache.put_many(fetched)
+            found.update(fetched)  # returned even when the cache can't hold them all
+
+        return stack_vectors(unique, found, self.img_embed_dim)
+
+    def search(self, embeddings, anns_field="img_embedding", top_k=1000, filters=()) -> tuple[np.ndarray, np.ndarray]:
+        """
+        One batched search for all the query vectors.
+        Return (ids, scores) arrays of shape [n_queries, top_k], rows padded with id -1 and score -inf
+        when the collection holds fewer than top_k vectors.
+        filters (normalized, see src/db/filters.py) become the search expr, milvus filters during the ann search.
         """
         top_k = top_k if top_k is not None else 1
+        out_ids = np.full((len(embeddings), top_k), -1, dtype=np.int64)
+        out_scores = np.full((len(embeddings), top_k), -np.inf, dtype=np.float32)
+        if len(embeddings) == 0:
+            return out_ids, out_scores
 
         # Define search parameters
         search_params = {
@@ -89,46 +196,51 @@ class DBManager:
         }
 
         # Perform the search in Milvus
-        results = self.collection.search(
-            data=embeddings,  # The query vectors
-            anns_field=anns_field,  # The field to search in
-            param=search_params,  # The search parameter dictionary
-            limit=top_k,  # Number of top results to return
-            output_fields=['id']  # Fields to return (e.g., 'id', 'url', etc.)
-        )
-
-        # Extract the relevant search results (i.e., IDs of matching vectors)
-        output = []
-        for result in results:
-            output.append([hit.entity.get('id') for hit in result])
+        metrics.batch_size.observe(len(embeddings), kind='search')
+        with metrics.stage('ann_search'):
+            results = self.collection.search(
+                data=np.asarray(embeddings, dtype=np.float32).tolist(),  # The query vectors
+                anns_field=anns_field,  # The field to search in
+                param=search_params,  # The search parameter dictionary
+                limit=top_k,  # Number of top results to return
+                expr=search_filters.to_expr(filters) or None,
+            )
 
-        return output
+        for row, hits in enumerate(results):
+            out_ids[row, :len(hits)] = hits.ids
+            out_scores[row, :len(hits)] = hits.distances  # COSINE: higher is more similar
 
-    
+        return out_ids, out_scores
 
-    def get_similarity_by_ids(self, ids: list[int], top_k=1000):
+    def search_by_ids(self, ids: list[int], top_k=1000, filters=()) -> tuple[np.ndarray, np.ndarray]:
         """
-        Given a list of IDs, retrieve their embeddings from Milvus and return the top_k most similar vectors' IDs.
+        Top_k neighbours of every id in a single search. rows are aligned with `ids`,
+        ids that are not in the collection get an all padding row.
         """
-        top_k = top_k if top_k is not None else 1
+        found_ids, vectors = self.get_vectors(ids)
+        hit_ids, hit_scores = self.search(vectors, top_k=top_k, filters=filters)
+
+        out_ids = np.full((len(ids), top_k), -1, dtype=np.int64)
+        out_scores = np.full((len(ids), top_k), -np.inf, dtype=np.float32)
+        row_of = {int(art_id): row for row, art_id in enumerate(found_ids)}
+        for row, art_id in enumerate(ids):
+            if art_id in row_of:
+                out_ids[row] = hit_ids[row_of[art_id]]
+                out_scores[row] = hit_scores[row_of[art_id]]
+        return out_ids, out_scores
 
-        # Step 1: Retrieve embeddings of the given IDs
-        id_list = ", ".join(str(id) for id in ids)
-        print(id_list)
-        if id_list:
-            entities = self.collection.query(
-                expr=f"id in [{id_list}]",
-                output_fields=["img_embedding"]
-            )
-        else:
-            entities = []
-        
-        print(entities, 'ent')
+    def get_similarity_by_embeddings(self, embeddings: list[list[float]], anns_field="img_embedding", top_k=1000): 
+        """
+        Return the top_k vectors in the db that are most similar to the given embeddings.
+        """
+        ids, _ = self.search(embeddings, anns_field=anns_field, top_k=top_k)
+        return [row[row >= 0].tolist() for row in ids]
 
-        if not entities:
+    def get_similarity_by_ids(self, ids: list[int], top_k=1000):
+        """
+        Given a list of IDs, retrieve their embeddings and return the top_k most similar vectors' IDs.
+        """
+        found_ids, vectors = self.get_vectors(ids)
+        if len(found_ids) == 0:
             return []  # If no embeddings are found, return empty list
-
-        # Extract embeddings
-        embeddings = [entity["img_embedding"] for entity in entities]
-
-        return self.get_similarity_by_embeddings(embeddings=embeddings, top_k=top_k)
\ No newline at end of file
+        return self.get_similarity_by_embeddings(embeddings=vectors, top_k=top_k)
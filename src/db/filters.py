@@ -0,0 +1,98 @@
+import json
+import numpy as np
+from pydantic import BaseModel
+from typing import List, Literal, Union
+
+# typed scalar fields that searches can be filtered on, field -> 'number' | 'text'
+FILTER_FIELDS = {
+    'width': 'number',
+    'height': 'number',
+    'depth': 'number',
+    'technique': 'text',
+    'medium': 'text',
+    'style': 'text',
+    'artist': 'text',
+}
+FILTER_OPS = ('==', '!=', '<', '<=', '>', '>=', 'in', 'not in')
+
+
+class Filter(BaseModel):
+    """one predicate, e.g. {"field": "medium", "op": "==", "value": "קנבס"} or {"field": "width", "op": "<", "value": 80}"""
+    field: Literal['width', 'height', 'depth', 'technique', 'medium', 'style', 'artist']
+    op: Literal['==', '!=', '<', '<=', '>', '>=', 'in', 'not in']
+    value: Union[float, str, List[float], List[str]]
+
+
+def normalize(filters) -> tuple:
+    """
+    canonical hashable form of the predicates (sorted tuple of (field, op, value)), used as cache / batch key.
+    raises ValueError on a value that doesn't match the field type or the op.
+    """
+    out = []
+    for f in filters or ():
+        field, op, value = (f.field, f.op, f.value) if isinstance(f, Filter) else tuple(f)
+        kind = FILTER_FIELDS.get(field)
+        if kind is None:
+            raise ValueError(f'unknown filter field {field!r}, available: {list(FILTER_FIELDS)}')
+        if op not in FILTER_OPS:
+            raise ValueError(f'unknown filter op {op!r}, available: {FILTER_OPS}')
+        values = list(value) if isinstance(value, (list, tuple)) else [value]
+        if (op in ('in', 'not in')) != isinstance(value, (list, tuple)):
+            raise ValueError(f'{field} {op}: "in" / "not in" take a list, the other ops a single value')
+        if kind == 'number':
+            try:
+                values = [float(v) for v in values]
+            except (TypeError, ValueError):
+                raise ValueError(f'{field} is numeric, got: {value!r}')
+        else:
+            if op in ('<', '<=', '>', '>='):
+                raise ValueError(f'{field} is text, only ==, !=, in, not in are supported')
+            values = [str(v) for v in values]
+        out.append((field, op, tuple(values) if op in ('in', 'not in') else values[0]))
+    return tuple(sorted(out, key=repr))
+
+
+def _literal(value) -> str:
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, str) else repr(float(value))
+
+
+def to_expr(filters: tuple) -> str:
+    """milvus boolean expression of normalized filters, '' when there is nothing to filter"""
+    terms = []
+    for field, op, value in filters:
+        if op in ('in', 'not in'):
+            terms.append(f"{field} {op} [{', '.join(_literal(v) for v in value)}]")
+        else:
+            terms.append(f"{field} {op} {_literal(value)}")
+    return ' and '.join(terms)
+
+
+def mask(filters: tuple, columns: dict[str, np.ndarray]) -> np.ndarray | None:
+    """
+    bool array, True where a row passes every filter. numeric columns are float with nan for missing
+    (missing never passes, like a milvus null), text columns are object arrays with '' for missing.
+    None when there is nothing to filter.
+    """
+    out = None
+    for field, op, value in filters:
+        column = columns[field]
+        if op == 'in':
+            passed = np.isin(column, list(value))
+        elif op == 'not in':
+            passed = ~np.isin(column, list(value))
+        elif op == '==':
+            passed = column == value
+        elif op == '!=':
+            passed = column != value
+        elif op == '<':
+            passed = column < value
+        elif op == '<=':
+            passed = column <= value
+        elif op == '>':
+            passed = column > value
+        else:
+            passed = column >= value
+        if FILTER_FIELDS[field] == 'number':
+            passed &= ~np.isnan(column)
+        out = passed if out is None else out & passed
+    return out
@@ -0,0 +1,106 @@
+import os
+import json
+import threading
+import numpy as np
+
+
+class MetadataStore:
+    """
+    Columnar in-memory copy of the scalar fields, one array per field plus an id -> row index,
+    so a page of results is served with a few fancy-index gathers instead of a db query.
+    """
+
+    fields = ('url', 'img_name', 'artist', 'size', 'tags', 'created_at',
+              'width', 'height', 'depth', 'technique', 'medium', 'style')
+
+    def __init__(self, fields: tuple[str, ...] | None = None):
+        self.fields = tuple(fields or self.fields)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._columns = {field: np.empty(0, dtype=object) for field in self.fields}
+        self._size = 0
+        self._row_of = {}  # id -> row
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, art_id):
+        return art_id in self._row_of
+
+    def _reserve(self, extra: int):
+        needed = self._size + extra
+        if needed <= len(self._ids):
+            return
+        capacity = max(needed, 2 * len(self._ids), 1024)
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._ids = ids
+        for field, column in self._columns.items():
+            grown = np.empty(capacity, dtype=object)
+            grown[:self._size] = column[:self._size]
+            self._columns[field] = grown
+
+    def upsert(self, rows: list[dict]):
+        """rows are dicts with an 'id' and any of the store fields, existing ids are replaced"""
+        with self._lock:
+            self._reserve(len(rows))
+            for row in rows:
+                art_id = int(row['id'])
+                idx = self._row_of.get(art_id)
+                if idx is None:
+                    idx = self._size
+                    self._size += 1
+                    self._row_of[art_id] = idx
+                    self._ids[idx] = art_id
+                for field, column in self._columns.items():
+                    column[idx] = row.get(field)
+
+    def delete(self, ids):
+        with self._lock:
+            for art_id in ids:
+                idx = self._row_of.pop(int(art_id), None)
+                if idx is None:
+                    continue
+                # swap the last row into the hole
+                last = self._size - 1
+                if idx != last:
+                    self._ids[idx] = self._ids[last]
+                    for column in self._columns.values():
+                        column[idx] = column[last]
+                    self._row_of[int(self._ids[idx])] = idx
+                for column in self._columns.values():
+                    column[last] = None
+                self._size -= 1
+
+    def get(self, ids: list[int], fields: list[str] | None = None) -> list[dict]:
+        """one dict per known id (in the order of ids) with 'id' and the requested fields only"""
+        fields = list(fields) if fields else list(self.fields)
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise ValueError(f'unknown fields {sorted(unknown)}, available: {self.fields}')
+
+        with self._lock:
+            found = [int(art_id) for art_id in ids if int(art_id) in self._row_of]
+            rows = np.fromiter((self._row_of[art_id] for art_id in found), dtype=np.int64, count=len(found))
+            columns = {field: self._columns[field][rows].tolist() for field in fields}
+
+        return [{'id': art_id, **{field: columns[field][i] for field in fields}} for i, art_id in enumerate(found)]
+
+    def save(self, path: str):
+        with self._lock:
+            columns = {'id': self._ids[:self._size].tolist()}
+            columns.update({field: column[:self._size].tolist() for field, column in self._columns.items()})
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(columns, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            columns = json.load(f)
+        fields = [field for field in self.fields if field in columns]
+        self.upsert([{'id': art_id, **{field: columns[field][i] for field in fields}}
+                     for i, art_id in enumerate(columns['id'])])
@@ -0,0 +1,494 @@
+import os
+import time
+import atexit
+import logging
+import threading
+import numpy as np
+from src.db.quantization import make_codec
+from src.db import filters as search_filters
+from src.v1 import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class NumpyManager:
+    """
+    In-process exact vector search. keeps every img_embedding in one contiguous float32 matrix
+    and answers a batch of queries with a single matrix multiply + argpartition.
+    same interface as DBManager, so DBApi can use either one.
+
+    with a quantization (float16 / int8 / pq) candidates are scored on the compressed codes and only
+    the best `rerank_k` are re-ranked on the float32 rows. with mmap the float32 rows stay in a writable
+    memory map of the vectors file, the heap only holds the codes.
+
+    the typed filter fields (width, medium, ...) are kept as columns aligned with the rows, a filtered
+    search masks the rows that fail before the top_k selection, at the cost of one vectorized compare.
+
+    rows visible to a search are never written in place: new rows are written past the published _size,
+    a replaced id gets a new row and its old one is marked deleted, compaction builds new arrays. a search
+    works on a snapshot of (arrays, size, deleted rows) and never sees a half written row.
+    """
+
+    copy_block_rows = 8192  # rows copied at a time when the vectors buffer is rebuilt
+
+    def __init__(self, config, init: bool = False):
+        self.config = config
+        self.img_embed_dim = config.img_embed_dim
+        self.collection_name = config.collection_name
+        self.data_dir = config.numpy_dir
+        # None: map the rows when they are quantized, the rerank only reads a few of them per query
+        mmap = config.numpy_mmap if config.numpy_mmap is not None else config.numpy_quantization is not None
+        self.mmap = mmap and self.data_dir is not None
+
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, self.img_embed_dim), dtype=np.float32)
+        self._size = 0
+        self._row_of = {}  # id -> row in self._vectors
+        self._scalars = {field: self._empty_scalar(field, 0) for field in search_filters.FILTER_FIELDS}
+        self._deleted = set()  # rows deleted but not compacted yet, masked out of every search
+        self._dirty = False  # changed since the last save
+        self._save_timer = None
+        self.save_delay_s = config.numpy_save_delay_s
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()  # one writer of the files at a time
+        self.timings = {}  # startup phase -> seconds
+
+        self.quantization = config.numpy_quantization
+        self.pq_subspaces = config.numpy_pq_subspaces
+        self.codec_sample = config.numpy_codec_sample
+        self.codec = make_codec(self.quantization, self.pq_subspaces)  # replaced by a fitted one in index()
+        self.rerank_k = config.numpy_rerank_k
+        self._codes = None  # codes of rows [0, _n_indexed), rows past it are scored exactly
+        self._n_indexed = 0
+        self._layout = 0  # bumped when compaction renumbers the rows, codes encoded before that are stale
+        self._index_lock = threading.Lock()  # one codec fit / encode at a time, searches don't take it
+
+        t0 = time.perf_counter()
+        if init:
+            self._create_collection()
+        else:
+            self._load()
+        self.timings['load'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        self.index()
+        self.timings['index'] = time.perf_counter() - t0
+        if self.data_dir is not None:
+            atexit.register(self.save)  # rows still waiting for a scheduled save
+
+    @property
+    def _ids_path(self):
+        return os.path.join(self.data_dir, f'{self.collection_name}_ids.npy')
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.data_dir, f'{self.collection_name}_img_embedding.npy')
+
+    @property
+    def _scalars_path(self):
+        return os.path.join(self.data_dir, f'{self.collection_name}_scalars.npz')
+
+    @property
+    def _deleted_path(self):
+        return os.path.join(self.data_dir, f'{self.collection_name}_deleted.npy')
+
+    @staticmethod
+    def _empty_scalar(field: str, n: int) -> np.ndarray:
+        # numbers are float with nan for missing, text is an object column with '' for missing
+        if search_filters.FILTER_FIELDS[field] == 'number':
+            return np.full(n, np.nan, dtype=np.float64)
+        return np.full(n, '', dtype=object)
+
+    def _create_collection(self):
+        if self.data_dir is not None:
+            for path in (self._ids_path, self._vectors_path, self._scalars_path, self._deleted_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        logger.info("Collection %s created!", self.collection_name)
+
+    def _load(self):
+        if self.data_dir is None or not os.path.exists(self._ids_path):
+            return
+        self._ids = np.load(self._ids_path)
+        self._size = len(self._ids)
+        # a mapped file keeps spare rows past _size for the next inserts, the saved ids say how many are real
+        vectors = np.load(self._vectors_path, mmap_mode='r+' if self.mmap else 'r')
+        self._vectors = vectors if self.mmap else np.array(vectors[:self._size])
+        self._row_of = {int(art_id): row for row, art_id in enumerate(self._ids)}  # a replaced id: its last row
+        if len(self._row_of) < self._size:
+            self._deleted = set(range(self._size)) - set(self._row_of.values())  # replaced rows, not compacted yet
+        saved = np.load(self._scalars_path) if os.path.exists(self._scalars_path) else {}
+        for field in self._scalars:
+            if field in saved:
+                column = saved[field]
+                self._scalars[field] = column if column.dtype.kind == 'f' else column.astype(object)
+            else:
+                self._scalars[field] = self._empty_scalar(field, self._size)
+        if os.path.exists(self._deleted_path):
+            # deletes acknowledged since the last compaction
+            for art_id in np.load(self._deleted_path).tolist():
+                row = self._row_of.pop(art_id, None)
+                if row is not None:
+                    self._deleted.add(row)
+
+    def _reserve(self, extra: int):
+        """grow the buffers (doubling) so repeated small inserts stay amortized O(1)"""
+        needed = self._size + extra
+        if needed > len(self._ids):
+            capacity = max(needed, 2 * len(self._ids), 1024)
+            ids = np.empty(capacity, dtype=np.int64)
+            ids[:self._size] = self._ids[:self._size]
+            self._ids = ids
+            for field, column in self._scalars.items():
+                grown = self._empty_scalar(field, capacity)
+                grown[:self._size] = column[:self._size]
+                self._scalars[field] = grown
+        if needed > len(self._vectors) or not self._vectors.flags.writeable:
+            self._vectors = self._new_vectors(max(needed, 2 * len(self._vectors), 1024), np.arange(self._size))
+
+    def _new_vectors(self, capacity: int, rows: np.ndarray) -> np.ndarray:
+        """
+        a [capacity, dim] buffer starting with self._vectors[rows], copied a block at a time. with mmap it is
+        a new vectors file swapped in for the old one, so the matrix never passes through the heap
+        (a snapshot holding the old map keeps reading the replaced file).
+        """
+        shape = (capacity, self.img_embed_dim)
+        if self.mmap:
+            os.makedirs(self.data_dir, exist_ok=True)
+            tmp = f'{self._vectors_path}.tmp.npy'
+            vectors = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            vectors = np.empty(shape, dtype=np.float32)
+        for start in range(0, len(rows), self.copy_block_rows):
+            block = rows[start:start + self.copy_block_rows]
+            vectors[start:start + len(block)] = self._vectors[block]
+        if self.mmap:
+            vectors.flush()
+            os.replace(tmp, self._vectors_path)
+        return vectors
+
+    @staticmethod
+    def _encode(codec, vectors: np.ndarray, start: int, end: int) -> np.ndarray:
+        """codes of rows [start, end), a block at a time so a mapped matrix isn't read into the heap at once"""
+        return np.concatenate([codec.encode(vectors[i:min(i + codec.block_rows, end)])
+                               for i in range(start, end, codec.block_rows)])
+
+    def index(self):
+        """
+        fit a new codec on a sample of the rows and encode every row, then swap (codec, codes) in.
+        the fit and the encode run outside the lock on rows that don't change, searches keep using the
+        previous codes meanwhile. exact search has nothing to build
+        """
+        if self.quantization is None:
+            return
+        with self._index_lock:
+            while True:
+                with self._lock:
+                    vectors, size, layout = self._vectors, self._size, self._layout
+                if size == 0:
+                    return
+                sample = np.random.default_rng(0).choice(size, min(size, self.codec_sample), replace=False)
+                codec = make_codec(self.quantization, self.pq_subspaces).fit(np.asarray(vectors[np.sort(sample)]))
+                codes = self._encode(codec, vectors, 0, size)
+                with self._lock:
+                    if self._layout == layout:
+                        self.codec, self._codes, self._n_indexed = codec, codes, size
+                        return
+                # a compaction renumbered the rows meanwhile, fit again on the new layout
+
+    def _index_tail(self):
+        """encode the rows added since the last index() with the current codec, retrain once the catalog doubled"""
+        if self.quantization is None:
+            return
+        with self._lock:
+            codec, codes, n_indexed = self.codec, self._codes, self._n_indexed
+            vectors, size, layout = self._vectors, self._size, self._layout
+        if n_indexed == size:
+            return
+        if n_indexed == 0 or size > 2 * n_indexed:
+            self.index()
+            return
+        if not self._index_lock.acquire(blocking=False):
+            return  # a retrain is running, these rows are scored exactly until the next flush
+        try:
+            tail = self._encode(codec, vectors, n_indexed, size)
+            with self._lock:
+                if self.codec is codec and self._layout == layout and self._n_indexed == n_indexed:
+                    self._codes = np.concatenate([codes[:n_indexed], tail])
+                    self._n_indexed = size
+        finally:
+            self._index_lock.release()
+
+    def flush(self):
+        """
+        encode the new rows, compact once replaced / deleted rows are a quarter of the matrix, and save
+        within save_delay_s (a burst of inserts is written once, no-op for an in-memory only collection)
+        """
+        self._index_tail()
+        if self._deleted and len(self._deleted) >= self._size // 4:
+            self.compact()  # flushes again
+            return
+        self._schedule_save()
+
+    def _schedule_save(self):
+        if self.data_dir is None:
+            return
+        if self.save_delay_s <= 0:
+            self.save()
+            return
+        with self._lock:
+            if not self._dirty or self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.save_delay_s, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self):
+        """write the collection to disk now if it changed since the last save"""
+        if self.data_dir is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return
+                ids, vectors, size, _, _, _, _, scalars = self._snapshot()
+                deleted = self._deleted_ids()
+                self._dirty = False
+            try:
+                # the visible rows of a snapshot don't change, they are written without holding the lock.
+                # ids go last: a crash part way leaves ids that still fit the vectors saved before them
+                os.makedirs(self.data_dir, exist_ok=True)
+                if isinstance(vectors, np.memmap):
+                    vectors.flush()  # the rows were written into the mapped file, only its dirty pages go out
+                else:
+                    self._save_array(self._vectors_path, vectors[:size])
+                self._save_array(self._scalars_path, {field: column[:size] if column.dtype.kind == 'f' else
+                                                      column[:size].astype(str) for field, column in scalars.items()})
+                self._save_array(self._deleted_path, deleted)
+                self._save_array(self._ids_path, ids[:size])
+            except Exception:
+                self._dirty = True  # retried by the next save
+                raise
+
+    @staticmethod
+    def _save_array(path: str, data):
+        tmp = f'{path}.tmp.npz' if isinstance(data, dict) else f'{path}.tmp.npy'
+        if isinstance(data, dict):
+            np.savez(tmp, **data)
+        else:
+            np.save(tmp, data)
+        os.replace(tmp, path)
+
+    def _save_deleted(self):
+        """
+        the deleted ids go to their own small file, a delete is durable without rewriting the matrix.
+        only ids without a live row: the old rows of replaced ids are found again from the duplicate ids on load.
+        """
+        if self.data_dir is None:
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._save_array(self._deleted_path, self._deleted_ids())
+
+    def _deleted_ids(self) -> np.ndarray:
+        deleted = {int(art_id) for art_id in self._ids[sorted(self._deleted)]} - self._row_of.keys()
+        return np.array(sorted(deleted), dtype=np.int64)
+
+    def set(self, batch):
+        """rows as dicts (the milvus insert format), see set_columns"""
+        if not batch:
+            return
+        vectors = np.stack([np.asarray(row['img_embedding'], dtype=np.float32) for row in batch])
+        self.set_columns([row['id'] for row in batch], vectors,
+                         {field: [row.get(field) for row in batch] for field in self._scalars})
+
+    def set_columns(self, ids, vectors, columns: dict | None = None):
+        """
+        insert or replace the rows of many ids at once. vectors is a [n, dim] array (normalized here, the
+        COSINE metric of the milvus index), columns maps a filter field to its n values.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.img_embed_dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1)
+        columns = columns or {}
+        last = {art_id: i for i, art_id in enumerate(ids.tolist())}  # an id sent twice keeps its last row
+        if len(last) < len(ids):
+            keep = np.fromiter(last.values(), dtype=np.int64, count=len(last))
+            ids, vectors = ids[keep], vectors[keep]
+            columns = {field: [values[i] for i in keep] for field, values in columns.items() if values is not None}
+        with self._lock:
+            self._reserve(len(ids))
+            start, end = self._size, self._size + len(ids)
+            # written past _size, so no snapshot sees these rows until _size is published below
+            self._ids[start:end] = ids
+            self._vectors[start:end] = vectors
+            for field, column in self._scalars.items():
+                values = columns.get(field)
+                if values is None:
+                    values = [None] * len(ids)
+                if search_filters.FILTER_FIELDS[field] == 'number':
+                    column[start:end] = [np.nan if value is None else float(value) for value in values]
+                else:
+                    column[start:end] = [value or '' for value in values]
+            for row, art_id in enumerate(ids.tolist(), start=start):
+                old = self._row_of.get(art_id)
+                if old is not None:
+                    self._deleted.add(old)  # the replaced row, purged by the next compaction
+                self._row_of[art_id] = row
+            self._size = end
+            self._dirty = True
+
+    def upsert(self, batch):
+        # rows are keyed by id already
+        self.set(batch)
+
+    def delete(self, ids):
+        """mark the rows deleted, they are masked at search time and removed by compact()"""
+        with self._lock:
+            for art_id in ids:
+                idx = self._row_of.pop(int(art_id), None)
+                if idx is not None:
+                    self._deleted.add(idx)
+            self._save_deleted()
+
+    def compact(self):
+        """drop the deleted rows into new arrays and swap them in, searches keep using their snapshot"""
+        with self._lock:
+            if not self._deleted:
+                return
+            keep = np.ones(self._size, dtype=bool)
+            keep[list(self._deleted)] = False
+            self._vectors = self._new_vectors(max(int(keep.sum()), 1024), np.flatnonzero(keep))
+            self._ids = self._ids[:self._size][keep]
+            self._scalars = {field: column[:self._size][keep] for field, column in self._scalars.items()}
+            self._size = len(self._ids)
+            self._row_of = {int(art_id): row for row, art_id in enumerate(self._ids)}
+            self._deleted = set()
+            self._dirty = True
+            self._layout += 1
+            if self._n_indexed:
+                self._codes = self._codes[:self._n_indexed][keep[:self._n_indexed]]
+                self._n_indexed = len(self._codes)
+        if self.mmap:
+            # the vectors file was rewritten in place of the old one, the saved ids have to follow it now
+            self._index_tail()
+            self.save()
+            return
+        self.flush()
+
+    def _snapshot(self):
+        """
+        (ids, vectors, size, deleted rows, codec, codes, n_indexed, scalars),
+        rows [0, size) of these arrays don't change
+        """
+        with self._lock:
+            return (self._ids, self._vectors, self._size, list(self._deleted),
+                    self.codec, self._codes, self._n_indexed, dict(self._scalars))
+
+    def get_vectors(self, ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """Return (ids, vectors) for the given ids that exist in the collection"""
+        with metrics.stage('vector_fetch'):
+            return self._get_vectors(ids)
+
+    def _get_vectors(self, ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        # a few dict lookups and one gather, done under the lock since _row_of is updated in place
+        with self._lock:
+            row_of, deleted = self._row_of, self._deleted
+            found = [art_id for art_id in dict.fromkeys(ids) if art_id in row_of and row_of[art_id] not in deleted]
+            return np.asarray(found, dtype=np.int64), np.asarray(self._vectors[[row_of[art_id] for art_id in found]])
+
+    def search(self, embeddings, anns_field="img_embedding", top_k=1000, filters=()) -> tuple[np.ndarray, np.ndarray]:
+        """
+        One matrix multiply for all the query vectors.
+        Return (ids, scores) arrays of shape [n_queries, top_k], rows padded with id -1 and score -inf
+        when the collection holds fewer than top_k (matching) vectors.
+        """
+        metrics.batch_size.observe(len(embeddings), kind='search')
+        with metrics.stage('ann_search'):
+            return self._search(embeddings, anns_field, top_k, filters)
+
+    def _search(self, embeddings, anns_field, top_k, filters) -> tuple[np.ndarray, np.ndarray]:
+        if anns_field != "img_embedding":
+            raise ValueError(f'numpy backend only indexes img_embedding, got: {anns_field}')
+        top_k = top_k if top_k is not None else 1
+        ids, vectors, size, deleted, codec, codes, n_indexed, scalars = self._snapshot()
+
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.img_embed_dim)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1)
+
+        out_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        out_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        # rows that can't be returned: deleted, or failing the filters
+        passed = search_filters.mask(filters, {field: column[:size] for field, column in scalars.items()})
+        excluded = None
+        if deleted or passed is not None:
+            excluded = np.zeros(size, dtype=bool) if passed is None else ~passed
+            excluded[deleted] = True
+        n_alive = size - (int(excluded.sum()) if excluded is not None else 0)
+
+        k = min(top_k, n_alive)
+        if k <= 0 or len(queries) == 0:
+            return out_ids, out_scores
+
+        if codes is None or n_indexed == 0:
+            scores = queries @ vectors[:size].T
+        else:
+            scores = np.empty((len(queries), size), dtype=np.float32)
+            scores[:, :n_indexed] = codec.scores(queries, codes[:n_indexed])
+            scores[:, n_indexed:] = queries @ vectors[n_indexed:size].T  # not encoded yet, exact
+        if excluded is not None:
+            scores[:, excluded] = -np.inf
+
+        if codes is not None and n_indexed:
+            # candidates from the codes, then exact scores on the float32 rows of the candidates only
+            n_candidates = min(max(self.rerank_k, k), n_alive)
+            candidates = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+            exact = np.einsum('qd,qcd->qc', queries, vectors[candidates])
+            rerank = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(candidates, rerank, axis=1)
+            top_scores = np.take_along_axis(exact, rerank, axis=1)
+        else:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+
+        out_ids[:, :k] = ids[np.take_along_axis(top, order, axis=1)]
+        out_scores[:, :k] = np.take_along_axis(top_scores, order, axis=1)
+        return out_ids, out_scores
+
+    def search_by_ids(self, ids: list[int], top_k=1000, filters=()) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top_k neighbours of every id in a single search. rows are aligned with `ids`,
+        ids that are not in the collection get an all padding row.
+        """
+        found_ids, vectors = self.get_vectors(ids)
+        found = set(found_ids.tolist())
+        known = np.array([art_id in found for art_id in ids], dtype=bool)
+        rows = {art_id: row for row, art_id in enumerate(found_ids.tolist())}
+        out_ids = np.full((len(ids), top_k), -1, dtype=np.int64)
+        out_scores = np.full((len(ids), top_k), -np.inf, dtype=np.float32)
+        out_ids[known], out_scores[known] = self.search(vectors[[rows[art_id] for art_id in ids if art_id in found]],
+                                                        top_k=top_k, filters=filters)
+        return out_ids, out_scores
+
+    def get_similarity_by_embeddings(self, embeddings: list[list[float]], anns_field="img_embedding", top_k=1000):
+        """
+        Return the top_k vectors in the db that are most similar to the given embeddings.
+        """
+        ids, _ = self.search(embeddings, anns_field=anns_field, top_k=top_k)
+        return [row[row >= 0].tolist() for row in ids]
+
+    def get_similarity_by_ids(self, ids: list[int], top_k=1000):
+        """
+        Given a list of IDs, look up their embeddings in the matrix and return the top_k most similar vectors' IDs.
+        """
+        found_ids, vectors = self.get_vectors(ids)
+        if len(found_ids) == 0:
+            return []
+        return self.get_similarity_by_embeddings(embeddings=vectors, top_k=top_k)
@@ -0,0 +1,150 @@
+import numpy as np
+
+QUANTIZATIONS = ('float16', 'int8', 'pq')
+
+
+class Codec:
+    """
+    compressed representation of the vectors used to generate candidates,
+    approximate inner products are computed straight on the codes.
+    """
+    block_rows = 8192  # codes are decoded / scored in blocks of rows to bound the temporary memory
+    block_queries = 64  # ... and of queries
+
+    def fit(self, vectors: np.ndarray):
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def prepare(self, queries: np.ndarray):
+        """query side work done once per search (scaled queries, lookup tables...)"""
+        return queries
+
+    def _score_block(self, prepared, codes: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def scores(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """approximate queries @ vectors.T, shape [n_queries, n_codes]"""
+        prepared = self.prepare(queries)
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for q_start in range(0, len(queries), self.block_queries):
+            q_end = q_start + self.block_queries
+            for start in range(0, len(codes), self.block_rows):
+                end = start + self.block_rows
+                out[q_start:q_end, start:end] = self._score_block(prepared[q_start:q_end], codes[start:end])
+        return out
+
+    def bytes_per_vector(self, dim: int) -> int:
+        raise NotImplementedError
+
+
+class Float16Codec(Codec):
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float16)
+
+    def _score_block(self, queries, codes):
+        # numpy has no fast float16 matmul, widen one block at a time
+        return queries @ codes.astype(np.float32).T
+
+    def bytes_per_vector(self, dim):
+        return 2 * dim
+
+
+class Int8Codec(Codec):
+    """symmetric scalar quantization with one scale per dimension"""
+
+    def __init__(self):
+        self.scales = None
+
+    def fit(self, vectors):
+        max_abs = np.abs(vectors).max(axis=0) if len(vectors) else np.ones(vectors.shape[1])
+        self.scales = (np.where(max_abs > 0, max_abs, 1) / 127).astype(np.float32)
+        return self
+
+    def encode(self, vectors):
+        return np.clip(np.rint(vectors / self.scales), -127, 127).astype(np.int8)
+
+    def prepare(self, queries):
+        # q . (codes * scales) == (q * scales) . codes, scale the queries once
+        return queries * self.scales
+
+    def _score_block(self, queries, codes):
+        return queries @ codes.astype(np.float32).T
+
+    def bytes_per_vector(self, dim):
+        return dim
+
+
+class PQCodec(Codec):
+    """
+    product quantization: the vector is cut into `subspaces` chunks, each chunk is replaced by the id
+    of its nearest of 256 k-means centroids (1 byte). scores use per-query lookup tables (ADC).
+    """
+    block_queries = 8  # the lookup makes a [queries, rows, subspaces] float32 temporary: 8 x 8192 x 96 is 25MB
+
+    def __init__(self, subspaces: int, n_centroids: int = 256, n_iter: int = 20, seed: int = 0):
+        self.subspaces = subspaces
+        self.n_centroids = n_centroids
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None  # [subspaces, n_centroids, sub_dim]
+
+    def _split(self, vectors):
+        n, dim = vectors.shape
+        if dim % self.subspaces:
+            raise ValueError(f'dim {dim} is not divisible by {self.subspaces} subspaces')
+        return vectors.reshape(n, self.subspaces, dim // self.subspaces)
+
+    @staticmethod
+    def _nearest(points, centroids):
+        distances = (points ** 2).sum(1, keepdims=True) - 2 * points @ centroids.T + (centroids ** 2).sum(1)
+        return distances.argmin(axis=1)
+
+    def fit(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        parts = self._split(np.asarray(vectors, dtype=np.float32))
+        k = min(self.n_centroids, len(vectors))
+        self.centroids = np.empty((self.subspaces, self.n_centroids, parts.shape[2]), dtype=np.float32)
+        for m in range(self.subspaces):
+            points = parts[:, m]
+            centroids = points[rng.choice(len(points), k, replace=False)].copy()
+            for _ in range(self.n_iter):
+                assign = self._nearest(points, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, points)
+                counts = np.bincount(assign, minlength=k)[:, None]
+                centroids = np.where(counts > 0, sums / np.maximum(counts, 1), centroids)
+            # fewer vectors than centroids: the spare slots repeat real centroids
+            self.centroids[m] = centroids[np.arange(self.n_centroids) % k]
+        return self
+
+    def encode(self, vectors):
+        parts = self._split(np.asarray(vectors, dtype=np.float32))
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            codes[:, m] = self._nearest(parts[:, m], self.centroids[m])
+        return codes
+
+    def prepare(self, queries):
+        # lut[q, m, c] = <query chunk m, centroid c of subspace m>
+        return np.einsum('qmd,mcd->qmc', self._split(queries), self.centroids)
+
+    def _score_block(self, lut, codes):
+        return lut[:, np.arange(self.subspaces), codes].sum(axis=-1)
+
+    def bytes_per_vector(self, dim):
+        return self.subspaces
+
+
+def make_codec(name: str | None, pq_subspaces: int = 96) -> Codec | None:
+    if name is None:
+        return None
+    if name == 'float16':
+        return Float16Codec()
+    if name == 'int8':
+        return Int8Codec()
+    if name == 'pq':
+        return PQCodec(pq_subspaces)
+    raise ValueError(f'quantization should be one of {QUANTIZATIONS} or None, got: {name}')
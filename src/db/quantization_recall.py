@@ -0,0 +1,88 @@
+"""
+recall@k of the compressed representations against exact float32 search, on our own catalog.
+
+    python -m src.db.quantization_recall --vectors volumes/numpy/v2_img_embedding.npy --k 6 100 1000
+"""
+import argparse
+import json
+import time
+import numpy as np
+from src.db.quantization import QUANTIZATIONS, make_codec
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(f, t, assume_unique=True)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def evaluate(vectors: np.ndarray, queries: np.ndarray, ks: list[int], reranks: list[int],
+             quantizations: list[str], pq_subspaces: int) -> list[dict]:
+    dim = vectors.shape[1]
+    max_k = max(ks)
+    truth = top_k(queries @ vectors.T, max_k)
+    report = []
+
+    for name in quantizations:
+        codec = make_codec(name, pq_subspaces)
+        t0 = time.perf_counter()
+        codec.fit(vectors)
+        codes = codec.encode(vectors)
+        build_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        approx = codec.scores(queries, codes)
+        score_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+        for rerank in reranks:
+            n_candidates = max(rerank, max_k)
+            candidates = top_k(approx, min(n_candidates, len(vectors)))
+            if rerank:
+                exact = np.einsum('qd,qcd->qc', queries, vectors[candidates])
+                candidates = np.take_along_axis(candidates, top_k(exact, max_k), axis=1)
+            report.append({
+                'quantization': name,
+                'rerank': rerank,
+                'bytes_per_vector': codec.bytes_per_vector(dim),
+                'compression': 4 * dim / codec.bytes_per_vector(dim),
+                'build_s': round(build_s, 3),
+                'score_ms_per_query': round(score_ms, 3),
+                **{f'recall@{k}': round(recall(candidates[:, :k], truth[:, :k]), 4) for k in ks},
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', required=True, help='.npy float32 matrix, e.g. the numpy backend img_embedding file')
+    parser.add_argument('--queries', type=int, default=200, help='catalog vectors used as queries')
+    parser.add_argument('--k', type=int, nargs='+', default=[6, 100, 1000])
+    parser.add_argument('--rerank', type=int, nargs='+', default=[0, 256, 1000],
+                        help='candidates re-ranked exactly, 0 ranks on the codes only')
+    parser.add_argument('--quantization', nargs='+', default=list(QUANTIZATIONS), choices=QUANTIZATIONS)
+    parser.add_argument('--pq-subspaces', type=int, default=96)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    vectors = np.load(args.vectors).astype(np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    rng = np.random.default_rng(args.seed)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    ks = [k for k in args.k if k <= len(vectors)]
+
+    report = evaluate(vectors, queries, ks, args.rerank, args.quantization, args.pq_subspaces)
+    for row in report:
+        print(' '.join(f'{key}={value}' for key, value in row.items()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+
+
+class SearchBatcher:
+    """
+    Coalesce concurrent searches into one multi-vector search.
+    a request that arrives while no other search is in flight runs directly, without waiting.
+    under load, the first queued request opens a window of `window_ms`, every request that arrives before it closes
+    (or until `max_batch` query vectors are gathered) goes to the engine in the same search call,
+    and each caller gets back its own rows.
+    """
+
+    def __init__(self, search_fn, window_ms: float, max_batch: int):
+        self.search_fn = search_fn  # (embeddings, anns_field, top_k, filters) -> (ids, scores)
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self._in_flight = 0  # searches started and not answered yet, direct or queued
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='search-batcher', daemon=True)
+        self._worker.start()
+
+    def search(self, embeddings, anns_field="img_embedding", top_k=1000, filters=()) -> tuple[np.ndarray, np.ndarray]:
+        """same contract as DBManager.search, blocks until the coalesced search is done"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) == 0 or len(embeddings) >= self.max_batch:
+            return self.search_fn(embeddings, anns_field=anns_field, top_k=top_k, filters=filters)
+        with self._lock:
+            idle = self._in_flight == 0
+            self._in_flight += 1
+        try:
+            if idle:
+                result = self.search_fn(embeddings, anns_field=anns_field, top_k=top_k, filters=filters)
+                self._count(1)
+                return result
+            future = Future()
+            self._queue.put((embeddings, (anns_field, tuple(filters)), top_k, future))
+            return future.result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _count(self, n_requests: int):
+        with self._lock:
+            self.batches += 1
+            self.requests += n_requests
+
+    def _gather(self) -> list:
+        pending = [self._queue.get()]
+        n_vectors = len(pending[0][0])
+        deadline = time.perf_counter() + self.window
+        while n_vectors < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(request)
+            n_vectors += len(request[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._gather()
+            # one search per (vector field, filters), almost always just unfiltered img_embedding
+            by_key = {}
+            for request in pending:
+                by_key.setdefault(request[1], []).append(request)
+            for (anns_field, filters), requests in by_key.items():
+                self._search(anns_field, filters, requests)
+
+    def _search(self, anns_field: str, filters: tuple, requests: list):
+        top_k = max(request[2] for request in requests)
+        try:
+            ids, scores = self.search_fn(np.concatenate([request[0] for request in requests]),
+                                         anns_field=anns_field, top_k=top_k, filters=filters)
+        except Exception as e:
+            for request in requests:
+                request[3].set_exception(e)
+            return
+
+        self._count(len(requests))
+        start = 0
+        for embeddings, _, request_top_k, future in requests:
+            end = start + len(embeddings)
+            # rows are sorted by score, so the first request_top_k columns are that request's answer
+            future.set_result((ids[start:end, :request_top_k], scores[start:end, :request_top_k]))
+            start = end
@@ -0,0 +1,57 @@
+import threading
+import numpy as np
+
+
+class Tombstones:
+    """
+    Bitmap of deleted ids (ids are non-negative int64 product ids, the bitmap grows to the largest one).
+    deletes are visible to search and fusion as soon as they are marked here, before the backend
+    has physically removed the rows.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._bits = np.zeros(capacity, dtype=bool)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _grow(self, max_id: int):
+        if max_id < len(self._bits):
+            return
+        bits = np.zeros(max(max_id + 1, 2 * len(self._bits)), dtype=bool)
+        bits[:len(self._bits)] = self._bits
+        self._bits = bits
+
+    def add(self, ids):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        ids = ids[ids >= 0]
+        if len(ids) == 0:
+            return
+        with self._lock:
+            self._grow(int(ids.max()))
+            self._bits[ids] = True
+            self._count = int(self._bits.sum())
+
+    def remove(self, ids):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        with self._lock:
+            ids = ids[(ids >= 0) & (ids < len(self._bits))]
+            self._bits[ids] = False
+            self._count = int(self._bits.sum())
+
+    def ids(self) -> np.ndarray:
+        return np.flatnonzero(self._bits)
+
+    def mask(self, ids: np.ndarray) -> np.ndarray:
+        """bool array, True where the id is deleted (padding -1 and unknown ids are False)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        bits = self._bits  # a concurrent _grow swaps the array, never shrinks it
+        inside = (ids >= 0) & (ids < len(bits))
+        out = np.zeros(ids.shape, dtype=bool)
+        out[inside] = bits[ids[inside]]
+        return out
+
+    def __contains__(self, art_id):
+        return 0 <= art_id < len(self._bits) and bool(self._bits[art_id])
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class VectorCache:
+    """
+    Bounded LRU id -> embedding cache, so the query vectors of popular ids don't have to
+    be fetched from the db on every search. Shared by the request threads, every method takes the lock.
+    """
+
+    def __init__(self, dim: int, max_size: int):
+        self.dim = dim
+        self.max_size = max_size
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, art_id):
+        with self._lock:
+            return art_id in self._vectors
+
+    def __len__(self):
+        with self._lock:
+            return len(self._vectors)
+
+    def put(self, art_id, vector):
+        self.put_many({art_id: vector})
+
+    def put_many(self, vectors: dict):
+        with self._lock:
+            for art_id, vector in vectors.items():
+                self._vectors[art_id] = np.asarray(vector, dtype=np.float32)
+                self._vectors.move_to_end(art_id)
+            while len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+
+    def get_many(self, ids) -> dict:
+        """return {id: vector} for the ids that are in the cache, in the order of `ids`"""
+        found = {}
+        with self._lock:
+            for art_id in dict.fromkeys(ids):
+                vector = self._vectors.get(art_id)
+                if vector is not None:
+                    self._vectors.move_to_end(art_id)
+                    found[art_id] = vector
+        return found
+
+    def discard(self, ids):
+        with self._lock:
+            for art_id in ids:
+                self._vectors.pop(art_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+
+
+def stack_vectors(ids, found: dict, dim: int) -> tuple[np.ndarray, np.ndarray]:
+    """(found_ids, vectors) for the ids present in `found`, in the order of `ids`"""
+    present = [art_id for art_id in dict.fromkeys(ids) if art_id in found]
+    vectors = np.empty((len(present), dim), dtype=np.float32)
+    for row, art_id in enumerate(present):
+        vectors[row] = found[art_id]
+    return np.asarray(present, dtype=np.int64), vectors
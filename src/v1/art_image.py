@@ -1,6 +1,11 @@
 from pydantic import BaseModel
 from datetime import datetime
 from src.v1.embed_model import EmbedModel
+from src.v1.embed_cache import EmbedCache, file_digest
+from src.v1 import metrics
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional, Tuple
 
 
@@ -17,40 +22,214 @@ class ArtImage(BaseModel):
     size: Tuple[int, int]
     extracted_features: Optional[Dict[str, float]] = None
     tags: Optional[List[str]] = None
+    # typed catalog fields (product export columns), searches can be filtered on them
+    width: Optional[float] = None
+    height: Optional[float] = None
+    depth: Optional[float] = None
+    technique: Optional[str] = None
+    medium: Optional[str] = None
+    style: Optional[str] = None
+
+
+class ArtBatch:
+    """
+    arts of the ingest path with their vectors in one contiguous [n, dim] float32 array, row i belongs to arts[i].
+    the vectors go from the encoder to the db insert without becoming python floats, the embedding
+    fields of the ArtImage objects stay empty.
+    """
+
+    def __init__(self, arts: list[ArtImage], img_embeddings, prompts: list | None = None, prompt_embeddings=None):
+        self.arts = list(arts)
+        self.img_embeddings = np.ascontiguousarray(img_embeddings, dtype=np.float32)
+        self.prompts = list(prompts) if prompts is not None else [None] * len(self.arts)
+        self.prompt_embeddings = None if prompt_embeddings is None else np.ascontiguousarray(prompt_embeddings,
+                                                                                           dtype=np.float32)
+
+    @classmethod
+    def from_arts(cls, arts: list[ArtImage]) -> 'ArtBatch':
+        """batch of arts that carry their own img_embeddings (e.g. built by a client)"""
+        prompt_embeddings = None
+        if arts and all(art.prompt_embeddings is not None for art in arts):
+            prompt_embeddings = np.stack([np.asarray(art.prompt_embeddings, dtype=np.float32) for art in arts])
+        return cls(arts, np.stack([np.asarray(art.img_embeddings, dtype=np.float32) for art in arts]),
+                   [art.prompt for art in arts], prompt_embeddings)
+
+    @classmethod
+    def of(cls, arts: 'ArtBatch | list[ArtImage]') -> 'ArtBatch':
+        return arts if isinstance(arts, ArtBatch) else cls.from_arts(arts)
+
+    @classmethod
+    def concat(cls, batches: list['ArtBatch']) -> 'ArtBatch':
+        if len(batches) == 1:
+            return batches[0]
+        prompt_embeddings = None
+        if all(batch.prompt_embeddings is not None for batch in batches):
+            prompt_embeddings = np.concatenate([batch.prompt_embeddings for batch in batches])
+        return cls([art for batch in batches for art in batch.arts],
+                   np.concatenate([batch.img_embeddings for batch in batches]),
+                   [prompt for batch in batches for prompt in batch.prompts], prompt_embeddings)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return np.fromiter((art.id for art in self.arts), dtype=np.int64, count=len(self.arts))
+
+    def __len__(self) -> int:
+        return len(self.arts)
+
+    def __iter__(self):
+        return iter(self.arts)
+
+    def __getitem__(self, index: slice) -> 'ArtBatch':
+        """a slice of the batch, the arrays are views"""
+        return ArtBatch(self.arts[index], self.img_embeddings[index], self.prompts[index],
+                        None if self.prompt_embeddings is None else self.prompt_embeddings[index])
+
+
+class PreparedBatch:
+    """a batch after the cpu stage: cache lookups done and the misses decoded + preprocessed"""
+
+    def __init__(self, urls: list[str], keys: list[str] | None, cached: dict, miss: list[int], tensor,
+                 encoded=None):
+        self.urls = urls
+        self.keys = keys
+        self.cached = cached
+        self.miss = miss
+        self.tensor = tensor
+        self.encoded = encoded  # Future of the miss embeddings when the model encodes in a worker pool
 
 
 class GenArtImages:
 
-    def __init__(self, model: EmbedModel, batch_size: int):
+    def __init__(self, model: EmbedModel, batch_size: int, cache: EmbedCache | None = None,
+                 num_workers: int = 0, prefetch: int = 2):
         self.model = model
         self.batch_size = batch_size
+        self.cache = cache
+        self.num_workers = num_workers  # decode/preprocess threads, 0 runs everything on the caller thread
+        self.prefetch = prefetch  # max batches decoded ahead of the encoder, bounds the memory held by the pipeline
 
     
-    def gen_object(self, imgs: list[ArtImage]):
+    def gen_object(self, imgs: list[ArtImage], on_error=None):
         """
-        each img is object (dict / pydantic) that we get from the user
+        each img is object (dict / pydantic) that we get from the user, yields an ArtBatch per encoded batch
+        on_error(img, exc) is called for every image that could not be read or encoded, the image is
+        dropped from its batch and the rest of the batch goes on. without on_error the exception is raised.
         """
+        batches = [imgs[i: i + self.batch_size] for i in range(0, len(imgs), self.batch_size)]
+
+        for imgs_batch, prepared in self._prepared_batches(batches, on_error):
+            if not imgs_batch:
+                continue
+            try:
+                imgs_embed_batch, prompt_batch , prompts_embed_batch = self.get_batch_embeddings(
+                    [img.url for img in imgs_batch], prepared)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                for img in imgs_batch:
+                    on_error(img, e)
+                continue
 
-        for i in range(0, len(imgs), self.batch_size):
+            if all(prompt_embeds is not None for prompt_embeds in prompts_embed_batch):
+                prompts_embed_batch = np.stack(prompts_embed_batch)
+            else:
+                prompts_embed_batch = None
+            yield ArtBatch(imgs_batch, imgs_embed_batch, prompt_batch, prompts_embed_batch)
 
-            imgs_batch = imgs[i: i + self.batch_size]
-            imgs_embed_batch, prompt_batch , prompts_embed_batch = self.get_batch_embeddings([img.url for img in imgs_batch])
-            
-            for i, img in enumerate(imgs_batch):
-                img.img_embeddings = imgs_embed_batch[i]
-                img.prompt = prompt_batch[i]
-                img.prompt_embeddings = prompts_embed_batch[i]
-            
-            yield imgs_batch
 
+    def _prepare_imgs(self, batch: list[ArtImage], on_error=None):
+        """prepare_batch for a batch of arts, unreadable images are reported to on_error and dropped"""
+        try:
+            return batch, self.prepare_batch([img.url for img in batch])
+        except Exception:
+            if on_error is None:
+                raise
+        # find the broken images one by one, then prepare the rest together
+        ok = []
+        for img in batch:
+            try:
+                self.prepare_batch([img.url], submit=False)
+                ok.append(img)
+            except Exception as e:
+                on_error(img, e)
+        return ok, self.prepare_batch([img.url for img in ok]) if ok else None
 
-    def get_batch_embeddings(self, imgs_batch: list[str]):
-        imgs_embed_batch = self.model.predict_imgs(imgs_batch)
+    def _prepared_batches(self, batches: list[list[ArtImage]], on_error=None):
+        """
+        yield (batch, PreparedBatch) in order. with workers, the next `prefetch` batches are decoded
+        and preprocessed on a thread pool while the caller encodes the current one
+        (PIL decode/resize and the torch transforms release the GIL).
+        """
+        if self.num_workers <= 0:
+            for batch in batches:
+                yield self._prepare_imgs(batch, on_error)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='preprocess') as pool:
+            pending = deque()
+            next_batch = 0
+            try:
+                while pending or next_batch < len(batches):
+                    while next_batch < len(batches) and len(pending) < max(self.prefetch, 1):
+                        batch = batches[next_batch]
+                        pending.append(pool.submit(self._prepare_imgs, batch, on_error))
+                        next_batch += 1
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+    def get_batch_embeddings(self, imgs_batch: list[str], prepared: PreparedBatch | None = None):
+        imgs_embed_batch = self.predict_imgs_cached(imgs_batch, prepared)
         prompt_batch = self.get_batch_prompts(imgs_batch)
         prompts_embed_batch = self.get_batch_prompts_embeds(prompt_batch)
         return imgs_embed_batch, prompt_batch , prompts_embed_batch
 
 
+    def prepare_batch(self, urls: list[str], submit: bool = True) -> PreparedBatch:
+        """
+        cpu stage: hash + cache lookup, then decode and preprocess only the misses.
+        with a pooled model (submit_encode) the misses are handed to the embedding workers right away,
+        so the encode of this batch overlaps with the preprocessing of the next ones.
+        """
+        keys, cached = None, {}
+        if self.cache is not None:
+            keys = [EmbedCache.make_key(file_digest(url), self.model.name, self.model.preprocess_version) for url in urls]
+            cached = self.cache.get_many(keys)
+        miss = [i for i in range(len(urls)) if keys is None or keys[i] not in cached]
+
+        tensor = self.model.preprocess_imgs([urls[i] for i in miss]) if miss else None
+        if submit and tensor is not None and hasattr(self.model, 'submit_encode'):
+            metrics.batch_size.observe(len(miss), kind='encode')
+            return PreparedBatch(urls, keys, cached, miss, None, encoded=self.model.submit_encode(tensor))
+        return PreparedBatch(urls, keys, cached, miss, tensor)
+
+    def predict_imgs_cached(self, urls: list[str], prepared: PreparedBatch | None = None) -> np.ndarray:
+        """
+        embeddings for a batch of image files, only the cache misses go through the model
+        """
+        prepared = prepared or self.prepare_batch(urls)
+
+        embeddings = np.empty((len(urls), self.model.dim), dtype=np.float32)
+        for i, key in enumerate(prepared.keys or []):
+            if key in prepared.cached:
+                embeddings[i] = prepared.cached[key]
+
+        if prepared.miss and prepared.encoded is not None:
+            with metrics.stage('encode'):
+                miss_embeddings = prepared.encoded.result()  # submitted to the worker pool by prepare_batch
+        elif prepared.miss:
+            with metrics.stage('encode'):
+                miss_embeddings = self.model.encode_imgs(prepared.tensor)
+            metrics.batch_size.observe(len(prepared.miss), kind='encode')
+        if prepared.miss:
+            embeddings[prepared.miss] = miss_embeddings
+            if self.cache is not None:
+                self.cache.put_many([prepared.keys[i] for i in prepared.miss], miss_embeddings)
+
+        return embeddings
+
     def get_batch_prompts(self, images):
         return [None for _ in range(len(images))]
 
@@ -1,24 +1,55 @@
 from src.v1.logic import Logic
 from src.v1.art_image import ArtImage
+from src.v1.ingest_jobs import IngestJobs
 
 class ArtMatching:
     """the main class"""
 
     def __init__(self):
         self.logic = Logic()
+        self.ingest_jobs = IngestJobs(self.logic.insert_art_images)
 
     def insert_arts(self, imgs: list[ArtImage]) -> bool:
         self.logic.insert_art_images(imgs)
         return True
 
-    def del_arts(self, images_id) -> bool:
-        # 1. delete from the database
-        return True
+    def submit_insert_arts(self, imgs: list[ArtImage], upsert: bool = False) -> dict:
+        """queue the insert on the ingest worker, return the job status (with its job_id)"""
+        return self.ingest_jobs.submit(imgs, upsert=upsert).to_dict()
+
+    def get_insert_job(self, job_id: str) -> dict | None:
+        job = self.ingest_jobs.get(job_id)
+        return job.to_dict() if job is not None else None
+
+    def list_insert_jobs(self) -> list[dict]:
+        return [job.to_dict() for job in self.ingest_jobs.all()]
+
+    def del_arts(self, images_id: list[int]) -> bool:
+        return self.logic.delete_art_images(images_id)
 
     def get_similar_arts(self, data):
         # should return list of ids
         arts = self.logic.get_similar_arts(data)
         return arts
 
-    def get_arts_data(self, images_id):
-        return True
+    def search_arts(self, data):
+        return self.logic.search_by_text(data.description, data.liked_ids, data.disliked_ids, data.top_n,
+                                         data.filters)
+
+    def get_embeddings(self, images_id: list[int]):
+        return self.logic.get_embeddings(images_id)
+
+    def search_embeddings(self, embeddings, top_n: int = 6, filters=None) -> list[list[int]]:
+        return self.logic.search_by_embeddings(embeddings, top_n, filters)
+
+    def readiness(self) -> dict:
+        return self.logic.readiness()
+
+    def collection_stats(self) -> dict:
+        return self.logic.collection_stats()
+
+    def cache_stats(self) -> dict:
+        return self.logic.cache_stats()
+
+    def get_arts_data(self, images_id: list[int], fields: list[str] | None = None) -> list[dict]:
+        return self.logic.get_arts_data(images_id, fields)
@@ -0,0 +1,187 @@
+import sys
+import time
+import logging
+import tracemalloc
+import contextlib
+import multiprocessing as mp
+import torch
+from src.v1.embed_model import EmbedModel
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigBatchTuner:
+    def __init__(self):
+        self.enabled = True
+        self.default_batch_size = 4  # used when tuning is disabled
+        self.candidates = [1, 2, 4, 8, 16, 32, 64]  # encode batch sizes to probe, ascending
+        self.memory_budget_mb = 4096  # activations of one encode batch must fit in this
+        self.min_gain = 1.05  # stop growing the batch when throughput improves less than 5%
+        self.max_probe_seconds = 60  # no new probe starts after this many seconds
+        # probe a fresh copy of the model in its own process: the rss peak of the api process also
+        # counts the searches it serves while the model loads in the background
+        self.probe_in_subprocess = True
+        self.insert_payload_mb = 32  # milvus grpc messages are capped at 64MB by default
+        self.insert_row_overhead_bytes = 2048  # scalar fields of one row (url, name, tags...)
+        self.max_insert_batch_size = 4096
+
+
+def _reset_peak_rss() -> bool:
+    """reset the process rss high-water mark (linux only), so the next peak belongs to a single probe"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_bytes() -> int | None:
+    """rss high-water mark of the process, None where the os doesn't report it (windows)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # linux reports KB
+
+
+@contextlib.contextmanager
+def _torch_threads(threads: int | None):
+    """run the probes with the intra-op thread count the model will encode with"""
+    if not threads:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def _probe_process(model_factory, config, threads: int | None, results):
+    try:
+        tuner = BatchTuner(model_factory(), config, threads=threads)
+        results.put((tuner.tune_encode_batch_size(), tuner.probes, None))
+    except Exception as e:
+        results.put((None, [], f'{type(e).__name__}: {e}'))
+
+
+class BatchTuner:
+    """
+    pick the encode and insert batch sizes at startup.
+    encode: probe the model with synthetic batches of growing size, keep the fastest (img/s)
+    that fits the memory budget. insert: as many rows as fit the payload and memory budget.
+    """
+
+    def __init__(self, model: EmbedModel, config: ConfigBatchTuner, threads: int | None = None):
+        self.model = model
+        self.config = config
+        self.threads = threads  # intra-op threads the encodes will run with (e.g. a pool worker's), None keeps the current
+        self.probes = []  # (batch_size, img/s, peak bytes per image)
+
+    def _peak_memory(self, fn) -> int:
+        """
+        peak bytes allocated while running fn: the device allocator on cuda, the rss high-water mark
+        (reset before the call) on linux, and tracemalloc elsewhere (a lower bound, torch's cpu
+        allocator isn't traced).
+        """
+        if torch.cuda.is_available() and str(getattr(self.model, 'device', 'cpu')).startswith('cuda'):
+            torch.cuda.reset_peak_memory_stats()
+            before = torch.cuda.memory_allocated()
+            fn()
+            return torch.cuda.max_memory_allocated() - before
+        if _reset_peak_rss():
+            before = _peak_rss_bytes()
+            fn()
+            return max(_peak_rss_bytes() - before, 0)
+        tracemalloc.start()
+        try:
+            fn()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def tune_encode_batch_size(self) -> int:
+        config = self.config
+        budget = config.memory_budget_mb * 2 ** 20
+        best_size, best_rate = None, 0.0
+        bytes_per_img = 0
+        started = time.perf_counter()
+
+        for batch_size in config.candidates:
+            # don't try a size the previous probes predict won't fit
+            if bytes_per_img and batch_size * bytes_per_img > budget:
+                break
+            if best_size is not None and time.perf_counter() - started > config.max_probe_seconds:
+                break
+            imgs = torch.rand(batch_size, *self.model.input_shape)
+            with _torch_threads(self.threads):
+                self.model.encode_imgs(imgs[:1])  # warm up kernels / allocator for this shape
+                t0 = time.perf_counter()
+                peak = self._peak_memory(lambda: self.model.encode_imgs(imgs))
+                rate = batch_size / (time.perf_counter() - t0)
+            bytes_per_img = max(bytes_per_img, peak / batch_size)
+            self.probes.append((batch_size, rate, bytes_per_img))
+
+            if peak > budget:
+                break  # this size already doesn't fit, larger ones won't either
+            if rate < best_rate * config.min_gain:
+                break
+            best_size, best_rate = batch_size, rate
+
+        if best_size is None:
+            # even the smallest candidate is over budget, there is nothing smaller to fall back to
+            logger.warning('encode batch of %d needs more than the %dMB memory budget',
+                           config.candidates[0], config.memory_budget_mb)
+            best_size = config.candidates[0]
+        return best_size
+
+    def tune_insert_batch_size(self) -> int:
+        config = self.config
+        row_bytes = self.model.dim * 4 + config.insert_row_overhead_bytes
+        payload = min(config.insert_payload_mb, config.memory_budget_mb) * 2 ** 20
+        return int(max(1, min(payload // row_bytes, config.max_insert_batch_size)))
+
+    def tune_in_subprocess(self, model_factory) -> int:
+        """tune_encode_batch_size on a model_factory() copy in a spawned process, the probes are copied back"""
+        ctx = mp.get_context('spawn')  # fork + torch threads deadlocks
+        results = ctx.Queue()
+        process = ctx.Process(target=_probe_process, name='batch-probe', daemon=True,
+                              args=(model_factory, self.config, self.threads, results))
+        process.start()
+        try:
+            batch_size, self.probes, error = results.get()
+        finally:
+            process.join()
+        if error is not None:
+            raise RuntimeError(f'batch size probe failed: {error}')
+        return batch_size
+
+    def tune(self, model_factory=None) -> tuple[int, int]:
+        """
+        return (encode_batch_size, insert_batch_size). with a (picklable) model_factory the encode probes
+        run on cpu in their own process, so the peak rss is only theirs.
+        """
+        if not self.config.enabled:
+            return self.config.default_batch_size, self.config.default_batch_size
+
+        on_cpu = not str(getattr(self.model, 'device', 'cpu')).startswith('cuda')
+        if model_factory is not None and self.config.probe_in_subprocess and on_cpu:
+            encode_batch_size = self.tune_in_subprocess(model_factory)
+        else:
+            encode_batch_size = self.tune_encode_batch_size()
+        insert_batch_size = max(self.tune_insert_batch_size(), encode_batch_size)
+        for batch_size, rate, bytes_per_img in self.probes:
+            logger.debug('batch probe: size=%d %.1f img/s ~%.1fMB/img', batch_size, rate, bytes_per_img / 2 ** 20)
+        logger.info('batch sizes: encode=%d insert=%d (memory budget %dMB)',
+                    encode_batch_size, insert_batch_size, self.config.memory_budget_mb)
+        return encode_batch_size, insert_batch_size
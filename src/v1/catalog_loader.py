@@ -0,0 +1,261 @@
+"""
+streaming, resumable bulk load of the product export into the collection.
+
+    python -m src.v1.catalog_loader --csv data/Products-Export-2025-February-16-1830-full.csv --images-dir data
+
+rows are read one at a time and sent in chunks of --chunk arts to the running server's /upsert_arts
+(the server owns the collection, a second in-process writer would clobber its store), so memory doesn't grow
+with the catalog. a checkpoint is written after every committed chunk: a crashed run resumes after the
+last committed row, and re-runs skip the rows whose image file and metadata are unchanged.
+images are expected at {images-dir}/{id}.jpg (see data/download_script.py), rows without one are skipped.
+the server resolves the image paths itself, so it has to see the same images dir.
+"""
+import os
+import csv
+import gzip
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+import requests
+from src.v1.embed_cache import file_digest
+from src.v1.product_export import row_fields
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class ServerClient:
+    """the calls of the loader to the art matching server, connection errors, 429 and 5xx are retried with backoff"""
+
+    def __init__(self, server: str, retries: int = 4, timeout: float = 120, poll_interval: float = 1.0,
+                 lookup_batch: int = 1000):
+        self.server = server.rstrip('/')
+        self.retries = retries
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.lookup_batch = lookup_batch  # ids per /get_arts_data call
+        self.session = requests.Session()
+
+    def _request(self, method: str, path: str, **kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, f'{self.server}{path}', timeout=self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            time.sleep(0.5 * 2 ** attempt * (1 + random.random()))
+
+    def upsert_chunk(self, chunk: list[dict]) -> dict:
+        """
+        send one chunk to /upsert_arts (a retried chunk the server already took replaces, not duplicates)
+        and wait for its insert job, returns the finished job status (with its "failures")
+        """
+        body = gzip.compress(json.dumps(chunk, ensure_ascii=False).encode('utf-8'), compresslevel=5)
+        job = self._request('POST', '/upsert_arts', data=body,
+                            headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        while job['status'] not in ('done', 'failed'):
+            time.sleep(self.poll_interval)
+            job = self._request('GET', f"/insert_jobs/{job['job_id']}")
+        return job
+
+    def delete(self, ids: list[int]):
+        return self._request('POST', '/delete_arts', json=[int(art_id) for art_id in ids])
+
+    def collection_stats(self) -> dict:
+        """{"collection": name, "backend": ..., "arts": live art count} of the server's collection"""
+        return self._request('GET', '/collection_stats')
+
+    def existing(self, ids: list[int]) -> set[int]:
+        """the ids that are in the collection"""
+        found = set()
+        for i in range(0, len(ids), self.lookup_batch):
+            rows = self._request('POST', '/get_arts_data', json={'ids': ids[i: i + self.lookup_batch],
+                                                                   'fields': ['img_name']})
+            found.update(row['id'] for row in rows)
+        return found
+
+
+class Checkpoint:
+    """
+    json file with the csv position of the last committed chunk and a fingerprint per loaded id.
+    the position is only trusted while the csv file is the same one (size + mtime), the position and the
+    fingerprints only while the collection is the one they were loaded into. validate() then drops the
+    fingerprints of the loaded ids the collection no longer has (recreated, or deleted by someone else).
+    """
+
+    def __init__(self, path: str, csv_path: str, collection: str):
+        self.path = path
+        stat = os.stat(csv_path)
+        self.csv_stamp = [stat.st_size, stat.st_mtime_ns]
+        self.collection = collection
+        self.rows_done = 0
+        self.fingerprints = {}  # id -> fingerprint of the committed row
+        self.files = {}  # image path -> [size, mtime_ns, sha256], skips re-hashing untouched images
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.files = state.get('files', {})
+            if state.get('collection') != collection:
+                logger.warning('checkpoint %s was written for collection %s, the server has %s, loading every row again',
+                               path, state.get('collection'), collection)
+                return
+            if state.get('csv_stamp') == self.csv_stamp:
+                self.rows_done = state.get('rows_done', 0)
+            self.fingerprints = state.get('fingerprints', {})
+
+    def validate(self, existing) -> int:
+        """
+        keep the fingerprints of the ids existing(ids) -> set still finds, return how many were dropped.
+        the dropped ids are loaded again, a rescan from the first row reaches the ones before the resume position
+        """
+        found = existing([int(art_id) for art_id in self.fingerprints])
+        lost = [art_id for art_id in self.fingerprints if int(art_id) not in found]
+        for art_id in lost:
+            del self.fingerprints[art_id]
+        if lost:
+            logger.warning('%d loaded arts are no longer in collection %s, they are loaded again',
+                           len(lost), self.collection)
+            self.rows_done = 0
+        return len(lost)
+
+    def image_digest(self, path: str) -> str:
+        stat = os.stat(path)
+        known = self.files.get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = file_digest(path)
+        self.files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'csv_stamp': self.csv_stamp, 'collection': self.collection,
+                       'rows_done': self.rows_done, 'fingerprints': self.fingerprints, 'files': self.files},
+                      f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+class CatalogLoader:
+    """client is a ServerClient (upsert_chunk, delete, collection_stats, existing)"""
+
+    def __init__(self, client: ServerClient, csv_path: str, images_dir: str, checkpoint_path: str,
+                 chunk_size: int = 256):
+        self.client = client
+        self.csv_path = csv_path
+        self.images_dir = images_dir
+        self.chunk_size = chunk_size
+        self.checkpoint = Checkpoint(checkpoint_path, csv_path, client.collection_stats()['collection'])
+        lost = self.checkpoint.validate(client.existing)
+        self.stats = {'rows': 0, 'resumed_past': self.checkpoint.rows_done, 'lost': lost, 'unchanged': 0,
+                      'no_image': 0, 'bad_row': 0, 'loaded': 0, 'failed': 0, 'deleted': 0}
+
+    def _rows(self):
+        with open(self.csv_path, encoding='utf-8-sig', newline='') as f:
+            yield from csv.DictReader(f)
+
+    def _art(self, row: dict) -> tuple[dict, str] | None:
+        """(insert record, fingerprint) of a row, None when the row has to be skipped"""
+        try:
+            art_id = int(row['id'])
+        except (KeyError, TypeError, ValueError):
+            self.stats['bad_row'] += 1
+            return None
+        path = os.path.join(self.images_dir, f'{art_id}.jpg')
+        if not os.path.exists(path):
+            self.stats['no_image'] += 1
+            return None
+
+        fields = row_fields(row)
+        fields.setdefault('img_name', str(art_id))
+        fingerprint = hashlib.sha256(json.dumps([self.checkpoint.image_digest(path), fields], sort_keys=True,
+                                                ensure_ascii=False).encode()).hexdigest()
+        size = [int(fields.get('width', 0)), int(fields.get('height', 0))]
+        return {'id': art_id, 'url': str(Path(path).resolve()), 'size': size, **fields}, fingerprint
+
+    def _commit(self, chunk: list[tuple[dict, str]], rows_done: int):
+        job = self.client.upsert_chunk([record for record, _ in chunk])
+        if job['status'] == 'failed':
+            logger.warning('insert job %s failed: %s', job['job_id'], job['error'])
+            failed = {record['id'] for record, _ in chunk}
+        else:
+            failed = {failure['id'] for failure in job['failures']}
+        for record, fingerprint in chunk:
+            if record['id'] in failed:
+                self.checkpoint.fingerprints.pop(str(record['id']), None)  # retried on the next run
+            else:
+                self.checkpoint.fingerprints[str(record['id'])] = fingerprint
+        self.stats['loaded'] += len(chunk) - len(failed)
+        self.stats['failed'] += len(failed)
+        self.checkpoint.rows_done = rows_done
+        self.checkpoint.save()
+        logger.info('committed %d arts (%d failed), %d rows done', len(chunk) - len(failed), len(failed), rows_done)
+
+    def run(self, delete_missing: bool = False) -> dict:
+        start = self.checkpoint.rows_done
+        seen = set()
+        chunk = []
+        n_rows = 0
+        for n_rows, row in enumerate(self._rows(), start=1):
+            self.stats['rows'] += 1
+            if row.get('id'):
+                seen.add(str(row['id']).strip())
+            if n_rows <= start:
+                continue  # committed by the run that crashed
+            prepared = self._art(row)
+            if prepared is None:
+                continue
+            record, fingerprint = prepared
+            if self.checkpoint.fingerprints.get(str(record['id'])) == fingerprint:
+                self.stats['unchanged'] += 1
+                continue
+            chunk.append(prepared)
+            if len(chunk) >= self.chunk_size:
+                self._commit(chunk, n_rows)
+                chunk = []
+        if chunk:
+            self._commit(chunk, n_rows)
+
+        if delete_missing:
+            missing = [art_id for art_id in self.checkpoint.fingerprints if art_id not in seen]
+            if missing:
+                self.client.delete([int(art_id) for art_id in missing])
+                for art_id in missing:
+                    del self.checkpoint.fingerprints[art_id]
+            self.stats['deleted'] = len(missing)
+
+        # the pass is complete, the next run starts from the first row again (and skips what is unchanged)
+        self.checkpoint.rows_done = 0
+        self.checkpoint.save()
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', required=True, help='Products-Export-*.csv')
+    parser.add_argument('--images-dir', default='data')
+    parser.add_argument('--server', default='http://localhost:8000', help='the running art matching server')
+    parser.add_argument('--chunk', type=int, default=256, help='arts embedded and committed together')
+    parser.add_argument('--checkpoint', help='default: volumes/catalog_loader/{csv name}.json')
+    parser.add_argument('--delete-missing', action='store_true',
+                        help='delete loaded arts that are no longer in the csv')
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    client = ServerClient(args.server)
+    checkpoint = args.checkpoint or os.path.join('volumes', 'catalog_loader', f'{Path(args.csv).stem}.json')
+    loader = CatalogLoader(client, args.csv, args.images_dir, checkpoint, args.chunk)
+    print(json.dumps(loader.run(delete_missing=args.delete_missing), indent=2))
+
+
+if __name__ == '__main__':
+    main()
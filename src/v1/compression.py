@@ -0,0 +1,108 @@
+"""
+asgi middleware that inflates compressed request bodies (Content-Encoding: gzip / zstd) before fastapi
+parses them, so bulk insert clients can send their json chunks compressed.
+zstd needs the optional `zstandard` package; without it zstd bodies are answered with 415.
+"""
+import io
+import json
+import zlib
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def _gunzip(body: bytes, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    data = decompressor.decompress(body, max_size + 1)
+    if len(data) > max_size:
+        raise BodyTooLarge()
+    if not decompressor.eof:
+        raise zlib.error('truncated gzip body')
+    return data
+
+
+def _unzstd(body: bytes, max_size: int) -> bytes:
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+        data = reader.read(max_size + 1)
+    if len(data) > max_size:
+        raise BodyTooLarge()
+    return data
+
+
+def supported_encodings() -> list[str]:
+    return ['gzip', 'zstd'] if zstandard is not None else ['gzip']
+
+
+class DecompressMiddleware:
+    """
+    app.add_middleware(DecompressMiddleware). bodies without a Content-Encoding pass through untouched.
+    the inflated size is capped by max_size (413 above it) so a small compressed body can't blow up memory.
+    """
+
+    def __init__(self, app, max_size: int = 512 * 2 ** 20):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        encoding = dict(scope['headers']).get(b'content-encoding', b'').decode('latin-1').strip().lower()
+        if encoding in ('', 'identity'):
+            return await self.app(scope, receive, send)
+
+        decode = {'gzip': _gunzip, 'x-gzip': _gunzip}
+        if zstandard is not None:
+            decode['zstd'] = _unzstd
+        if encoding not in decode:
+            return await self._error(send, 415, f'unsupported Content-Encoding {encoding}, '
+                                                f'supported: {", ".join(supported_encodings())}')
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body = b''.join(chunks)
+
+        try:
+            # inflating a large chunk is cpu work, keep it off the event loop
+            data = await asyncio.to_thread(decode[encoding], body, self.max_size)
+        except BodyTooLarge:
+            return await self._error(send, 413, f'decompressed body is larger than {self.max_size} bytes')
+        except Exception as e:
+            return await self._error(send, 400, f'invalid {encoding} body: {type(e).__name__}: {e}')
+        logger.debug('inflated %s body %d -> %d bytes', encoding, len(body), len(data))
+
+        headers = [(name, value) for name, value in scope['headers']
+                   if name not in (b'content-encoding', b'content-length')]
+        headers.append((b'content-length', str(len(data)).encode()))
+        delivered = False
+
+        async def inflated_receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {'type': 'http.request', 'body': data, 'more_body': False}
+            return await receive()  # disconnect
+
+        await self.app({**scope, 'headers': headers}, inflated_receive, send)
+
+    @staticmethod
+    async def _error(send, status: int, detail: str):
+        body = json.dumps({'detail': detail}).encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,257 @@
+"""
+near-duplicate arts of the catalog (reprints, size variants, re-uploads under a new id).
+
+two checks at ingest:
+- before encoding, a 64 bit dHash of the image. an art within hash_distance bits of a stored art is a copy:
+  it is inserted with the vector of that art and never goes through the model.
+- after encoding, the cosine similarity to the nearest stored art (and to the rest of its insert batch).
+  above embed_threshold the art joins that art's group, once its insert batch is written.
+
+every group has a canonical id (its first art), searches collapse a group to its best ranked art.
+"""
+import os
+import json
+import logging
+import threading
+import numpy as np
+from PIL import Image
+from src.v1 import metrics
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+
+class ConfigDedup:
+    def __init__(self):
+        self.enabled = True
+        self.hash_distance = 2  # max differing dHash bits for two files to be the same image (skips the model)
+        self.embed_threshold = 0.97  # cosine similarity above which an encoded art joins its neighbour's group
+        self.dir = os.path.join('volumes', 'dedup')  # None keeps the index in memory only
+        self.save_delay_s = 10  # changes are written at most this long after they happen, one write for a burst
+
+
+def dhash(path: str, hash_size: int = 8) -> int:
+    """difference hash: a (hash_size+1) x hash_size grayscale thumbnail, one bit per horizontal gradient"""
+    with Image.open(path) as img:
+        img.draft('L', (4 * hash_size, 4 * hash_size))  # jpeg decodes at 1/8 scale, the hash needs 9x8 pixels
+        pixels = np.asarray(img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR),
+                            dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class DuplicateIndex:
+    """
+    id -> dHash of every ingested art, and member id -> canonical id of the grouped ones.
+    hashes are looked up by bands: with hash_distance d the 64 bits are cut into d + 1 bands, two hashes
+    within d bits agree on at least one whole band, so only the arts sharing a band are compared.
+    """
+
+    def __init__(self, config: ConfigDedup, name: str, load: bool = True):
+        self.config = config
+        self.path = os.path.join(config.dir, f'{name}.json') if config.dir is not None else None
+        n_bands = config.hash_distance + 1
+        edges = np.linspace(0, HASH_BITS, n_bands + 1).astype(int)
+        self._bands = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(edges[:-1], edges[1:])]  # (shift, mask)
+        self._buckets = [{} for _ in self._bands]  # band value -> set of ids
+        self.hashes = {}  # id -> dHash
+        self.canonical = {}  # member id -> canonical id, canonical ids aren't keys
+        self.members = {}  # canonical id -> set of member ids
+        self.stats = {'hash_copies': 0, 'embed_grouped': 0}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer of the json file at a time
+        self._dirty = False  # changed since the last save
+        self._save_timer = None
+        if self.path is not None and os.path.exists(self.path):
+            if load:
+                self.load()
+            else:
+                os.remove(self.path)  # a fresh collection, the saved groups belong to the dropped one
+
+    def _band_values(self, h: int):
+        return [(h >> shift) & mask for shift, mask in self._bands]
+
+    def set_hash(self, art_id: int, h: int):
+        with self._lock:
+            old = self.hashes.get(art_id)
+            if old is not None:
+                self._unbucket(art_id, old)
+            self.hashes[art_id] = h
+            for bucket, value in zip(self._buckets, self._band_values(h)):
+                bucket.setdefault(value, set()).add(art_id)
+            self._dirty = True
+
+    def _unbucket(self, art_id: int, h: int):
+        for bucket, value in zip(self._buckets, self._band_values(h)):
+            ids = bucket.get(value)
+            if ids is not None:
+                ids.discard(art_id)
+                if not ids:
+                    del bucket[value]
+
+    def match(self, h: int, exclude_id: int | None = None) -> int | None:
+        """canonical id of the closest stored art within hash_distance bits, None when there is none"""
+        with self._lock:
+            candidates = set()
+            for bucket, value in zip(self._buckets, self._band_values(h)):
+                candidates |= bucket.get(value, set())
+            candidates.discard(exclude_id)
+            best, best_distance = None, self.config.hash_distance + 1
+            for art_id in sorted(candidates):  # ties go to the smaller id
+                distance = (self.hashes[art_id] ^ h).bit_count()
+                if distance < best_distance:
+                    best, best_distance = art_id, distance
+            return None if best is None else self.canonical.get(best, best)
+
+    def group(self, art_id: int, other_id: int):
+        """merge the group of art_id into the group of other_id, whose canonical id is kept"""
+        with self._lock:
+            self._group(art_id, other_id)
+
+    def _group(self, art_id: int, other_id: int):
+        root = self.canonical.get(other_id, other_id)
+        old_root = self.canonical.get(art_id, art_id)
+        if old_root == root:
+            return
+        moved = self.members.pop(old_root, set()) | {old_root}
+        for member in moved:
+            self.canonical[member] = root
+        self.members.setdefault(root, set()).update(moved)
+        self._dirty = True
+
+    def add_groups(self, pairs, check: str):
+        """
+        group every (art id, duplicate id) pair, called once the arts are written.
+        check is 'hash' or 'embedding', an art that is already grouped is left in its group.
+        """
+        stat = {'hash': 'hash_copies', 'embedding': 'embed_grouped'}[check]
+        grouped = 0
+        with self._lock:
+            for art_id, other_id in pairs:
+                art_id, other_id = int(art_id), int(other_id)
+                if art_id == other_id or art_id in self.canonical:
+                    continue
+                self._group(art_id, other_id)
+                grouped += 1
+            self.stats[stat] += grouped
+        if grouped:
+            metrics.duplicates.inc(grouped, check=check)
+
+    def _ungroup(self, art_id: int):
+        """take art_id out of its group, a canonical hands the group over to its smallest member"""
+        root = self.canonical.pop(art_id, None)
+        if root is not None:
+            members = self.members[root]
+            members.discard(art_id)
+            if not members:
+                del self.members[root]
+            return
+        members = self.members.pop(art_id, None)
+        if members:
+            new_root = min(members)
+            del self.canonical[new_root]
+            members.discard(new_root)
+            for member in members:
+                self.canonical[member] = new_root
+            if members:
+                self.members[new_root] = members
+
+    def remove(self, ids):
+        """forget deleted (or re-uploaded) arts"""
+        with self._lock:
+            for art_id in ids:
+                art_id = int(art_id)
+                self._ungroup(art_id)
+                h = self.hashes.pop(art_id, None)
+                if h is not None:
+                    self._unbucket(art_id, h)
+            self._dirty = True
+
+    def embedding_duplicates(self, ids: np.ndarray, vectors: np.ndarray, search) -> list[tuple[int, int]]:
+        """
+        (art id, duplicate id) of the not yet grouped arts of an insert batch: the nearest stored art
+        (search(vectors, top_k) -> (ids, scores), called before the batch is inserted so an art doesn't find itself)
+        or else the first earlier art of the batch above embed_threshold. nothing is grouped here, the caller
+        passes the pairs to add_groups once the batch is written.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            todo = np.array([art_id not in self.canonical for art_id in ids.tolist()], dtype=bool)
+        if not todo.any():
+            return []
+        threshold = self.config.embed_threshold
+        duplicate_of = {}
+        found_ids, found_scores = search(vectors[todo], top_k=2)  # the art itself is there on an upsert
+        for art_id, row_ids, row_scores in zip(ids[todo].tolist(), found_ids, found_scores):
+            for other_id, score in zip(row_ids.tolist(), row_scores.tolist()):
+                if other_id >= 0 and other_id != art_id and score >= threshold:
+                    duplicate_of[art_id] = other_id
+                    break
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        unit = vectors / np.where(norms > 0, norms, 1)
+        similar = np.triu(unit @ unit.T >= threshold, k=1)
+        for first, second in np.argwhere(similar & todo[None, :]):
+            art_id = int(ids[second])
+            if art_id != ids[first] and art_id not in duplicate_of:
+                duplicate_of[art_id] = int(ids[first])
+        return list(duplicate_of.items())
+
+    def canonical_of(self, ids) -> np.ndarray:
+        """canonical id of every id (an ungrouped id is its own canonical)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        canonical = self.canonical
+        if not canonical:
+            return ids
+        return np.fromiter((canonical.get(art_id, art_id) for art_id in ids.tolist()), dtype=np.int64, count=len(ids))
+
+    def summary(self) -> dict:
+        return {'hashed': len(self.hashes), 'groups': len(self.members), 'grouped_arts': len(self.canonical),
+                **self.stats}
+
+    def schedule_save(self):
+        """save within save_delay_s, the changes made until then go into the same write"""
+        if self.path is None:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.config.save_delay_s, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self):
+        """write the index now if it changed since the last save"""
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                if not self._dirty:
+                    return
+                state = {'hashes': {art_id: f'{h:016x}' for art_id, h in self.hashes.items()},
+                         'canonical': dict(self.canonical)}
+                self._dirty = False
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = f'{self.path}.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.path)
+            except Exception:
+                self._dirty = True  # retried by the next save
+                raise
+
+    def load(self):
+        with open(self.path) as f:
+            state = json.load(f)
+        for art_id, h in state.get('hashes', {}).items():
+            self.set_hash(int(art_id), int(h, 16))
+        for member, root in state.get('canonical', {}).items():
+            self.canonical[int(member)] = root
+            self.members.setdefault(root, set()).add(int(member))
+        self._dirty = False
+        logger.info('duplicate index loaded: %s', self.summary())
@@ -0,0 +1,99 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from src.v1 import metrics
+
+
+class ConfigEmbedCache:
+    def __init__(self):
+        self.path = 'volumes/embed_cache.sqlite'
+        self.max_entries = 100_000  # ~300MB of 768-d float32 vectors, least recently used are evicted
+
+
+def file_digest(path: str) -> str:
+    """content hash of an image file, so renamed / re-downloaded copies still hit the cache"""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+class EmbedCache:
+    """
+    Persistent image embedding cache keyed by (file content hash, model name, preprocessing version).
+    vectors are stored as raw float32 blobs in a single sqlite file, with LRU eviction past max_entries.
+    """
+
+    def __init__(self, config: ConfigEmbedCache):
+        self.path = config.path
+        self.max_entries = config.max_entries
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL, last_used INTEGER NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    @staticmethod
+    def make_key(digest: str, model_name: str, preprocess_version: int) -> str:
+        return f'{model_name}:{preprocess_version}:{digest}'
+
+    def __len__(self):
+        return self._size
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """return {key: vector} for the keys that are in the cache"""
+        if not keys:
+            return {}
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', keys
+            ).fetchall()
+            if rows:
+                self._conn.execute(
+                    f'UPDATE embeddings SET last_used = ? WHERE key IN ({",".join("?" * len(rows))})',
+                    [time.time_ns()] + [key for key, _ in rows]
+                )
+                self._conn.commit()
+
+        found = {key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows}
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+        metrics.cache_lookup('embed', len(found), len(set(keys)) - len(found))
+        return found
+
+    def put_many(self, keys: list[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        now = time.time_ns()
+        with self._lock:
+            existing = self._conn.execute(
+                f'SELECT COUNT(*) FROM embeddings WHERE key IN ({",".join("?" * len(keys))})', keys
+            ).fetchone()[0] if keys else 0
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)',
+                [(key, vector.shape[0], vector.tobytes(), now) for key, vector in zip(keys, vectors)]
+            )
+            self._size += len(set(keys)) - existing
+            if self._size > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (self._size - self.max_entries,)
+                )
+                self._size = self.max_entries
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM embeddings')
+            self._conn.commit()
+            self._size = 0
@@ -3,9 +3,14 @@ import torch
 from PIL import Image, ImageOps
 import numpy as np
 from sklearn.preprocessing import normalize
+from src.v1 import metrics
 
 
 class EmbedModel:
+    name = 'base'
+    dim = 768
+    input_shape = (3, 224, 224)  # shape of one preprocessed image
+    preprocess_version = 1  # bump when preprocessing changes, it invalidates the embedding cache
 
     def __init__(self):
         pass
@@ -35,9 +40,17 @@ class EmbedModel:
         ])
         return batch_tensor
     
-    def predict_imgs(self, urls: list[str]) -> np.ndarray:
+    def preprocess_imgs(self, urls: list[str]) -> torch.Tensor:
+        """decode + preprocess a batch of image files into the model input tensor (cpu bound)"""
+        return self.preprocessing(urls)
+
+    def encode_imgs(self, imgs: torch.Tensor) -> np.ndarray:
+        """model forward on a preprocessed batch, return l2 normalized embeddings"""
         pass
 
+    def predict_imgs(self, urls: list[str]) -> np.ndarray:
+        return self.encode_imgs(self.preprocess_imgs(urls))
+
     def predict_text(self, texts: list[str]) -> np.ndarray:
         pass
 
@@ -48,6 +61,7 @@ class ConfigClip:
         self.device = 'cuda' if torch.cuda.is_available() else 'mps' if torch.backends.mps.is_available() else 'cpu'
         self.name = self.available_models[-1]
         self.model_dir = 'volumes'
+        self.backend = 'torch'  # 'torch' | 'onnx' (exported towers on onnxruntime, see src/v1/onnx_embed.py)
 
 
 class ClipEmbed(EmbedModel):
@@ -63,12 +77,19 @@ class ClipEmbed(EmbedModel):
         self.dim = 768
         self.model, self.model_preprocess = clip.load(self.name, device=config.device, download_root=self.model_dir)
         self.model.eval()
+        resolution = self.model.visual.input_resolution
+        self.input_shape = (3, resolution, resolution)
 
-    def predict_imgs(self, urls: list[str]) -> np.ndarray:
+    def preprocess_imgs(self, urls: list[str]) -> torch.Tensor:
         # imgs = self.preprocessing(urls)
 
-        imgs = [self.model_preprocess(Image.open(img_path).convert("RGB")) for img_path in urls]
-        imgs = torch.stack(imgs).to(self.device)
+        with metrics.stage('decode'):
+            imgs = [Image.open(img_path).convert("RGB") for img_path in urls]
+        with metrics.stage('preprocess'):
+            return torch.stack([self.model_preprocess(img) for img in imgs])
+
+    def encode_imgs(self, imgs: torch.Tensor) -> np.ndarray:
+        imgs = imgs.to(self.device)
 
         with torch.no_grad():
             embedding = self.model.encode_image(imgs)
@@ -77,7 +98,7 @@ class ClipEmbed(EmbedModel):
         return normalize_embedding
 
     def predict_text(self, texts: list[str]) -> np.ndarray:
-        text_tokens = clip.tokenize(texts).to(self.device)
+        text_tokens = clip.tokenize(texts, truncate=True).to(self.device)
         with torch.no_grad():
             embedding = self.model.encode_text(text_tokens)
             embedding = embedding.cpu().numpy()
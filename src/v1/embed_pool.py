@@ -0,0 +1,246 @@
+"""
+pool of embedding worker processes for ingestion on many-core cpu nodes.
+each worker loads its own copy of the model with a pinned torch thread count (and cpu affinity where the
+os supports it). preprocessed batches go in and embeddings come back through shared memory slots,
+only (task id, slot, n) tuples travel through the queues.
+"""
+import os
+import queue
+import atexit
+import logging
+import threading
+import itertools
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+import numpy as np
+from src.v1.embed_model import EmbedModel
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigEmbedPool:
+    def __init__(self):
+        self.workers = 0  # embedding processes, 0 keeps encoding in the api process
+        self.threads_per_worker = 2  # torch intra-op threads of each worker
+        self.pin_cpus = True  # give every worker its own cpus (linux only)
+        self.slots_per_worker = 2  # shared memory batches in flight per worker
+
+
+def _worker(index: int, model_factory, threads: int, cpus: list[int] | None, slot_names: list[tuple[str, str]],
+            input_shape: tuple, dim: int, max_batch: int, tasks, results):
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already set by the model import
+
+    slots = []
+    for input_name, output_name in slot_names:
+        input_shm = shared_memory.SharedMemory(name=input_name)
+        output_shm = shared_memory.SharedMemory(name=output_name)
+        slots.append((input_shm, output_shm,
+                      np.ndarray((max_batch, *input_shape), dtype=np.float32, buffer=input_shm.buf),
+                      np.ndarray((max_batch, dim), dtype=np.float32, buffer=output_shm.buf)))
+
+    try:
+        model = model_factory()
+    except Exception as e:
+        results.put((None, None, f'worker {index} failed to load the model: {type(e).__name__}: {e}'))
+        return
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, slot, n = task
+        _, _, inputs, outputs = slots[slot]
+        try:
+            # the tensor is a view on the shared memory, no copy on the way in
+            outputs[:n] = model.encode_imgs(torch.from_numpy(inputs[:n]))
+            results.put((task_id, slot, None))
+        except Exception as e:
+            results.put((task_id, slot, f'{type(e).__name__}: {e}'))
+
+    for input_shm, output_shm, _, _ in slots:
+        input_shm.close()
+        output_shm.close()
+
+
+class EmbedWorkerPool:
+    """
+    submit(tensor) -> Future of the [n, dim] embeddings. submit blocks while every shared memory slot
+    is in use, which bounds the memory of the pipeline. results of concurrent submits can complete
+    out of order, each future holds its own batch so callers keep their order.
+    """
+
+    def __init__(self, model_factory, input_shape: tuple, dim: int, max_batch: int, config: ConfigEmbedPool):
+        self.input_shape = tuple(input_shape)
+        self.dim = dim
+        self.max_batch = max_batch
+        self.config = config
+        ctx = mp.get_context('spawn')  # fork + torch threads deadlocks
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._futures = {}  # task id -> (Future, n, slot)
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._error = None
+
+        n_slots = config.workers * config.slots_per_worker
+        input_bytes = max_batch * int(np.prod(self.input_shape)) * 4
+        self._slots = [(shared_memory.SharedMemory(create=True, size=input_bytes),
+                        shared_memory.SharedMemory(create=True, size=max_batch * dim * 4)) for _ in range(n_slots)]
+        self._inputs = [np.ndarray((max_batch, *self.input_shape), dtype=np.float32, buffer=i.buf) for i, _ in self._slots]
+        self._outputs = [np.ndarray((max_batch, dim), dtype=np.float32, buffer=o.buf) for _, o in self._slots]
+        self._free = queue.Queue()
+        self._in_use = set()  # slots handed out by submit, a slot is only given back once
+        for slot in range(n_slots):
+            self._free.put(slot)
+
+        n_cpus = os.cpu_count() or 1
+        slot_names = [(i.name, o.name) for i, o in self._slots]
+        self._processes = []
+        for index in range(config.workers):
+            cpus = None
+            if config.pin_cpus:
+                first = index * config.threads_per_worker
+                cpus = sorted({cpu % n_cpus for cpu in range(first, first + config.threads_per_worker)})
+            process = ctx.Process(target=_worker, name=f'embed-worker-{index}', daemon=True,
+                                  args=(index, model_factory, config.threads_per_worker, cpus, slot_names,
+                                        self.input_shape, dim, max_batch, self._tasks, self._results))
+            process.start()
+            self._processes.append(process)
+
+        self._collector = threading.Thread(target=self._collect, name='embed-pool-results', daemon=True)
+        self._collector.start()
+        atexit.register(self.close)
+        logger.info('embedding pool: %d workers x %d threads, %d shared memory slots of %.1fMB',
+                    config.workers, config.threads_per_worker, n_slots, input_bytes / 2 ** 20)
+
+    def submit(self, imgs) -> Future:
+        """imgs: preprocessed [n, *input_shape] tensor / array with n <= max_batch"""
+        imgs = imgs.numpy() if hasattr(imgs, 'numpy') else np.asarray(imgs)
+        n = len(imgs)
+        if n > self.max_batch:
+            raise ValueError(f'batch of {n} is larger than the pool max_batch {self.max_batch}')
+        if self._error is not None:
+            raise RuntimeError(f'embedding pool is broken: {self._error}')
+
+        slot = self._free.get()
+        with self._lock:
+            self._in_use.add(slot)
+        if self._error is not None:  # broke while we waited for the slot
+            self._release(slot)
+            raise RuntimeError(f'embedding pool is broken: {self._error}')
+        self._inputs[slot][:n] = imgs
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._futures[task_id] = (future, n, slot)
+        self._tasks.put((task_id, slot, n))
+        return future
+
+    def encode(self, imgs) -> np.ndarray:
+        imgs = imgs.numpy() if hasattr(imgs, 'numpy') else np.asarray(imgs)
+        futures = [self.submit(imgs[i: i + self.max_batch]) for i in range(0, len(imgs), self.max_batch)]
+        return np.concatenate([future.result() for future in futures]) if futures \
+            else np.empty((0, self.dim), dtype=np.float32)
+
+    def _collect(self):
+        while True:
+            try:
+                task_id, slot, error = self._results.get(timeout=1)
+            except queue.Empty:
+                dead = [p.name for p in self._processes if not p.is_alive()]
+                if dead and self._error is None and self._processes:
+                    self._fail(f'workers exited: {dead}')
+                continue
+            except (EOFError, OSError):
+                return  # closed
+            if task_id is None:
+                self._fail(error)
+                continue
+            with self._lock:
+                pending = self._futures.pop(task_id, None)
+            if pending is None:
+                continue  # already failed by _fail
+            future, n, _ = pending
+            if error is None:
+                embeddings = self._outputs[slot][:n].copy()
+                self._release(slot)
+                future.set_result(embeddings)
+            else:
+                self._release(slot)
+                future.set_exception(RuntimeError(f'embedding worker failed: {error}'))
+
+    def _release(self, slot: int):
+        """give a slot back to the free queue, a slot that is already free is not queued twice"""
+        with self._lock:
+            if slot not in self._in_use:
+                return
+            self._in_use.discard(slot)
+        self._free.put(slot)
+
+    def _fail(self, error: str):
+        logger.error('embedding pool: %s', error)
+        self._error = error
+        # stop the workers first, a live one could still write a late result into a slot given back below
+        processes, self._processes = self._processes, []
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout=10)
+        with self._lock:
+            pending, self._futures = self._futures, {}
+        for future, _, slot in pending.values():
+            self._release(slot)  # unblocks submitters waiting for a slot, they see the error
+            future.set_exception(RuntimeError(f'embedding pool is broken: {error}'))
+
+    def close(self):
+        processes, self._processes = self._processes, []
+        for _ in processes:
+            self._tasks.put(None)
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for input_shm, output_shm in self._slots:
+            for shm in (input_shm, output_shm):
+                shm.close()
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+        self._slots = []
+
+
+class PooledEmbedModel(EmbedModel):
+    """
+    the local model preprocesses and embeds text, image batches are encoded by the worker pool.
+    GenArtImages submits batches from its preprocess threads, so every worker has a batch in flight.
+    """
+
+    def __init__(self, model: EmbedModel, pool: EmbedWorkerPool):
+        self.model = model
+        self.pool = pool
+        self.name = model.name
+        self.dim = model.dim
+        self.input_shape = model.input_shape
+        self.preprocess_version = model.preprocess_version
+
+    def preprocess_imgs(self, urls: list[str]):
+        return self.model.preprocess_imgs(urls)
+
+    def encode_imgs(self, imgs) -> np.ndarray:
+        return self.pool.encode(imgs)
+
+    def submit_encode(self, imgs) -> Future:
+        return self.pool.submit(imgs)
+
+    def predict_text(self, texts: list[str]) -> np.ndarray:
+        return self.model.predict_text(texts)
@@ -0,0 +1,96 @@
+import numpy as np
+
+FUSION_METHODS = ('borda', 'rrf', 'score')
+
+
+def pad_rankings(rankings: list[list[int]]) -> np.ndarray:
+    """ragged lists of ids -> [n, max_len] int64 array padded with -1"""
+    max_len = max((len(r) for r in rankings), default=0)
+    ids = np.full((len(rankings), max_len), -1, dtype=np.int64)
+    for row, ranking in enumerate(rankings):
+        ids[row, :len(ranking)] = ranking
+    return ids
+
+
+def _contributions(ids: np.ndarray, scores: np.ndarray | None, method: str, rrf_k: int) -> np.ndarray:
+    """points every (list, rank) cell gives to its id, same shape as ids, 0 for padding"""
+    valid = ids >= 0
+    ranks = np.broadcast_to(np.arange(ids.shape[1]), ids.shape)
+
+    if method == 'borda':
+        # the longest list gives (len - rank) points, like the original Logic.borda_count
+        max_rank = valid.sum(axis=1).max(initial=0)
+        points = (max_rank - ranks).astype(np.float64)
+    elif method == 'rrf':
+        points = 1.0 / (rrf_k + ranks + 1)
+    elif method == 'score':
+        if scores is None:
+            raise ValueError('score fusion needs the similarity scores')
+        points = scores.astype(np.float64)
+    else:
+        raise ValueError(f'fusion method should be one of {FUSION_METHODS}, got: {method}')
+
+    return np.where(valid, points, 0.0)
+
+
+def fuse_scores(liked_ids: np.ndarray, liked_scores: np.ndarray | None = None,
+                disliked_ids: np.ndarray | None = None, disliked_scores: np.ndarray | None = None,
+                method: str = 'borda', dislike_weight: float = 1.0, rrf_k: int = 60) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Aggregate ranked candidate lists into one score per candidate.
+    liked_* / disliked_* are [n, k] arrays (rows padded with id -1), likes add points and dislikes subtract them.
+    return (candidate_ids, totals), candidate_ids sorted ascending.
+    """
+    parts_ids = [np.asarray(liked_ids, dtype=np.int64).reshape(-1)]
+    parts_points = [_contributions(np.atleast_2d(liked_ids), liked_scores, method, rrf_k).reshape(-1)]
+
+    if disliked_ids is not None and np.size(disliked_ids):
+        parts_ids.append(np.asarray(disliked_ids, dtype=np.int64).reshape(-1))
+        parts_points.append(-dislike_weight * _contributions(np.atleast_2d(disliked_ids), disliked_scores, method, rrf_k).reshape(-1))
+
+    all_ids = np.concatenate(parts_ids)
+    all_points = np.concatenate(parts_points)
+    valid = all_ids >= 0
+
+    candidates, inverse = np.unique(all_ids[valid], return_inverse=True)
+    totals = np.bincount(inverse, weights=all_points[valid], minlength=len(candidates))
+    return candidates, totals
+
+
+def top_n(candidates: np.ndarray, totals: np.ndarray, n: int | None, exclude=None, groups=None) -> np.ndarray:
+    """
+    ids of the n best candidates, best first. ids in `exclude` are masked out.
+    groups(ids) -> canonical id of every id (near duplicates): only the best candidate of a group is kept,
+    and a group with an excluded id is masked out as a whole.
+    ties are broken by the smaller id so the output is deterministic.
+    """
+    if exclude is not None and len(exclude):
+        exclude = np.fromiter(exclude, dtype=np.int64)
+        if groups is None:
+            keep = ~np.isin(candidates, exclude)
+        else:
+            keep = ~np.isin(groups(candidates), groups(exclude))
+        candidates, totals = candidates[keep], totals[keep]
+
+    if groups is not None and len(candidates):
+        order = np.lexsort((candidates, -totals))
+        _, first = np.unique(groups(candidates[order]), return_index=True)
+        best = order[np.sort(first)]
+        candidates, totals = candidates[best], totals[best]
+
+    if n is not None and n < len(candidates):
+        # argpartition keeps the n best (plus anything tied with the n-th) before the full sort
+        nth = np.argpartition(-totals, n - 1)[n - 1]
+        keep = totals >= totals[nth]
+        candidates, totals = candidates[keep], totals[keep]
+
+    order = np.lexsort((candidates, -totals))
+    return candidates[order][:n]
+
+
+def fuse(liked_ids, liked_scores=None, disliked_ids=None, disliked_scores=None, n: int | None = 6,
+         exclude=None, method: str = 'borda', dislike_weight: float = 1.0, rrf_k: int = 60, groups=None) -> list[int]:
+    """rank fusion of liked/disliked neighbour lists, return the top n ids (python ints), see top_n for groups"""
+    candidates, totals = fuse_scores(liked_ids, liked_scores, disliked_ids, disliked_scores,
+                                     method=method, dislike_weight=dislike_weight, rrf_k=rrf_k)
+    return top_n(candidates, totals, n, exclude=exclude, groups=groups).tolist()
@@ -0,0 +1,98 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from src.v1.art_image import ArtImage
+
+
+class IngestJob:
+    """state of one background insert, updated by the ingest worker and read by the status endpoint"""
+
+    def __init__(self, total: int, upsert: bool = False):
+        self.id = uuid.uuid4().hex
+        self.upsert = upsert
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.total = total
+        self.inserted = 0
+        self.failures = []  # [{'id': art id, 'error': message}]
+        self.error = None  # set when the whole job failed
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def on_inserted(self, arts: list[ArtImage]):
+        with self._lock:
+            self.inserted += len(arts)
+
+    def on_error(self, art: ArtImage, exc: Exception):
+        with self._lock:
+            self.failures.append({'id': art.id, 'error': f'{type(exc).__name__}: {exc}'})
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            processed = self.inserted + len(self.failures)
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'upsert': self.upsert,
+                'total': self.total,
+                'inserted': self.inserted,
+                'failed': len(self.failures),
+                'progress': processed / self.total if self.total else 1.0,
+                'elapsed_s': round(elapsed, 3),
+                'throughput_per_s': round(processed / elapsed, 3) if elapsed else 0.0,
+                'failures': list(self.failures),
+                'error': self.error,
+            }
+
+
+class IngestJobs:
+    """
+    run inserts on a dedicated worker thread so the http request returns right away with a job id.
+    jobs run one after the other (they share the model and the db connection), the last
+    `max_jobs_kept` finished jobs are kept for the status endpoint.
+    """
+
+    def __init__(self, insert_fn, max_jobs_kept: int = 100):
+        self.insert_fn = insert_fn  # Logic.insert_art_images
+        self.max_jobs_kept = max_jobs_kept
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest')
+
+    def submit(self, imgs: list[ArtImage], upsert: bool = False) -> IngestJob:
+        job = IngestJob(total=len(imgs), upsert=upsert)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._evict()
+        self._executor.submit(self._run, job, imgs)
+        return job
+
+    def get(self, job_id: str) -> IngestJob | None:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def all(self) -> list[IngestJob]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(len(self.jobs) - self.max_jobs_kept, 0)]:
+            del self.jobs[job_id]
+
+    def _run(self, job: IngestJob, imgs: list[ArtImage]):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            self.insert_fn(imgs, on_inserted=job.on_inserted, on_error=job.on_error, upsert=job.upsert)
+            job.status = 'done'
+        except Exception as e:
+            job.error = f'{type(e).__name__}: {e}'
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
@@ -1,78 +1,399 @@
-from src.v1.art_image import GenArtImages, ArtImage
+from src.v1.art_image import GenArtImages, ArtImage, ArtBatch
 from src.db.db_api import DBApi
+from src.db import filters as search_filters
 from src.v1.embed_model import EmbedModel, ClipEmbed, ConfigClip
+from src.v1.embed_cache import EmbedCache, ConfigEmbedCache
+from src.v1.embed_pool import EmbedWorkerPool, PooledEmbedModel, ConfigEmbedPool
+from src.v1.batch_tuner import BatchTuner, ConfigBatchTuner
+from src.v1.result_cache import ResultCache, ConfigResultCache
+from src.v1.text_embed import TextEmbedCache, normalize_text
+from src.v1.dedup import DuplicateIndex, ConfigDedup, dhash
+from src.v1 import fusion, metrics
 from typing import Literal
+import os
+import time
+import atexit
+import logging
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from collections import defaultdict
 from tqdm import tqdm
 
+logger = logging.getLogger(__name__)
+
+class ConfigLogic:
+    def __init__(self):
+        self.warm_start = True  # attach to the existing collection instead of dropping and recreating it
+        self.background_model_load = True  # serve searches while the embedding model loads, see /ready
+        self.text_cache_size = 10_000
+        # weights of the hybrid text + likes query vector
+        self.text_weight = 1.0
+        self.liked_weight = 1.0
+        self.disliked_weight = 0.5
+
 
 class Logic:
 
-    def __init__(self):
-        self.db_api = DBApi(init=True)
-        self.embed_model: EmbedModel = ClipEmbed(ConfigClip())
-        self.batch_size = 4
-        self.gen_art_images = GenArtImages(self.embed_model, self.batch_size)
+    def __init__(self, config: ConfigLogic | None = None):
+        self.config = config or ConfigLogic()
+        self.startup_timings = {}  # phase -> seconds
 
+        t0 = time.perf_counter()
+        self.db_api = DBApi(init=not self.config.warm_start)
+        self.startup_timings.update({f'db.{phase}': t for phase, t in self.db_api.startup_timings().items()})
+        self.startup_timings['db'] = time.perf_counter() - t0
 
-    def insert_art_images(self, imgs: list[ArtImage]):
-        gen_embed = self.gen_art_images.gen_object(imgs)
-        for batch_obj in tqdm(gen_embed, desc=f'{len(imgs) / self.batch_size}'):
-            self.db_api.insert_arts(batch_obj)
+        self.preprocess_workers = os.cpu_count() or 1
+        self.fusion_method = 'borda'  # one of fusion.FUSION_METHODS
+        self.embed_cache = EmbedCache(ConfigEmbedCache())
+
+        # bumped on every catalog change, cached results from an older version are misses
+        self.catalog_version = 0
+        config_cache = ConfigResultCache()
+        self.result_cache = ResultCache(config_cache.max_results, config_cache.ttl_s)
+        self.neighbor_cache = ResultCache(config_cache.max_neighbors, config_cache.ttl_s)
+
+        # near duplicate groups, copies skip the model at ingest and searches collapse each group to one art
+        config_dedup = ConfigDedup()
+        self.dedup = DuplicateIndex(config_dedup, self.db_api.config_db.collection_name,
+                                    load=self.config.warm_start) if config_dedup.enabled else None
+        if self.dedup is not None:
+            atexit.register(self.dedup.save)  # the changes still waiting for a scheduled save
+
+        # searches only need the db, the model is needed for ingestion
+        self.model_ready = threading.Event()
+        self.model_error = None
+        if self.config.background_model_load:
+            threading.Thread(target=self._load_model, name='model-load', daemon=True).start()
+        else:
+            self._load_model()
+
+    def _load_model(self):
+        try:
+            t0 = time.perf_counter()
+            config_clip = ConfigClip()
+            config_pool = ConfigEmbedPool()
+            if config_clip.backend == 'onnx':
+                from src.v1.onnx_embed import OnnxClipEmbed, ConfigOnnx
+                model_factory = functools.partial(OnnxClipEmbed, ConfigOnnx())
+                # torch.set_num_threads doesn't reach an onnx session, the workers get their thread count here
+                config_worker = ConfigOnnx()
+                config_worker.intra_op_threads = config_pool.threads_per_worker
+                worker_factory = functools.partial(OnnxClipEmbed, config_worker)
+            else:
+                model_factory = worker_factory = functools.partial(ClipEmbed, config_clip)
+            self.embed_model: EmbedModel = model_factory()
+            self.startup_timings['model'] = time.perf_counter() - t0
+
+            use_pool = config_pool.workers > 0 and getattr(self.embed_model, 'device', 'cpu') == 'cpu'
+
+            # before model_ready is set, so /ready only reports once the batch sizes are final.
+            # with a pool the probes run the worker's model and thread count
+            t0 = time.perf_counter()
+            tuner = BatchTuner(self.embed_model, ConfigBatchTuner(),
+                               threads=config_pool.threads_per_worker if use_pool else None)
+            self.batch_size, self.insert_batch_size = tuner.tune(worker_factory if use_pool else model_factory)
+            self.startup_timings['batch_tune'] = time.perf_counter() - t0
+
+            if use_pool:
+                # image batches are encoded by worker processes, this process keeps preprocessing and text
+                t0 = time.perf_counter()
+                pool = EmbedWorkerPool(worker_factory, self.embed_model.input_shape, self.embed_model.dim,
+                                       self.batch_size, config_pool)
+                self.embed_model = PooledEmbedModel(self.embed_model, pool)
+                self.startup_timings['embed_pool'] = time.perf_counter() - t0
+
+            self.text_embed_cache = TextEmbedCache(self.embed_model, self.config.text_cache_size)
+            # with a pool, the prefetch window also keeps every embedding worker busy
+            prefetch = max(2 * self.preprocess_workers, 2 * config_pool.workers * config_pool.slots_per_worker)
+            self.gen_art_images = GenArtImages(self.embed_model, self.batch_size, cache=self.embed_cache,
+                                               num_workers=self.preprocess_workers, prefetch=prefetch)
+        except Exception as e:
+            self.model_error = f'{type(e).__name__}: {e}'
+            logger.error('failed to load the embedding model: %s', self.model_error)
+            raise
+        finally:
+            self.model_ready.set()
+        timings = {phase: round(t, 3) for phase, t in self.startup_timings.items()}
+        logger.info("startup timings: %s", timings)
+
+    def wait_for_model(self):
+        self.model_ready.wait()
+        if self.model_error is not None:
+            raise RuntimeError(f'embedding model is not available: {self.model_error}')
+
+    def readiness(self) -> dict:
+        model_loaded = self.model_ready.is_set() and self.model_error is None
+        return {
+            'ready': model_loaded,
+            'db_ready': True,  # the db is attached before Logic finishes constructing
+            'model_ready': model_loaded,
+            'model_error': self.model_error,
+            'startup_timings': {phase: round(t, 3) for phase, t in self.startup_timings.items()},
+        }
+
+
+    def insert_art_images(self, imgs: list[ArtImage], on_inserted=None, on_error=None, upsert: bool = False):
+        """
+        embed and insert the arts. on_inserted(arts) is called after every committed insert batch,
+        on_error(art, exc) for every art that failed (without it the first failure is raised).
+        with upsert, arts whose id already exists replace the stored row.
+        """
+        self.wait_for_model()
+        copies = []
+        if self.dedup is not None:
+            imgs, copies = self._split_copies(imgs)
+            if on_error is not None:
+                report_error = on_error
+
+                def on_error(art, exc):
+                    self.dedup.remove([art.id])  # not stored, later copies of it must not point at it
+                    report_error(art, exc)
+        self._encode_and_insert(imgs, on_inserted, on_error, upsert)
+        if copies:
+            self.db_api.flush()  # the canonical arts inserted above are readable
+            missing = self._insert_copies(copies, on_inserted, on_error, upsert)
+            self._encode_and_insert(missing, on_inserted, on_error, upsert)
+        self.db_api.flush()
+        if self.dedup is not None:
+            self.dedup.schedule_save()  # one write for a burst of insert calls (bulk loads send many)
         return True
+
+    def _encode_and_insert(self, imgs: list[ArtImage], on_inserted=None, on_error=None, upsert: bool = False):
+        if not imgs:
+            return
+        gen_embed = self.gen_art_images.gen_object(imgs, on_error=on_error)
+        pending = []  # encoded ArtBatch objects waiting for a full insert batch
+        n_pending = 0
+        for batch_obj in tqdm(gen_embed, desc=f'{len(imgs) / self.batch_size}'):
+            pending.append(batch_obj)
+            n_pending += len(batch_obj)
+            while n_pending >= self.insert_batch_size:
+                # one copy into a contiguous insert batch, the rest stays as a view
+                merged = ArtBatch.concat(pending)
+                self._insert_batch(merged[:self.insert_batch_size], on_inserted, on_error, upsert)
+                rest = merged[self.insert_batch_size:]
+                pending, n_pending = ([rest], len(rest)) if len(rest) else ([], 0)
+        if pending:
+            self._insert_batch(ArtBatch.concat(pending), on_inserted, on_error, upsert)
+
+    def _split_copies(self, imgs: list[ArtImage]) -> tuple[list[ArtImage], list[tuple[ArtImage, int]]]:
+        """
+        (arts to encode, [(copy, canonical id)]): dHash every image, an art whose hash is within
+        hash_distance of a stored art (or of an earlier art of this call) is a copy of it.
+        """
+        def hash_of(art):
+            try:
+                return dhash(art.url)
+            except Exception:
+                return None  # unreadable, the encoder reports it
+
+        with ThreadPoolExecutor(max_workers=self.preprocess_workers) as pool:
+            hashes = list(pool.map(hash_of, imgs))
+
+        to_encode, copies = [], []
+        for art, h in zip(imgs, hashes):
+            if h is None:
+                to_encode.append(art)
+                continue
+            if self.dedup.hashes.get(art.id) == h:
+                to_encode.append(art)  # same image re-sent under its id, it keeps its group
+                continue
+            self.dedup.remove([art.id])  # a new image for this id leaves its old group
+            canonical = self.dedup.match(h, exclude_id=art.id)
+            self.dedup.set_hash(art.id, h)
+            if canonical is None:
+                to_encode.append(art)
+            else:
+                copies.append((art, canonical))
+        return to_encode, copies
+
+    def _insert_copies(self, copies: list[tuple[ArtImage, int]], on_inserted=None, on_error=None,
+                       upsert: bool = False) -> list[ArtImage]:
+        """insert the copies with the vector of their canonical art, return the copies whose canonical is missing"""
+        found_ids, vectors = self.db_api.get_vectors(sorted({canonical for _, canonical in copies}))
+        vector_of = dict(zip(found_ids.tolist(), vectors))
+        ready = [(art, canonical) for art, canonical in copies if canonical in vector_of]
+        for i in range(0, len(ready), self.insert_batch_size):
+            chunk = ready[i: i + self.insert_batch_size]
+            self._insert_batch(ArtBatch([art for art, _ in chunk], np.stack([vector_of[c] for _, c in chunk])),
+                               on_inserted, on_error, upsert, copy_of=[canonical for _, canonical in chunk])
+        return [art for art, canonical in copies if canonical not in vector_of]
+
+    def _insert_batch(self, arts: ArtBatch, on_inserted=None, on_error=None, upsert: bool = False,
+                      copy_of: list[int] | None = None):
+        """copy_of: canonical id of every art when the batch holds hash copies, they skip the embedding check"""
+        duplicates = []
+        try:
+            if self.dedup is not None:
+                if copy_of is not None:
+                    duplicates, check = list(zip(arts.ids.tolist(), copy_of)), 'hash'
+                else:
+                    # searched before the insert so an art doesn't find itself, grouped after it
+                    duplicates, check = self.dedup.embedding_duplicates(arts.ids, arts.img_embeddings,
+                                                                        self.db_api.search_embeddings), 'embedding'
+            if upsert:
+                self.db_api.upsert_arts(arts)
+            else:
+                self.db_api.insert_arts(arts)
+        except Exception as e:
+            if on_error is None:
+                if self.dedup is not None:
+                    self.dedup.remove(arts.ids.tolist())  # not stored, later copies of them must not point at them
+                raise
+            for art in arts:
+                on_error(art, e)
+            return
+        if duplicates:
+            self.dedup.add_groups(duplicates, check)
+        self.bump_catalog_version()
+        if on_inserted is not None:
+            on_inserted(arts)
     
 
     def borda_count(self, rankings, dislikes=None):
-        scores = defaultdict(int)
-        max_rank = max(len(r) for r in rankings) if rankings else 0  # Maximum rank across all lists
-        max_dislike_rank = max(len(d) for d in dislikes) if dislikes else 0  # Max rank for dislikes
+        """full borda ranking of ragged id lists, kept for callers that still pass python lists"""
+        disliked_ids = fusion.pad_rankings(dislikes) if dislikes else None
+        return fusion.fuse(fusion.pad_rankings(rankings), disliked_ids=disliked_ids, n=None, method='borda')
+
+
+    def delete_art_images(self, ids: list[int]):
+        self.db_api.delete_arts(ids)
+        if self.dedup is not None:
+            self.dedup.remove(ids)
+            self.dedup.schedule_save()
+        self.bump_catalog_version()
+        return True
+
+    def get_arts_data(self, ids: list[int], fields: list[str] | None = None) -> list[dict]:
+        return self.db_api.get_arts_data(ids, fields)
 
-        for ranking in rankings:
-            for rank, image_id in enumerate(ranking):
-                scores[image_id] += (max_rank - rank)  # Higher rank -> more points
+    def get_embeddings(self, ids: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        """(found_ids, [n, dim] img embeddings) of the ids that exist"""
+        return self.db_api.get_vectors(ids)
 
-        if dislikes:
-            for dislike_ranking in dislikes:
-                for rank, image_id in enumerate(dislike_ranking):
-                    scores[image_id] -= (max_dislike_rank - rank)
+    def search_by_embeddings(self, embeddings: np.ndarray, top_n=6, filters=None) -> list[list[int]]:
+        """top_n ids for every query vector, one search"""
+        filters = search_filters.normalize(filters)
+        ids, _ = self.db_api.search_embeddings(embeddings, top_k=top_n, filters=filters)
+        return [[int(art_id) for art_id in row if art_id >= 0] for row in ids]
 
+    def bump_catalog_version(self):
+        """invalidate the result and neighbour caches, call after every insert / delete"""
+        self.catalog_version += 1
 
-        sorted_images = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    def collection_stats(self) -> dict:
+        """name and live art count of the collection, bulk loaders check it before trusting their checkpoint"""
+        return self.db_api.stats()
 
-        return [image_id for image_id, _ in sorted_images]
+    def cache_stats(self) -> dict:
+        return {
+            'catalog_version': self.catalog_version,
+            'results': self.result_cache.stats(),
+            'neighbors': self.neighbor_cache.stats(),
+            'text_embeddings': self.text_embed_cache.stats() if hasattr(self, 'text_embed_cache') else None,
+            'duplicates': self.dedup.summary() if self.dedup is not None else None,
+        }
 
+    def get_neighbors(self, ids: list[int], top_k: int, filters: tuple = ()):
+        """
+        top_k (ids, scores) neighbour rows for every id (among the arts passing the normalized filters), aligned with ids.
+        rows come from the per-id neighbour cache, the misses go to the db in one search.
+        """
+        version = self.catalog_version
+        out_ids = np.full((len(ids), top_k), -1, dtype=np.int64)
+        out_scores = np.full((len(ids), top_k), -np.inf, dtype=np.float32)
+
+        missing = []
+        for row, art_id in enumerate(ids):
+            cached = self.neighbor_cache.get((art_id, top_k, filters), version)
+            if cached is None:
+                missing.append(row)
+            else:
+                out_ids[row], out_scores[row] = cached
+        metrics.cache_lookup('neighbor', len(ids) - len(missing), len(missing))
+
+        if missing:
+            found_ids, found_scores = self.db_api.search_by_ids([ids[row] for row in missing], top_k=top_k,
+                                                                filters=filters)
+            out_ids[missing], out_scores[missing] = found_ids, found_scores
+            for i, row in enumerate(missing):
+                self.neighbor_cache.put((ids[row], top_k, filters), (found_ids[i].copy(), found_scores[i].copy()), version)
+
+        return out_ids, out_scores
 
     def get_similar_arts(self, data, top_n=6, top_k=1000):
         liked_arts_ids, disliked_arts_ids = data.liked_ids, data.disliked_ids
         set_ids = set(liked_arts_ids + disliked_arts_ids)
+        # e.g. only canvas under 80cm, pushed down into the vector search
+        filters = search_filters.normalize(getattr(data, 'filters', None))
 
-        liked_similarity_lists = []
-        disliked_similarity_lists = []
+        # the answer only depends on the sets of ids, not on their order
+        liked_arts_ids = sorted(set(liked_arts_ids))
+        disliked_arts_ids = sorted(set(disliked_arts_ids))
+        version = self.catalog_version
+        key = (tuple(liked_arts_ids), tuple(disliked_arts_ids), top_n, top_k, self.fusion_method, filters)
+        similarity_list = self.result_cache.get(key, version)
+        metrics.cache_lookup('result', similarity_list is not None, similarity_list is None)
+        if similarity_list is not None:
+            return list(similarity_list)
 
-        # Fetch embeddings for liked arts
-        if liked_arts_ids:
-            liked_similarity_lists = self.db_api.get_similar_arts(liked_arts_ids, top_k=top_k)
-        
-        print(len(liked_arts_ids))
+        # one batched search for liked and disliked ids (minus the cached ones), rows padded with -1
+        ids, scores = self.get_neighbors(liked_arts_ids + disliked_arts_ids, top_k=top_k, filters=filters)
+        ids = np.where(self.db_api.tombstones.mask(ids), -1, ids)  # deleted since the rows were cached
+        n_liked = len(liked_arts_ids)
+        liked_ids, liked_scores = ids[:n_liked], scores[:n_liked]
+        disliked_ids, disliked_scores = ids[n_liked:], scores[n_liked:]
 
-        # Fetch embeddings for disliked arts
-        if disliked_arts_ids:
-            disliked_similarity_lists = self.db_api.get_similar_arts(disliked_arts_ids, top_k=top_k)
+        # Apply ranking algorithm, liked and disliked items are masked out
+        with metrics.stage('fusion'):
+            similarity_list = fusion.fuse(liked_ids, liked_scores, disliked_ids, disliked_scores,
+                                          n=top_n, exclude=set_ids, method=self.fusion_method,
+                                          groups=self.dedup.canonical_of if self.dedup is not None else None)
+        self.result_cache.put(key, tuple(similarity_list), version)
 
-        print(len(liked_similarity_lists))
+        logger.debug("similar arts: %s", similarity_list)
 
-        # Apply ranking algorithm
-        similarity_list = self.borda_count(liked_similarity_lists, disliked_similarity_lists)
+        return similarity_list
 
-        # Exclude liked and disliked items
-        similarity_list = [similar_id for similar_id in similarity_list if similar_id not in set_ids][:top_n]
+    def search_by_text(self, description: str, liked_ids: list[int] = (), disliked_ids: list[int] = (), top_n=6,
+                       filters=None):
+        """
+        one query vector from the description, the liked arts and (subtracted) the disliked arts,
+        searched once. liked and disliked arts are never returned.
+        """
+        text = normalize_text(description or '')
+        liked_ids, disliked_ids = sorted(set(liked_ids)), sorted(set(disliked_ids))
+        filters = search_filters.normalize(filters)
+        version = self.catalog_version
+        key = ('text', text, tuple(liked_ids), tuple(disliked_ids), top_n, filters)
+        similarity_list = self.result_cache.get(key, version)
+        metrics.cache_lookup('result', similarity_list is not None, similarity_list is None)
+        if similarity_list is not None:
+            return list(similarity_list)
 
-        print(f"similar arts: {similarity_list}")
+        query = np.zeros(self.db_api.config_db.img_embed_dim, dtype=np.float32)
+        if text:
+            self.wait_for_model()
+            query += self.config.text_weight * self.text_embed_cache.embed([text])[0]
+        if liked_ids:
+            _, vectors = self.db_api.get_vectors(liked_ids)
+            if len(vectors):
+                query += self.config.liked_weight * vectors.mean(axis=0)
+        if disliked_ids:
+            _, vectors = self.db_api.get_vectors(disliked_ids)
+            if len(vectors):
+                query -= self.config.disliked_weight * vectors.mean(axis=0)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
 
-        return similarity_list
-
-    
-    
+        exclude = set(liked_ids) | set(disliked_ids)
+        ids, _ = self.db_api.search_embeddings((query / norm)[None], top_k=top_n + len(exclude), filters=filters)
+        similarity_list = [int(art_id) for art_id in ids[0] if art_id >= 0 and art_id not in exclude][:top_n]
+        self.result_cache.put(key, tuple(similarity_list), version)
 
+        logger.debug("text search arts: %s", similarity_list)
 
+        return similarity_list
@@ -0,0 +1,127 @@
+"""
+in-process latency histograms and counters, rendered in the prometheus text format on /metrics.
+no client library: a series is a label tuple -> bucket counts, updated under one lock per metric.
+"""
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+def _label_str(labelnames: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_label_str(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = np.asarray(buckets, dtype=np.float64)
+        self._series = {}  # label values -> [counts per bucket (non cumulative, +Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        bucket = int(np.searchsorted(self.buckets, value, side='left'))  # first bucket with le >= value
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [np.zeros(len(self.buckets) + 1, dtype=np.int64), 0.0]
+            series[0][bucket] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, counts.copy(), total) for key, (counts, total) in sorted(self._series.items())]
+        for key, counts, total in series:
+            cumulative = np.cumsum(counts)
+            for le, count in zip(self.buckets, cumulative[:-1]):
+                labels = _label_str(self.labelnames, key, 'le="%g"' % le)
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _label_str(self.labelnames, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative[-1]}')
+            lines.append(f'{self.name}_sum{_label_str(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_label_str(self.labelnames, key)} {cumulative[-1]}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+# stage: decode, preprocess, encode, db_insert, vector_fetch, ann_search, fusion
+stage_seconds = REGISTRY.histogram('art_stage_seconds', 'latency of one call of a pipeline stage', ('stage',))
+# kind: encode (images per forward), insert (rows per db insert), search (query vectors per ann search)
+batch_size = REGISTRY.histogram('art_batch_size', 'items handled by one batched call', ('kind',), SIZE_BUCKETS)
+# cache: embed, vector, text, result, neighbor. result: hit, miss
+cache_events = REGISTRY.counter('art_cache_events_total', 'cache lookups', ('cache', 'result'))
+# check: hash (copy inserted without an encoder pass), embedding (grouped after encoding)
+duplicates = REGISTRY.counter('art_duplicates_total', 'near duplicate arts found at ingest', ('check',))
+
+
+def stage(name: str):
+    """with stage('encode'): ... records the block's latency"""
+    return stage_seconds.time(stage=name)
+
+
+def cache_lookup(cache: str, hits: int, misses: int):
+    if hits:
+        cache_events.inc(hits, cache=cache, result='hit')
+    if misses:
+        cache_events.inc(misses, cache=cache, result='miss')
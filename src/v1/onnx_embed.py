@@ -0,0 +1,167 @@
+"""
+CLIP image / text towers exported once to ONNX and run with onnxruntime (optionally int8 dynamic quantized).
+needs the `onnx` and `onnxruntime` packages, which are only required when ConfigClip.backend == 'onnx'.
+
+parity check against the pytorch model:
+
+    python -m src.v1.onnx_embed --images data/51.jpg data/61.jpg --texts "abstract acrylic on canvas"
+"""
+import os
+import json
+import logging
+import argparse
+import clip
+import torch
+import numpy as np
+from PIL import Image
+from sklearn.preprocessing import normalize
+from src.v1.embed_model import EmbedModel, ClipEmbed, ConfigClip
+from src.v1 import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigOnnx:
+    def __init__(self):
+        self.clip = ConfigClip()
+        self.export_dir = 'volumes/onnx'
+        self.quantize = True  # dynamic int8 weights, ~4x smaller and faster matmuls on cpu
+        self.intra_op_threads = os.cpu_count() or 1  # embed pool workers use ConfigEmbedPool.threads_per_worker
+        self.inter_op_threads = 1
+        self.opset = 17
+
+
+class _ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixels):
+        return self.model.encode_image(pixels)
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+class OnnxClipEmbed(EmbedModel):
+    """
+    same interface as ClipEmbed (preprocess_imgs / encode_imgs / predict_imgs / predict_text),
+    the towers are exported on first use and the exported files are reused afterwards.
+    """
+
+    def __init__(self, config: ConfigOnnx):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("the onnx embedding backend needs `pip install onnx onnxruntime`") from e
+
+        self.config = config
+        self.device = 'cpu'
+        self.name = f"{config.clip.name}-onnx{'-int8' if config.quantize else ''}"
+        self.model_dir = config.export_dir
+
+        stem = os.path.join(config.export_dir, config.clip.name.replace('/', '-').replace('@', '-'))
+        image_path, text_path, meta_path = f'{stem}_image.onnx', f'{stem}_text.onnx', f'{stem}.json'
+        if not (os.path.exists(image_path) and os.path.exists(text_path) and os.path.exists(meta_path)):
+            self._export(image_path, text_path, meta_path)
+        if config.quantize:
+            image_path, text_path = self._quantize(image_path), self._quantize(text_path)
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self.input_shape = (3, meta['resolution'], meta['resolution'])
+        # clip's own preprocessing (resize, center crop, normalize) without loading the torch weights
+        self.model_preprocess = clip.clip._transform(meta['resolution'])
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = config.intra_op_threads
+        options.inter_op_num_threads = config.inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ['CPUExecutionProvider']
+        self.image_session = ort.InferenceSession(image_path, options, providers=providers)
+        self.text_session = ort.InferenceSession(text_path, options, providers=providers)
+
+    def _export(self, image_path: str, text_path: str, meta_path: str):
+        os.makedirs(self.config.export_dir, exist_ok=True)
+        # float32 weights on cpu, clip.load gives fp16 on cuda
+        model, _ = clip.load(self.config.clip.name, device='cpu', jit=False, download_root=self.config.clip.model_dir)
+        model.eval()
+        resolution = model.visual.input_resolution
+
+        pixels = torch.rand(2, 3, resolution, resolution)
+        tokens = clip.tokenize(['a painting', 'a photo of a sculpture'])
+        with torch.no_grad():
+            dim = model.encode_image(pixels[:1]).shape[-1]
+            torch.onnx.export(_ImageTower(model), (pixels,), image_path, opset_version=self.config.opset,
+                              input_names=['pixels'], output_names=['embedding'],
+                              dynamic_axes={'pixels': {0: 'batch'}, 'embedding': {0: 'batch'}})
+            torch.onnx.export(_TextTower(model), (tokens,), text_path, opset_version=self.config.opset,
+                              input_names=['tokens'], output_names=['embedding'],
+                              dynamic_axes={'tokens': {0: 'batch'}, 'embedding': {0: 'batch'}})
+        with open(meta_path, 'w') as f:
+            json.dump({'dim': int(dim), 'resolution': int(resolution)}, f)
+        logger.info('exported %s to %s and %s', self.config.clip.name, image_path, text_path)
+
+    @staticmethod
+    def _quantize(path: str) -> str:
+        quantized = path.replace('.onnx', '_int8.onnx')
+        if not os.path.exists(quantized):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+            logger.info('quantized %s -> %s', path, quantized)
+        return quantized
+
+    def preprocess_imgs(self, urls: list[str]) -> torch.Tensor:
+        with metrics.stage('decode'):
+            imgs = [Image.open(img_path).convert("RGB") for img_path in urls]
+        with metrics.stage('preprocess'):
+            return torch.stack([self.model_preprocess(img) for img in imgs])
+
+    def encode_imgs(self, imgs: torch.Tensor) -> np.ndarray:
+        pixels = imgs.detach().cpu().numpy().astype(np.float32)
+        embedding = self.image_session.run(None, {'pixels': pixels})[0]
+        return normalize(embedding, norm="l2").astype(np.float32)
+
+    def predict_text(self, texts: list[str]) -> np.ndarray:
+        tokens = clip.tokenize(texts, truncate=True).numpy()
+        embedding = self.text_session.run(None, {'tokens': tokens})[0]
+        return normalize(embedding, norm="l2").astype(np.float32)
+
+
+def parity_check(reference: EmbedModel, candidate: EmbedModel, urls: list[str], texts: list[str]) -> dict:
+    """cosine agreement between two models' embeddings of the same inputs (1.0 = identical direction)"""
+    report = {}
+    if urls:
+        cosine = (reference.predict_imgs(urls) * candidate.predict_imgs(urls)).sum(axis=1)
+        report['image'] = {'n': len(urls), 'mean_cosine': float(cosine.mean()), 'min_cosine': float(cosine.min())}
+    if texts:
+        cosine = (reference.predict_text(texts) * candidate.predict_text(texts)).sum(axis=1)
+        report['text'] = {'n': len(texts), 'mean_cosine': float(cosine.mean()), 'min_cosine': float(cosine.min())}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', nargs='*', default=[])
+    parser.add_argument('--texts', nargs='*', default=[])
+    parser.add_argument('--no-quantize', action='store_true', help='compare the float32 onnx export instead')
+    args = parser.parse_args()
+
+    config = ConfigOnnx()
+    config.quantize = not args.no_quantize
+    config_clip = ConfigClip()
+    config_clip.device = 'cpu'
+    report = parity_check(ClipEmbed(config_clip), OnnxClipEmbed(config), args.images, args.texts)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
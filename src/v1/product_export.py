@@ -0,0 +1,36 @@
+"""typed art fields of the product export csv (Products-Export-*.csv), shared by the gui and the catalog loader"""
+import csv
+
+# product export column -> typed art field
+PRODUCT_EXPORT_COLUMNS = {
+    "Title": "img_name",
+    "Product סגנון היצירה": "style",
+    "Product טכניקה": "technique",
+    "Product מצע": "medium",
+    "Width": "width",
+    "Height": "height",
+    "Length": "depth",
+}
+NUMERIC_FIELDS = ("width", "height", "depth")
+
+
+def row_fields(row):
+    """typed fields of one product export row, empty or unparsable cells are left out"""
+    fields = {}
+    for column, field in PRODUCT_EXPORT_COLUMNS.items():
+        value = (row.get(column) or "").strip()
+        if not value:
+            continue
+        if field in NUMERIC_FIELDS:
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+        fields[field] = value
+    return fields
+
+
+def read_product_export(path):
+    """{id: {field: value}} from the product export csv, empty cells are left out"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return {int(row["id"]): row_fields(row) for row in csv.DictReader(f)}
@@ -0,0 +1,60 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class ConfigResultCache:
+    def __init__(self):
+        self.max_results = 10_000  # cached get_similar_arts answers
+        self.max_neighbors = 2_000  # cached top_k neighbour rows (~12KB each for top_k=1000)
+        self.ttl_s = 300
+
+
+class ResultCache:
+    """
+    Bounded LRU + TTL cache. every entry is stamped with the catalog version it was computed at,
+    a lookup at another version is a miss, so bumping the version invalidates everything at once.
+    """
+
+    def __init__(self, max_size: int, ttl_s: float):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value, version: int):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl_s, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.v1.embed_model import EmbedModel
+from src.v1 import metrics
+
+
+def normalize_text(text: str) -> str:
+    """'  Abstract  Acrylic on canvas' and 'abstract acrylic on canvas' are the same query"""
+    return ' '.join(text.lower().split())
+
+
+class TextEmbedCache:
+    """
+    LRU memo of text embeddings keyed by the normalized text.
+    the misses of a call are de-duplicated and embedded (and tokenized) in a single batch.
+    """
+
+    def __init__(self, model: EmbedModel, max_size: int = 10_000):
+        self.model = model
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        keys = [normalize_text(text) for text in texts]
+        with self._lock:
+            found = {key: self._vectors[key] for key in keys if key in self._vectors}
+            for key in found:
+                self._vectors.move_to_end(key)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        n_missed = sum(key not in found for key in keys)
+        self.hits += len(keys) - n_missed
+        self.misses += n_missed
+        metrics.cache_lookup('text', len(keys) - n_missed, n_missed)
+
+        if missing:
+            vectors = self.model.predict_text(missing)
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    found[key] = vector
+                    self._vectors[key] = vector
+                while len(self._vectors) > self.max_size:
+                    self._vectors.popitem(last=False)
+
+        return np.stack([found[key] for key in keys]).astype(np.float32)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'size': len(self._vectors), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
@@ -0,0 +1,44 @@
+"""
+embeddings on the wire as raw little endian float32 / float16 bytes instead of json float lists.
+json bodies carry them base64 encoded (EncodedVectors), application/octet-stream bodies carry the bytes as is.
+"""
+import base64
+import numpy as np
+from pydantic import BaseModel
+from typing import Literal, Tuple
+
+DTYPES = {'float32': np.dtype('<f4'), 'float16': np.dtype('<f2')}
+
+
+def to_bytes(vectors, dtype: str = 'float32') -> bytes:
+    return np.ascontiguousarray(vectors, dtype=DTYPES[dtype]).tobytes()
+
+
+def from_bytes(data: bytes, dim: int, dtype: str = 'float32') -> np.ndarray:
+    """[n, dim] float32 array of a raw body, ValueError when the length doesn't match"""
+    if dtype not in DTYPES:
+        raise ValueError(f'unknown dtype {dtype}, one of {sorted(DTYPES)}')
+    row_bytes = dim * DTYPES[dtype].itemsize
+    if not data or len(data) % row_bytes:
+        raise ValueError(f'body of {len(data)} bytes is not a whole number of {dim}-d {dtype} vectors')
+    return np.frombuffer(data, dtype=DTYPES[dtype]).reshape(-1, dim).astype(np.float32)
+
+
+class EncodedVectors(BaseModel):
+    dtype: Literal['float32', 'float16'] = 'float32'
+    shape: Tuple[int, int]  # [n, dim]
+    data: str  # base64 of the row-major values
+
+    @classmethod
+    def from_array(cls, vectors: np.ndarray, dtype: str = 'float32') -> 'EncodedVectors':
+        vectors = np.asarray(vectors).reshape(len(vectors), -1)
+        return cls(dtype=dtype, shape=vectors.shape, data=base64.b64encode(to_bytes(vectors, dtype)).decode('ascii'))
+
+    def to_array(self, dim: int | None = None) -> np.ndarray:
+        n, shape_dim = self.shape
+        if dim is not None and shape_dim != dim:
+            raise ValueError(f'expected {dim}-d vectors, got {shape_dim}')
+        vectors = from_bytes(base64.b64decode(self.data, validate=True), shape_dim, self.dtype)
+        if len(vectors) != n:
+            raise ValueError(f'shape says {n} vectors, data holds {len(vectors)}')
+        return vectors
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the code imports itself as `src.v1...` / `src.db...` from the repo root, like main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
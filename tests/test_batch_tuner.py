@@ -0,0 +1,53 @@
+import time
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+from src.v1.batch_tuner import BatchTuner, ConfigBatchTuner
+
+
+class FixedCostModel:
+    """every encode takes the same time whatever the batch size, so larger batches are always faster"""
+    input_shape = (3, 4, 4)
+    dim = 8
+
+    def __init__(self):
+        self.threads = []
+
+    def encode_imgs(self, imgs):
+        self.threads.append(torch.get_num_threads())
+        time.sleep(0.01)
+        return np.zeros((len(imgs), self.dim), dtype=np.float32)
+
+
+def make_model():
+    return FixedCostModel()
+
+
+def tuner_config(**overrides):
+    config = ConfigBatchTuner()
+    config.candidates = [1, 2, 4, 8]
+    config.__dict__.update(overrides)
+    return config
+
+
+def test_probes_use_the_given_thread_count():
+    before = torch.get_num_threads()
+    model = FixedCostModel()
+    tuner = BatchTuner(model, tuner_config(), threads=1)
+    assert tuner.tune_encode_batch_size() in (4, 8)
+    assert set(model.threads) == {1}
+    assert torch.get_num_threads() == before
+
+
+def test_no_probe_starts_after_the_deadline():
+    tuner = BatchTuner(FixedCostModel(), tuner_config(max_probe_seconds=0))
+    assert tuner.tune_encode_batch_size() == 1
+    assert [size for size, _, _ in tuner.probes] == [1]
+
+
+def test_probes_run_in_their_own_process():
+    model = FixedCostModel()
+    encode, insert = BatchTuner(model, tuner_config(), threads=1).tune(make_model)
+    assert encode in (4, 8) and insert >= encode  # 8 unless the machine is busy enough to hide the gain
+    assert model.threads == []  # the api process model wasn't used
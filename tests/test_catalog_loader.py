@@ -0,0 +1,212 @@
+import csv
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+pytest.importorskip('requests')
+from src.v1.catalog_loader import CatalogLoader, Checkpoint, ServerClient
+
+
+class FakeServer:
+    """the ServerClient calls of the loader against an in-memory collection"""
+
+    def __init__(self, collection='v2', fail_ids=(), crash_on_chunk=None):
+        self.collection = collection
+        self.arts = {}
+        self.chunks = []
+        self.fail_ids = set(fail_ids)
+        self.crash_on_chunk = crash_on_chunk
+
+    def upsert_chunk(self, chunk):
+        self.chunks.append([record['id'] for record in chunk])
+        if self.crash_on_chunk == len(self.chunks):
+            raise ConnectionError('server went away')
+        failures = [{'id': record['id'], 'error': 'bad image'} for record in chunk if record['id'] in self.fail_ids]
+        for record in chunk:
+            if record['id'] not in self.fail_ids:
+                self.arts[record['id']] = record
+        return {'job_id': str(len(self.chunks)), 'status': 'done', 'failures': failures, 'error': None}
+
+    def delete(self, ids):
+        for art_id in ids:
+            self.arts.pop(art_id, None)
+        return True
+
+    def collection_stats(self):
+        return {'collection': self.collection, 'backend': 'numpy', 'arts': len(self.arts)}
+
+    def existing(self, ids):
+        return {art_id for art_id in ids if art_id in self.arts}
+
+    def sent(self):
+        return [art_id for chunk in self.chunks for art_id in chunk]
+
+
+def write_catalog(tmp_path, ids, titles=None):
+    images = tmp_path / 'images'
+    images.mkdir(exist_ok=True)
+    for art_id in ids:
+        (images / f'{art_id}.jpg').write_bytes(f'image {art_id}'.encode())
+    csv_path = tmp_path / 'products.csv'
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['id', 'Title', 'Width', 'Height'])
+        writer.writeheader()
+        for art_id in ids:
+            title = (titles or {}).get(art_id, f'art {art_id}')
+            writer.writerow({'id': art_id, 'Title': title, 'Width': '40', 'Height': '60'})
+    return str(csv_path), str(images)
+
+
+def make_loader(server, tmp_path, csv_path, images_dir, chunk_size=2):
+    return CatalogLoader(server, csv_path, images_dir, str(tmp_path / 'checkpoint.json'), chunk_size)
+
+
+def test_records_carry_the_typed_fields(tmp_path):
+    csv_path, images_dir = write_catalog(tmp_path, [1])
+    server = FakeServer()
+    make_loader(server, tmp_path, csv_path, images_dir).run()
+    record = server.arts[1]
+    assert record['img_name'] == 'art 1'
+    assert record['width'] == 40.0 and record['size'] == [40, 60]
+
+
+def test_crashed_run_resumes_after_the_last_committed_chunk(tmp_path):
+    ids = [1, 2, 3, 4, 5]
+    csv_path, images_dir = write_catalog(tmp_path, ids)
+    server = FakeServer(crash_on_chunk=2)
+    with pytest.raises(ConnectionError):
+        make_loader(server, tmp_path, csv_path, images_dir).run()
+    assert json.loads((tmp_path / 'checkpoint.json').read_text())['rows_done'] == 2
+
+    server.crash_on_chunk = None
+    server.chunks = []
+    stats = make_loader(server, tmp_path, csv_path, images_dir).run()
+    assert server.sent() == [3, 4, 5]
+    assert stats['resumed_past'] == 2 and stats['loaded'] == 3
+    assert sorted(server.arts) == ids
+
+
+def test_rerun_only_sends_changed_and_failed_rows(tmp_path):
+    csv_path, images_dir = write_catalog(tmp_path, [1, 2, 3])
+    server = FakeServer(fail_ids={3})
+    stats = make_loader(server, tmp_path, csv_path, images_dir).run()
+    assert stats['failed'] == 1
+
+    csv_path, images_dir = write_catalog(tmp_path, [1, 2, 3], titles={2: 'renamed'})
+    server.fail_ids = set()
+    server.chunks = []
+    stats = make_loader(server, tmp_path, csv_path, images_dir).run()
+    assert server.sent() == [2, 3]
+    assert stats['unchanged'] == 1
+    assert server.arts[2]['img_name'] == 'renamed'
+
+
+def test_wiped_collection_reloads_everything(tmp_path):
+    csv_path, images_dir = write_catalog(tmp_path, [1, 2, 3])
+    make_loader(FakeServer(), tmp_path, csv_path, images_dir).run()
+
+    wiped = FakeServer()
+    make_loader(wiped, tmp_path, csv_path, images_dir).run()
+    assert wiped.sent() == [1, 2, 3]
+
+
+def test_arts_lost_by_the_collection_are_loaded_again(tmp_path):
+    csv_path, images_dir = write_catalog(tmp_path, [1, 2, 3, 4])
+    server = FakeServer()
+    make_loader(server, tmp_path, csv_path, images_dir).run()
+
+    # deleted behind the loader's back while others were added: the count alone grew
+    del server.arts[2]
+    server.arts.update({10: {}, 11: {}})
+    server.chunks = []
+    stats = make_loader(server, tmp_path, csv_path, images_dir).run()
+    assert server.sent() == [2]
+    assert stats['lost'] == 1 and stats['unchanged'] == 3
+
+
+def test_checkpoint_of_another_collection_is_ignored(tmp_path):
+    csv_path, _ = write_catalog(tmp_path, [1])
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = Checkpoint(path, csv_path, 'v2')
+    checkpoint.rows_done = 1
+    checkpoint.fingerprints = {'1': 'abc', '2': 'def'}
+    checkpoint.save()
+
+    assert Checkpoint(path, csv_path, 'v2').fingerprints == {'1': 'abc', '2': 'def'}
+    assert Checkpoint(path, csv_path, 'v2').rows_done == 1
+    assert Checkpoint(path, csv_path, 'v3').fingerprints == {}
+
+    checkpoint = Checkpoint(path, csv_path, 'v2')
+    assert checkpoint.validate(lambda ids: {1, 2}) == 0 and checkpoint.rows_done == 1
+    assert checkpoint.validate(lambda ids: {1}) == 1
+    assert checkpoint.fingerprints == {'1': 'abc'} and checkpoint.rows_done == 0
+
+
+def test_delete_missing(tmp_path):
+    csv_path, images_dir = write_catalog(tmp_path, [1, 2, 3])
+    server = FakeServer()
+    make_loader(server, tmp_path, csv_path, images_dir).run()
+
+    csv_path, images_dir = write_catalog(tmp_path, [1, 3])
+    stats = make_loader(server, tmp_path, csv_path, images_dir).run(delete_missing=True)
+    assert stats['deleted'] == 1
+    assert sorted(server.arts) == [1, 3]
+    state = json.loads((tmp_path / 'checkpoint.json').read_text())
+    assert sorted(state['fingerprints']) == ['1', '3']
+
+
+class ArtServerHandler(BaseHTTPRequestHandler):
+    """the endpoints ServerClient calls, the first upsert answers 503 and its job is pending until polled"""
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.calls.append(self.path)
+        if self.path == '/collection_stats':
+            self._reply(200, {'collection': 'v2', 'backend': 'numpy', 'arts': 2})
+        else:
+            self._reply(200, {'job_id': 'j1', 'status': 'done', 'failures': [], 'error': None})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.calls.append(self.path)
+        if self.path == '/upsert_arts':
+            if self.server.calls.count('/upsert_arts') == 1:
+                self._reply(503, {'detail': 'busy'})
+            else:
+                self.server.encoding = self.headers.get('Content-Encoding')
+                self._reply(200, {'job_id': 'j1', 'status': 'queued'})
+        elif self.path == '/get_arts_data':
+            ids = json.loads(body)['ids']
+            self._reply(200, [{'id': art_id, 'img_name': 'x'} for art_id in ids if art_id % 2])
+        else:
+            self._reply(200, True)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_server_client(monkeypatch):
+    monkeypatch.setattr('src.v1.catalog_loader.time.sleep', lambda seconds: None)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ArtServerHandler)
+    httpd.calls = []
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        host, port = httpd.server_address
+        client = ServerClient(f'http://{host}:{port}/', lookup_batch=2)
+        assert client.upsert_chunk([{'id': 1}])['status'] == 'done'
+        assert httpd.calls == ['/upsert_arts', '/upsert_arts', '/insert_jobs/j1'] and httpd.encoding == 'gzip'
+        assert client.existing([1, 2, 3, 5, 6]) == {1, 3, 5}
+        assert client.collection_stats()['collection'] == 'v2'
+        client.delete([4])
+        assert httpd.calls[-1] == '/delete_arts'
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
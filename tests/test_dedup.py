@@ -0,0 +1,149 @@
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('PIL')
+from src.v1.dedup import DuplicateIndex, ConfigDedup
+
+
+def make_index(tmp_path=None, **overrides):
+    config = ConfigDedup()
+    config.dir = str(tmp_path) if tmp_path is not None else None
+    config.__dict__.update(overrides)
+    return DuplicateIndex(config, 'v2')
+
+
+H = 0x0123_4567_89ab_cdef
+
+
+def test_band_lookup_finds_hashes_within_the_distance():
+    index = make_index(hash_distance=2)
+    index.set_hash(1, H)
+    assert index.match(H) == 1
+    assert index.match(H ^ 0b11) == 1  # two bits in the same band
+    assert index.match(H ^ (1 | 1 << 63)) == 1  # one bit in each outer band, the middle one agrees
+    assert index.match(H ^ 0b111) is None
+    assert index.match(H, exclude_id=1) is None
+
+
+def test_match_prefers_the_closest_and_resolves_the_canonical():
+    index = make_index(hash_distance=2)
+    index.set_hash(1, H ^ 0b11)
+    index.set_hash(2, H ^ 0b1)
+    index.set_hash(3, H)
+    assert index.match(H ^ 0b1) == 2
+    index.group(2, 1)
+    assert index.match(H ^ 0b1) == 1
+    index.set_hash(3, ~H & (2 ** 64 - 1))  # re-hashed arts leave their old buckets
+    assert 3 not in set().union(*(bucket.get(value, set()) for bucket, value
+                                  in zip(index._buckets, index._band_values(H))))
+
+
+def test_group_and_ungroup():
+    index = make_index()
+    index.group(2, 1)
+    index.group(3, 2)
+    index.group(5, 4)
+    index.group(4, 3)
+    assert index.canonical_of([1, 2, 3, 4, 5, 6]).tolist() == [1, 1, 1, 1, 1, 6]
+    assert index.members == {1: {2, 3, 4, 5}}
+
+    index.remove([3])
+    assert index.canonical_of([2, 3, 4]).tolist() == [1, 3, 1]
+
+    index.remove([1])  # the canonical hands over to its smallest member
+    assert index.canonical_of([2, 4, 5]).tolist() == [2, 2, 2]
+    assert index.members == {2: {4, 5}}
+
+    index.remove([4, 5])
+    assert index.canonical == {} and index.members == {}
+
+
+def test_embedding_duplicates_only_groups_when_asked():
+    index = make_index(embed_threshold=0.9)
+    vectors = np.array([[1.0, 0.0], [0.99, 0.1], [0.0, 1.0]], dtype=np.float32)
+
+    def search(queries, top_k):
+        # art 10 is stored and close to the second art of the batch
+        scores = np.array([[0.5], [0.95], [0.1]], dtype=np.float32)[:len(queries)]
+        return np.full((len(queries), 1), 10), scores
+
+    pairs = index.embedding_duplicates([1, 2, 3], vectors, search)
+    assert pairs == [(2, 10)]
+    assert index.canonical == {} and index.stats['embed_grouped'] == 0
+
+    index.add_groups(pairs, 'embedding')
+    assert index.canonical == {2: 10} and index.stats['embed_grouped'] == 1
+    index.add_groups([(2, 1)], 'embedding')  # already grouped, left alone
+    assert index.canonical == {2: 10} and index.stats['embed_grouped'] == 1
+
+
+def test_embedding_duplicates_within_the_batch():
+    index = make_index(embed_threshold=0.9)
+    vectors = np.array([[1.0, 0.0], [0.0, 1.0], [0.99, 0.1]], dtype=np.float32)
+    nothing = lambda queries, top_k: (np.full((len(queries), 1), -1), np.zeros((len(queries), 1)))
+    assert index.embedding_duplicates([1, 2, 3], vectors, nothing) == [(3, 1)]
+
+
+def test_saves_are_debounced(tmp_path):
+    index = make_index(tmp_path, save_delay_s=60)
+    path = tmp_path / 'v2.json'
+    index.set_hash(1, H)
+    index.group(2, 1)
+    index.schedule_save()
+    index.schedule_save()
+    assert not path.exists()
+    assert index._save_timer is not None
+
+    index.save()
+    assert index._save_timer is None
+    state = json.loads(path.read_text())
+    assert state == {'hashes': {'1': f'{H:016x}'}, 'canonical': {'2': 1}}
+
+    path.unlink()
+    index.save()  # nothing changed
+    assert not path.exists()
+
+    index.remove([2])
+    index.save()
+    reloaded = make_index(tmp_path)
+    assert reloaded.hashes == {1: H} and reloaded.canonical == {}
+
+
+def test_failed_insert_leaves_no_group():
+    logic_module = pytest.importorskip('src.v1.logic', exc_type=ImportError)
+    from src.v1.art_image import ArtImage, ArtBatch
+
+    class FailingDB:
+        def search_embeddings(self, queries, top_k):
+            return np.full((len(queries), 1), 10), np.ones((len(queries), 1), dtype=np.float32)
+
+        def insert_arts(self, arts):
+            raise RuntimeError('db down')
+
+    logic = logic_module.Logic.__new__(logic_module.Logic)
+    logic.dedup = make_index()
+    logic.db_api = FailingDB()
+    logic.dedup.set_hash(1, H)
+    arts = ArtBatch([ArtImage(id=1, url='1.jpg', img_name='a', size=(1, 1))], np.ones((1, 2), dtype=np.float32))
+
+    with pytest.raises(RuntimeError):
+        logic._insert_batch(arts)
+    assert logic.dedup.canonical == {} and logic.dedup.hashes == {}
+
+    failed = []
+    logic._insert_batch(arts, on_error=lambda art, e: failed.append(art.id))
+    assert failed == [1] and logic.dedup.canonical == {}
+
+
+def test_a_fresh_index_removes_the_saved_groups(tmp_path):
+    index = make_index(tmp_path)
+    index.group(2, 1)
+    index.save()
+    assert make_index(tmp_path).canonical == {2: 1}
+
+    config = ConfigDedup()
+    config.dir = str(tmp_path)
+    assert DuplicateIndex(config, 'v2', load=False).canonical == {}
+    assert not (tmp_path / 'v2.json').exists()
+    assert make_index(tmp_path).canonical == {}
@@ -0,0 +1,171 @@
+import csv
+import sys
+import json
+import asyncio
+import threading
+import pytest
+
+web = pytest.importorskip('aiohttp.web')
+from data import download_script
+from data.download_script import Fetcher, ConfigFetch
+
+
+class ImageServer:
+    """aiohttp app on its own loop thread: /img/{name} answers with ETags, /flaky/{name} with 503s first"""
+
+    def __init__(self):
+        self.requests = []
+        self.flaky_left = {}
+        self.delays = {}
+        app = web.Application()
+        app.router.add_get('/img/{name}', self.image)
+        app.router.add_get('/flaky/{name}', self.flaky)
+        app.router.add_get('/missing/{name}', self.missing)
+        self.loop = asyncio.new_event_loop()
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = self.runner.addresses[0][1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    async def image(self, request):
+        name = request.match_info['name']
+        self.requests.append((name, request.headers.get('If-None-Match')))
+        await asyncio.sleep(self.delays.get(name, 0))
+        etag = f'"{name}-v1"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=f'jpeg of {name}'.encode(), headers={'ETag': etag})
+
+    async def flaky(self, request):
+        name = request.match_info['name']
+        self.requests.append((name, None))
+        left = self.flaky_left.get(name, 0)
+        if left:
+            self.flaky_left[name] = left - 1
+            return web.Response(status=503, headers={'Retry-After': '0'})
+        return web.Response(body=f'jpeg of {name}'.encode())
+
+    async def missing(self, request):
+        self.requests.append((request.match_info['name'], None))
+        return web.Response(status=404)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@pytest.fixture
+def server():
+    server = ImageServer()
+    yield server
+    server.close()
+
+
+def fast_config(**overrides):
+    config = ConfigFetch()
+    config.concurrency = 4
+    config.backoff_s = 0.001
+    config.timeout_s = 5
+    config.__dict__.update(overrides)
+    return config
+
+
+def fetch_all(fetcher, rows):
+    done = {}
+    asyncio.run(fetcher.run(rows, lambda img_id, filename: done.__setitem__(img_id, filename)))
+    return done
+
+
+def test_download_then_not_modified(server, tmp_path):
+    rows = [('1', server.url('/img/1')), ('2', server.url('/img/2'))]
+    fetcher = Fetcher(str(tmp_path), fast_config())
+    assert fetch_all(fetcher, rows) == {'1': '1.jpg', '2': '2.jpg'}
+    assert fetcher.stats['downloaded'] == 2
+    assert (tmp_path / '1.jpg').read_bytes() == b'jpeg of 1'
+    assert json.loads((tmp_path / '.fetch_state.json').read_text())['1']['etag'] == '"1-v1"'
+
+    again = Fetcher(str(tmp_path), fast_config())
+    assert fetch_all(again, rows) == {'1': '1.jpg', '2': '2.jpg'}
+    assert again.stats['not_modified'] == 2 and again.stats['downloaded'] == 0
+    assert sorted(server.requests[2:]) == [('1', '"1-v1"'), ('2', '"2-v1"')]
+
+
+def test_transient_errors_are_retried(server, tmp_path):
+    server.flaky_left['7'] = 2
+    fetcher = Fetcher(str(tmp_path), fast_config(retries=3))
+    assert fetch_all(fetcher, [('7', server.url('/flaky/7'))]) == {'7': '7.jpg'}
+    assert fetcher.stats['retries'] == 2 and len(server.requests) == 3
+
+
+def test_failures(server, tmp_path):
+    server.flaky_left['8'] = 10
+    fetcher = Fetcher(str(tmp_path), fast_config(retries=1))
+    done = fetch_all(fetcher, [('8', server.url('/flaky/8')), ('9', server.url('/missing/9'))])
+    assert done == {'8': None, '9': None}
+    assert fetcher.stats['failed'] == 2
+    assert sorted(server.requests) == [('8', None), ('8', None), ('9', None)]  # the 404 isn't retried
+    assert not (tmp_path / '9.jpg').exists()
+
+
+def test_state_is_saved_periodically_and_on_errors(server, tmp_path):
+    state_path = tmp_path / '.fetch_state.json'
+    rows = [(str(i), server.url(f'/img/{i}')) for i in range(6)]
+    saved_at = []
+
+    def on_done(img_id, filename):
+        saved_at.append(len(json.loads(state_path.read_text())) if state_path.exists() else 0)
+        if len(saved_at) == 5:
+            raise RuntimeError('stop')
+
+    fetcher = Fetcher(str(tmp_path), fast_config(concurrency=1, save_every=2))
+    with pytest.raises(RuntimeError):
+        asyncio.run(fetcher.run(rows, on_done))
+    assert saved_at == [0, 0, 2, 2, 4]
+    assert len(json.loads(state_path.read_text())) == 5  # saved on the way out
+
+
+def test_a_repeated_id_is_fetched_once(server, tmp_path):
+    server.delays['5'] = 0.2  # still in flight when the second row comes
+    rows = [('5', server.url('/img/5')), ('6', server.url('/img/6')), ('5', server.url('/img/5'))]
+    done = []
+    fetcher = Fetcher(str(tmp_path), fast_config())
+    asyncio.run(fetcher.run(rows, lambda img_id, filename: done.append((img_id, filename))))
+    assert sorted(done) == [('5', '5.jpg'), ('5', '5.jpg'), ('6', '6.jpg')]
+    assert [name for name, _ in server.requests].count('5') == 1
+    assert fetcher.stats['downloaded'] == 2 and (tmp_path / '5.jpg').read_bytes() == b'jpeg of 5'
+
+
+def test_a_failed_resize_keeps_the_download(server, tmp_path):
+    pytest.importorskip('PIL')
+    fetcher = Fetcher(str(tmp_path / 'out'), fast_config(resize=16, resized_dir=str(tmp_path / 'resized')))
+    assert fetch_all(fetcher, [('1', server.url('/img/1'))]) == {'1': '1.jpg'}  # the body isn't a real jpeg
+    assert fetcher.stats['downloaded'] == 1 and fetcher.stats['failed'] == 0
+    assert fetcher.stats['resize_failed'] == 1
+    assert not (tmp_path / 'resized' / '1.jpg').exists()
+
+
+def test_updated_csv_keeps_the_input_order(server, tmp_path, monkeypatch):
+    server.delays['1'] = 0.3  # the first row finishes last
+    src = tmp_path / 'products.csv'
+    with open(src, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['id', 'url'])
+        writer.writeheader()
+        writer.writerow({'id': '1', 'url': server.url('/img/1')})
+        writer.writerow({'id': '2', 'url': server.url('/missing/2')})
+        writer.writerow({'id': '3', 'url': server.url('/img/3')})
+    updated = tmp_path / 'updated.csv'
+    monkeypatch.setattr(sys, 'argv', ['download_script.py', '--csv', str(src), '--out', str(tmp_path / 'out'),
+                                      '--updated-csv', str(updated), '--retries', '0'])
+    download_script.main()
+
+    with open(updated, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['id'], row['filename']) for row in rows] == [('1', '1.jpg'), ('2', ''), ('3', '3.jpg')]
@@ -0,0 +1,47 @@
+import os
+import time
+import signal
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+from src.v1.embed_pool import EmbedWorkerPool, ConfigEmbedPool
+
+
+class DoublingModel:
+    def encode_imgs(self, imgs):
+        return np.asarray(imgs).reshape(len(imgs), -1)[:, :4] * 2
+
+
+def make_model():
+    return DoublingModel()
+
+
+@pytest.fixture
+def pool():
+    config = ConfigEmbedPool()
+    config.workers, config.threads_per_worker, config.slots_per_worker = 2, 1, 1
+    pool = EmbedWorkerPool(make_model, (2, 2, 2), dim=4, max_batch=5, config=config)
+    yield pool
+    pool.close()
+
+
+def test_results_keep_the_batch_order(pool):
+    imgs = np.random.default_rng(0).random((13, 2, 2, 2), dtype=np.float32)
+    assert np.allclose(pool.encode(imgs), imgs.reshape(13, -1)[:, :4] * 2)
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason='needs SIGKILL')
+def test_dead_worker_breaks_the_pool_and_frees_each_slot_once(pool):
+    imgs = np.zeros((5, 2, 2, 2), dtype=np.float32)
+    pool.encode(imgs)
+    os.kill(pool._processes[0].pid, signal.SIGKILL)
+    deadline = time.time() + 10
+    while pool._error is None and time.time() < deadline:
+        time.sleep(0.1)
+
+    assert pool._error is not None
+    assert not pool._processes  # the other worker was stopped too
+    with pytest.raises(RuntimeError, match='broken'):
+        pool.submit(imgs)
+    assert pool._free.qsize() == 2 and not pool._in_use
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pydantic')
+from src.db import filters
+from src.db.numpy_manager import NumpyManager
+from tests.test_tombstones import numpy_config, unit_vectors
+
+# ids 1..5: width 10 / 20 / 30 / missing / 20, medium oil / ink / '' (missing) / oil / acrylic
+WIDTHS = [10, 20, 30, None, 20]
+MEDIUMS = ['oil', 'ink', None, 'oil', 'acrylic']
+
+
+@pytest.fixture(scope='module')
+def manager():
+    manager = NumpyManager(numpy_config(), init=True)
+    manager.set_columns([1, 2, 3, 4, 5], unit_vectors(5), {'width': WIDTHS, 'medium': MEDIUMS})
+    return manager
+
+
+def matching(manager, *predicates):
+    ids, _ = manager.search(unit_vectors(1, seed=1), top_k=10, filters=filters.normalize(predicates))
+    return sorted(i for i in ids[0].tolist() if i >= 0)
+
+
+@pytest.mark.parametrize('predicate, expected', [
+    (('width', '==', 20), [2, 5]),
+    (('width', '!=', 20), [1, 3]),  # a missing number never passes, like a milvus null
+    (('width', '<', 20), [1]),
+    (('width', '<=', 20), [1, 2, 5]),
+    (('width', '>', 20), [3]),
+    (('width', '>=', 20), [2, 3, 5]),
+    (('width', 'in', [10, 30]), [1, 3]),
+    (('width', 'not in', [10, 30]), [2, 5]),
+    (('medium', '==', 'oil'), [1, 4]),
+    (('medium', '!=', 'oil'), [2, 3, 5]),  # missing text is '', it passes !=
+    (('medium', 'in', ['ink', 'acrylic']), [2, 5]),
+    (('medium', 'not in', ['ink', 'acrylic']), [1, 3, 4]),
+    (('medium', '==', ''), [3]),
+])
+def test_each_operator_on_the_numpy_backend(manager, predicate, expected):
+    assert matching(manager, predicate) == expected
+
+
+def test_predicates_are_anded(manager):
+    assert matching(manager, ('medium', '==', 'oil'), ('width', '<', 100)) == [1]
+    assert matching(manager, ('medium', '==', 'oil'), ('width', '>', 10)) == []
+
+
+def test_unset_fields_are_missing(manager):
+    assert matching(manager, ('height', '>=', 0)) == []
+    assert matching(manager, ('style', '==', '')) == [1, 2, 3, 4, 5]
+
+
+def test_normalize():
+    predicates = [filters.Filter(field='width', op='<', value=80), ('medium', 'in', ['oil', 'ink'])]
+    normalized = filters.normalize(predicates)
+    assert normalized == filters.normalize(predicates[::-1])  # order doesn't change the cache key
+    assert ('width', '<', 80.0) in normalized and ('medium', 'in', ('oil', 'ink')) in normalized
+    assert filters.normalize(None) == ()
+
+
+@pytest.mark.parametrize('predicate', [
+    ('colour', '==', 'red'),
+    ('width', '~', 1),
+    ('width', 'in', 3),
+    ('width', '==', [3]),
+    ('width', '<', 'wide'),
+    ('medium', '<', 'oil'),
+])
+def test_normalize_rejects(predicate):
+    with pytest.raises(ValueError):
+        filters.normalize([predicate])
+
+
+def test_to_expr():
+    normalized = filters.normalize([('width', '>=', 20), ('medium', 'not in', ['קנבס', 'ink'])])
+    assert filters.to_expr(normalized) == 'medium not in ["קנבס", "ink"] and width >= 20.0'
+    assert filters.to_expr(()) == ''
+
+
+def test_mask_without_filters():
+    assert filters.mask((), {'width': np.array([1.0])}) is None
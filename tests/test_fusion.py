@@ -0,0 +1,83 @@
+from collections import defaultdict
+import numpy as np
+import pytest
+from src.v1.fusion import fuse, fuse_scores, pad_rankings, top_n
+
+
+def baseline_borda(rankings, dislikes=None):
+    """the defaultdict Borda count Logic used before fusion.py, returns id -> points"""
+    scores = defaultdict(int)
+    max_rank = max(len(r) for r in rankings) if rankings else 0
+    max_dislike_rank = max(len(d) for d in dislikes) if dislikes else 0
+    for ranking in rankings:
+        for rank, image_id in enumerate(ranking):
+            scores[image_id] += (max_rank - rank)
+    for dislike_ranking in dislikes or []:
+        for rank, image_id in enumerate(dislike_ranking):
+            scores[image_id] -= (max_dislike_rank - rank)
+    return dict(scores)
+
+
+def test_borda_matches_the_baseline_with_padding_holes():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        liked = [rng.choice(50, size=rng.integers(1, 12), replace=False).tolist() for _ in range(3)]
+        disliked = [rng.choice(50, size=rng.integers(1, 8), replace=False).tolist() for _ in range(2)]
+        candidates, totals = fuse_scores(pad_rankings(liked), disliked_ids=pad_rankings(disliked))
+        assert dict(zip(candidates.tolist(), totals.tolist())) == baseline_borda(liked, disliked)
+
+
+def test_padding_is_ignored():
+    candidates, totals = fuse_scores(np.array([[5, 6, -1], [-1, -1, -1]]))
+    assert candidates.tolist() == [5, 6] and totals.tolist() == [2.0, 1.0]
+    assert fuse(np.full((2, 3), -1)) == []
+
+
+def test_dislike_weighting():
+    liked = np.array([[1, 2, 3]])
+    disliked = np.array([[2, 4]])
+    candidates, totals = fuse_scores(liked, disliked_ids=disliked, dislike_weight=2.0)
+    assert dict(zip(candidates.tolist(), totals.tolist())) == {1: 3.0, 2: -2.0, 3: 1.0, 4: -2.0}
+    assert fuse(liked, disliked_ids=disliked, n=None, dislike_weight=2.0) == [1, 3, 2, 4]
+
+
+def test_rrf():
+    liked = np.array([[1, 2], [2, -1]])
+    candidates, totals = fuse_scores(liked, disliked_ids=np.array([[1]]), method='rrf', rrf_k=10)
+    expected = {1: 1 / 11 - 1 / 11, 2: 1 / 12 + 1 / 11}
+    assert candidates.tolist() == [1, 2]
+    np.testing.assert_allclose(totals, [expected[1], expected[2]])
+
+
+def test_score_fusion():
+    liked = np.array([[1, 2], [3, 2]])
+    scores = np.array([[0.9, 0.5], [0.8, 0.45]], dtype=np.float32)
+    candidates, totals = fuse_scores(liked, scores, np.array([[1, -1]]), np.array([[0.3, 0.0]]), method='score')
+    np.testing.assert_allclose(totals, [0.6, 0.95, 0.8], rtol=1e-6)
+    assert fuse(liked, scores, n=2, method='score') == [2, 1]
+    with pytest.raises(ValueError):
+        fuse_scores(liked, method='score')
+    with pytest.raises(ValueError):
+        fuse_scores(liked, method='condorcet')
+
+
+def test_exclusions_and_ties():
+    liked = np.array([[1, 2, 3], [4, 5, 6]])  # 1 and 4, 2 and 5, 3 and 6 tie
+    assert fuse(liked, n=None) == [1, 4, 2, 5, 3, 6]  # ties go to the smaller id
+    assert fuse(liked, n=3, exclude={1, 5}) == [4, 2, 3]
+    assert fuse(liked, n=3, exclude=[]) == [1, 4, 2]
+
+
+def test_top_n_keeps_everything_tied_with_the_nth():
+    candidates = np.array([9, 3, 7, 1])
+    totals = np.array([2.0, 5.0, 2.0, 2.0])
+    assert top_n(candidates, totals, 2).tolist() == [3, 1]
+    assert top_n(candidates, totals, 10).tolist() == [3, 1, 7, 9]
+
+
+def test_groups_keep_the_best_member():
+    canonical = {2: 1, 3: 1}
+    groups = lambda ids: np.array([canonical.get(i, i) for i in np.asarray(ids).tolist()], dtype=np.int64)
+    liked = np.array([[3, 4, 1, 2, 5]])
+    assert fuse(liked, n=None, groups=groups) == [3, 4, 5]
+    assert fuse(liked, n=None, exclude=[2], groups=groups) == [4, 5]  # the whole group is excluded
@@ -0,0 +1,92 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+requests = pytest.importorskip('requests')
+from gui.gui_logic import GuiLogic
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """answers the n-th POST with server.statuses[n] (the last one repeats), records every request"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        encoding = self.headers.get('Content-Encoding')
+        self.server.requests.append({'path': self.path, 'encoding': encoding, 'body': body})
+        statuses = self.server.statuses
+        status = statuses[min(len(self.server.requests), len(statuses)) - 1]
+        if status == 415 and encoding is None:
+            status = 200
+        payload = json.dumps({'job_id': f'job-{len(self.server.requests)}'} if status == 200 else {'detail': 'no'})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ScriptedHandler)
+    httpd.requests = []
+    httpd.statuses = [200]
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_logic(server, **kwargs):
+    host, port = server.server_address
+    return GuiLogic(insert_endpoint=f'http://{host}:{port}/upsert_arts', products_csv=None, **kwargs)
+
+
+CHUNK = [{'id': 1, 'url': 'data/1.jpg', 'img_name': 'a', 'size': [0, 0]},
+         {'id': 2, 'url': 'data/2.jpg', 'img_name': 'b', 'size': [0, 0]}]
+
+
+def test_default_endpoint_is_idempotent():
+    assert GuiLogic(products_csv=None).insert_endpoint.endswith('/upsert_arts')
+
+
+def test_retries_transient_errors(server, monkeypatch):
+    monkeypatch.setattr('gui.gui_logic.time.sleep', lambda seconds: None)
+    server.statuses = [503, 502, 200]
+    result = make_logic(server, retries=3)._post_chunk(CHUNK)
+
+    assert result == {'job_id': 'job-3'}
+    assert len(server.requests) == 3
+    assert {request['path'] for request in server.requests} == {'/upsert_arts'}
+    assert json.loads(gzip.decompress(server.requests[-1]['body'])) == CHUNK
+
+
+def test_gives_up_after_retries(server, monkeypatch):
+    monkeypatch.setattr('gui.gui_logic.time.sleep', lambda seconds: None)
+    server.statuses = [503]
+    with pytest.raises(RuntimeError, match='503'):
+        make_logic(server, retries=2)._post_chunk(CHUNK)
+    assert len(server.requests) == 3
+
+
+def test_client_errors_are_not_retried(server, monkeypatch):
+    monkeypatch.setattr('gui.gui_logic.time.sleep', lambda seconds: None)
+    server.statuses = [422]
+    with pytest.raises(RuntimeError, match='422'):
+        make_logic(server, retries=3)._post_chunk(CHUNK)
+    assert len(server.requests) == 1
+
+
+def test_unsupported_encoding_falls_back_to_plain_json(server, monkeypatch):
+    monkeypatch.setattr('gui.gui_logic.time.sleep', lambda seconds: None)
+    server.statuses = [415]
+    result = make_logic(server, retries=2)._post_chunk(CHUNK)
+
+    assert result == {'job_id': 'job-2'}
+    assert [request['encoding'] for request in server.requests] == ['gzip', None]
+    assert json.loads(server.requests[1]['body']) == CHUNK
@@ -0,0 +1,134 @@
+import json
+import threading
+import pytest
+import numpy as np
+from src.db.numpy_manager import NumpyManager
+from tests.test_tombstones import numpy_config, unit_vectors
+
+
+def test_search_orders_by_cosine_and_pads():
+    manager = NumpyManager(numpy_config(), init=True)
+    vectors = unit_vectors(6)
+    manager.set_columns(np.arange(10, 16), 3 * vectors)  # normalized on insert
+    manager.flush()
+
+    ids, scores = manager.search(vectors[:2], top_k=8)
+    exact = vectors[:2] @ vectors.T
+    assert ids[:, :6].tolist() == (10 + np.argsort(-exact, axis=1)).tolist()
+    np.testing.assert_allclose(scores[:, :6], -np.sort(-exact, axis=1), rtol=1e-5)
+    assert (ids[:, 6:] == -1).all() and np.isneginf(scores[:, 6:]).all()
+
+
+def test_replace_and_filters():
+    manager = NumpyManager(numpy_config(), init=True)
+    vectors = unit_vectors(4)
+    manager.set_columns([1, 2, 3], vectors[:3], {'width': [10, 20, None], 'medium': ['oil', None, 'ink']})
+    manager.set_columns([2, 2], vectors[[0, 3]], {'width': [30, 40]})  # an id sent twice keeps its last row
+
+    found, fetched = manager.get_vectors([2, 1, 9])
+    assert found.tolist() == [2, 1]
+    np.testing.assert_allclose(fetched[0], vectors[3], rtol=1e-6)
+    ids, _ = manager.search(vectors[3:4], top_k=5)
+    assert sorted(i for i in ids[0].tolist() if i >= 0) == [1, 2, 3]  # the replaced row is masked
+
+    ids, _ = manager.search(vectors[3:4], top_k=5, filters=(('width', '>=', 20),))
+    assert [i for i in ids[0].tolist() if i >= 0] == [2]
+    ids, _ = manager.search(vectors[3:4], top_k=5, filters=(('medium', '==', 'oil'),))
+    assert [i for i in ids[0].tolist() if i >= 0] == [1]
+
+
+def test_snapshot_keeps_its_rows():
+    manager = NumpyManager(numpy_config(), init=True)
+    vectors = unit_vectors(4)
+    manager.set_columns([1, 2], vectors[:2])
+    ids, held, size, deleted, _, _, _, _ = manager._snapshot()
+    before = held[:size].copy()
+
+    manager.set_columns([1, 3], vectors[2:4])  # a replace and an append
+    np.testing.assert_array_equal(held[:size], before)
+    assert ids[:size].tolist() == [1, 2] and deleted == []
+
+
+def test_persistence_round_trip(tmp_path):
+    config = numpy_config(numpy_dir=str(tmp_path))
+    manager = NumpyManager(config, init=True)
+    vectors = unit_vectors(5)
+    manager.set_columns(np.arange(5), vectors, {'style': ['a', 'b', 'c', 'd', 'e']})
+    manager.set_columns([1], vectors[4:5], {'style': ['z']})
+    manager.delete([3])
+    manager.flush()
+
+    reloaded = NumpyManager(config, init=False)
+    assert sorted(reloaded._row_of) == [0, 1, 2, 4]
+    found, fetched = reloaded.get_vectors([1])
+    np.testing.assert_allclose(fetched[0], vectors[4], rtol=1e-6)
+    ids, _ = reloaded.search(vectors[4:5], top_k=5, filters=(('style', '==', 'z'),))
+    assert [i for i in ids[0].tolist() if i >= 0] == [1]
+
+    reloaded.set_columns([3], vectors[3:4])  # deleted, then inserted again
+    reloaded.flush()
+    again = NumpyManager(config, init=False)
+    assert sorted(again._row_of) == [0, 1, 2, 3, 4]
+
+
+def test_saves_are_debounced(tmp_path):
+    manager = NumpyManager(numpy_config(numpy_dir=str(tmp_path), numpy_save_delay_s=60), init=True)
+    manager.set_columns([1, 2], unit_vectors(2))
+    manager.flush()
+    assert not (tmp_path / 'test_ids.npy').exists()
+    assert manager._save_timer is not None
+
+    manager.save()
+    assert manager._save_timer is None
+    assert np.load(tmp_path / 'test_ids.npy').tolist() == [1, 2]
+
+
+def test_replaced_rows_are_compacted():
+    manager = NumpyManager(numpy_config(), init=True)
+    vectors = unit_vectors(8)
+    manager.set_columns(np.arange(8), vectors)
+    manager.set_columns([0], vectors[:1])
+    manager.flush()
+    assert manager._size == 9 and len(manager._deleted) == 1
+
+    manager.set_columns([1, 2], vectors[1:3])
+    manager.flush()  # 3 dead rows of 11
+    assert manager._size == 8 and not manager._deleted
+    assert sorted(manager._row_of) == list(range(8))
+
+
+def test_concurrent_replace_and_search():
+    manager = NumpyManager(numpy_config(), init=True)
+    vectors = unit_vectors(64)
+    manager.set_columns(np.arange(64), vectors)
+    errors = []
+    stop = threading.Event()
+
+    def search():
+        while not stop.is_set():
+            ids, scores = manager.search(vectors[:8], top_k=64)
+            if not (np.sort(ids, axis=1) == np.arange(64)).all() or np.isneginf(scores).any():
+                errors.append(ids)
+
+    readers = [threading.Thread(target=search) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    for i in range(200):
+        manager.set_columns([i % 64], vectors[i % 64: i % 64 + 1])
+        if i % 50 == 0:
+            manager.compact()
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert not errors
+
+
+def test_init_removes_the_metadata_file(tmp_path):
+    db_api = pytest.importorskip('src.db.db_api', exc_type=ImportError)
+    config = numpy_config(numpy_dir=str(tmp_path), backend='numpy', coalesce_window_ms=0, use_prompt_embedding=False)
+    path = tmp_path / 'test_metadata.json'
+    path.write_text(json.dumps({'id': [1], 'url': ['1.jpg']}))
+    assert len(db_api.DBApi(init=False, config_db=config).metadata) == 1
+
+    assert len(db_api.DBApi(init=True, config_db=config).metadata) == 0
+    assert not path.exists()
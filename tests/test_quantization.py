@@ -0,0 +1,130 @@
+import threading
+import numpy as np
+import pytest
+from src.db import numpy_manager as numpy_manager_module
+from src.db.quantization import make_codec
+from src.db.quantization_recall import evaluate
+from src.db.numpy_manager import NumpyManager
+
+
+def clustered_vectors(n=2000, dim=32, clusters=40, seed=0):
+    """unit vectors around a few centers, closer to real embeddings than iid noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.normal(size=(n, dim))
+    vectors = vectors.astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope='module')
+def report():
+    vectors = clustered_vectors()
+    queries = vectors[np.random.default_rng(1).choice(len(vectors), 100, replace=False)]
+    rows = evaluate(vectors, queries, ks=[10], reranks=[0, 256], quantizations=['float16', 'int8', 'pq'],
+                    pq_subspaces=8)
+    return {(row['quantization'], row['rerank']): row for row in rows}
+
+
+@pytest.mark.parametrize('quantization, rerank, min_recall', [
+    ('float16', 0, 0.99),
+    ('int8', 0, 0.9),
+    ('pq', 0, 0.5),
+    ('float16', 256, 0.99),
+    ('int8', 256, 0.99),
+    ('pq', 256, 0.95),
+])
+def test_codec_recall(report, quantization, rerank, min_recall):
+    assert report[(quantization, rerank)]['recall@10'] >= min_recall
+
+
+@pytest.mark.parametrize('quantization, compression', [('float16', 2), ('int8', 4), ('pq', 16)])
+def test_codec_compression(report, quantization, compression):
+    assert report[(quantization, 0)]['compression'] == compression
+
+
+def test_codec_scores_match_dot_products():
+    vectors = clustered_vectors(n=300)
+    codec = make_codec('int8')
+    codec.fit(vectors)
+    approx = codec.scores(vectors[:5], codec.encode(vectors))
+    assert np.abs(approx - vectors[:5] @ vectors.T).max() < 0.05
+
+
+def quantized_config(quantization, **overrides):
+    return type('QuantizedConfig', (), {
+        'img_embed_dim': 32, 'collection_name': 'test', 'numpy_dir': None, 'numpy_mmap': None,
+        'numpy_save_delay_s': 0, 'numpy_quantization': quantization, 'numpy_rerank_k': 64, 'numpy_pq_subspaces': 8,
+        'numpy_codec_sample': 10_000, **overrides})
+
+
+def test_pq_scores_are_blocked_over_queries():
+    vectors = clustered_vectors(n=500)
+    codec = make_codec('pq', 8).fit(vectors)
+    codes = codec.encode(vectors)
+    expected = codec.scores(vectors[:20], codes)
+    codec.block_queries, codec.block_rows = 3, 64
+    np.testing.assert_allclose(codec.scores(vectors[:20], codes), expected, rtol=1e-6)
+
+
+@pytest.mark.parametrize('quantization', ['float16', 'int8', 'pq'])
+def test_numpy_manager_reranked_search(quantization):
+    vectors = clustered_vectors(n=1000)
+    manager = NumpyManager(quantized_config(quantization), init=True)
+    manager.set_columns(np.arange(len(vectors)), vectors)
+    manager.flush()  # encodes the rows with the codec
+
+    ids, _ = manager.search(vectors[:20], top_k=5)
+    exact = np.argsort(-(vectors[:20] @ vectors.T), axis=1)[:, :5]
+    assert np.mean([len(set(a) & set(b)) / 5 for a, b in zip(ids, exact)]) >= 0.95
+
+
+def test_quantized_rows_stay_mapped(tmp_path):
+    config = quantized_config('pq', numpy_dir=str(tmp_path))
+    vectors = clustered_vectors(n=3000)
+    manager = NumpyManager(config, init=True)
+    for start in range(0, 3000, 1000):  # grows the mapped file twice
+        manager.set_columns(np.arange(start, start + 1000), vectors[start:start + 1000])
+        manager.flush()
+    assert isinstance(manager._vectors, np.memmap) and len(manager._vectors) == 4096
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['test_deleted.npy', 'test_ids.npy',
+                                                                'test_img_embedding.npy', 'test_scalars.npz']
+    assert manager._codes.nbytes == 3000 * 8
+    manager.delete(np.arange(1000))
+    manager.compact()
+
+    reloaded = NumpyManager(config, init=False)
+    assert isinstance(reloaded._vectors, np.memmap) and reloaded._size == 2000
+    ids, _ = reloaded.search(vectors[1000:1010], top_k=1)
+    assert ids[:, 0].tolist() == list(range(1000, 1010))
+
+
+def test_codec_is_fitted_outside_the_lock(monkeypatch):
+    fitting, release = threading.Event(), threading.Event()
+    make = numpy_manager_module.make_codec
+
+    def slow_codec(name, pq_subspaces):
+        codec = make(name, pq_subspaces)
+        fit = codec.fit
+
+        def slow_fit(vectors):
+            fitting.set()
+            release.wait(5)
+            return fit(vectors)
+        codec.fit = slow_fit
+        return codec
+
+    vectors = clustered_vectors(n=450)
+    manager = NumpyManager(quantized_config('int8'), init=True)
+    manager.set_columns(np.arange(200), vectors[:200])
+    manager.flush()
+    manager.set_columns(np.arange(200, 450), vectors[200:])
+    monkeypatch.setattr(numpy_manager_module, 'make_codec', slow_codec)
+    retrain = threading.Thread(target=manager.flush)  # the catalog doubled: retrain
+    retrain.start()
+    assert fitting.wait(5)
+
+    ids, _ = manager.search(vectors[300:301], top_k=1)  # not blocked by the fit, the new rows are scored exactly
+    assert ids.tolist() == [[300]] and manager._n_indexed == 200
+    release.set()
+    retrain.join()
+    assert manager._n_indexed == 450 and manager._codes.shape == (450, 32)
@@ -0,0 +1,50 @@
+import time
+import threading
+import numpy as np
+from src.db.search_batcher import SearchBatcher
+
+
+class Engine:
+    """fake search: every query row answers with its own first value as the id"""
+
+    def __init__(self, delay_s=0.0):
+        self.delay_s = delay_s
+        self.calls = []
+
+    def search(self, embeddings, anns_field="img_embedding", top_k=1000, filters=()):
+        self.calls.append((len(embeddings), threading.current_thread().name))
+        time.sleep(self.delay_s)
+        ids = np.repeat(embeddings[:, :1].astype(np.int64), top_k, axis=1)
+        return ids, np.ones(ids.shape, dtype=np.float32)
+
+
+def test_an_idle_search_runs_directly():
+    engine = Engine()
+    batcher = SearchBatcher(engine.search, window_ms=500, max_batch=64)
+    t0 = time.perf_counter()
+    ids, _ = batcher.search(np.array([[7.0, 0.0]]), top_k=2)
+    assert time.perf_counter() - t0 < 0.25  # didn't wait for the window
+    assert ids.tolist() == [[7, 7]]
+    assert engine.calls == [(1, threading.current_thread().name)]
+
+
+def test_searches_under_load_are_coalesced():
+    engine = Engine(delay_s=0.2)
+    batcher = SearchBatcher(engine.search, window_ms=100, max_batch=64)
+    results = {}
+
+    def search(i):
+        results[i] = batcher.search(np.array([[float(i), 0.0]]), top_k=1)[0]
+
+    first = threading.Thread(target=search, args=(0,))
+    first.start()
+    time.sleep(0.05)  # the first search is in flight, the next ones queue up
+    others = [threading.Thread(target=search, args=(i,)) for i in range(1, 5)]
+    for thread in others:
+        thread.start()
+    for thread in [first] + others:
+        thread.join()
+
+    assert {i: ids.tolist() for i, ids in results.items()} == {i: [[i]] for i in range(5)}
+    assert [n for n, _ in engine.calls] == [1, 4]
+    assert batcher.batches == 2 and batcher.requests == 5
@@ -0,0 +1,116 @@
+import json
+import threading
+import numpy as np
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+from gui.thumbnails import ThumbnailAtlas, ConfigThumbnails
+
+
+def make_images(tmp_path, n):
+    images = tmp_path / 'images'
+    images.mkdir(exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = images / f'{i}.jpg'
+        Image.new('RGB', (40, 20), color=(10 * i % 256, 0, 0)).save(path)
+        paths.append(path)
+    return paths
+
+
+def make_atlas(tmp_path, **overrides):
+    config = ConfigThumbnails()
+    config.cache_dir = str(tmp_path / 'thumbnails')
+    config.image_size = (8, 8)
+    config.workers = 2
+    config.__dict__.update(overrides)
+    return ThumbnailAtlas(config)
+
+
+def saved_index(atlas):
+    with open(atlas.index_path) as f:
+        return json.load(f)
+
+
+def test_get_writes_the_index_in_batches(tmp_path):
+    paths = make_images(tmp_path, 5)
+    atlas = make_atlas(tmp_path, save_every=3)
+    for path in paths[:2]:
+        assert atlas.get(path.stem, path).shape == (8, 8, 3)
+    with pytest.raises(FileNotFoundError):
+        saved_index(atlas)
+
+    atlas.get(paths[2].stem, paths[2])
+    assert sorted(saved_index(atlas)) == ['0', '1', '2']
+    atlas.get(paths[3].stem, paths[3])
+    atlas.get(paths[3].stem, paths[3])  # fresh, nothing to save
+    assert len(saved_index(atlas)) == 3
+
+    atlas.close()
+    assert sorted(saved_index(atlas)) == ['0', '1', '2', '3']
+
+
+def test_thumbnails_survive_growth_and_reopening(tmp_path):
+    paths = make_images(tmp_path, 3)
+    atlas = make_atlas(tmp_path)
+    first = atlas.get('0', paths[0])
+    capacity = atlas._capacity()
+
+    atlas._grow(capacity + 1)
+    assert atlas._capacity() > capacity
+    np.testing.assert_array_equal(atlas.get('0', paths[0]), first)
+    assert atlas.build(paths) == 2
+    atlas.close()
+
+    reopened = make_atlas(tmp_path)
+    assert reopened.build(paths) == 0
+    np.testing.assert_array_equal(reopened.get('0', paths[0]), first)
+
+
+def test_get_returns_a_copy(tmp_path):
+    paths = make_images(tmp_path, 1)
+    atlas = make_atlas(tmp_path)
+    thumbnail = atlas.get('0', paths[0])
+    thumbnail[:] = 0
+    assert atlas.get('0', paths[0]).any()
+
+
+def test_discard_frees_the_slot(tmp_path):
+    paths = make_images(tmp_path, 2)
+    atlas = make_atlas(tmp_path)
+    atlas.build(paths)
+    slot = atlas.index['0'][0]
+
+    atlas.discard(['0', 'unknown'])
+    assert sorted(saved_index(atlas)) == ['1']
+    assert slot in atlas._free
+    assert make_atlas(tmp_path).index.keys() == {'1'}
+
+
+def test_get_rebuilds_a_discarded_thumbnail(tmp_path):
+    paths = make_images(tmp_path, 2)
+    atlas = make_atlas(tmp_path)
+    first = atlas.get('0', paths[0])
+    errors = []
+
+    def discard():
+        for _ in range(200):
+            atlas.discard(['0'])
+
+    thread = threading.Thread(target=discard)
+    thread.start()
+    try:
+        for _ in range(200):
+            np.testing.assert_array_equal(atlas.get('0', paths[0]), first)
+    except Exception as e:
+        errors.append(e)
+    thread.join()
+    assert not errors
+
+
+def test_padding_colours_get_their_own_files(tmp_path):
+    grey = make_atlas(tmp_path, padding_color=(100, 100, 100))
+    white = make_atlas(tmp_path, padding_color=(255, 255, 255))
+    assert grey.atlas_path != white.atlas_path and grey.index_path != white.index_path
+    assert grey.atlas_path.endswith('atlas_8x8_646464.npy')
+    assert make_atlas(tmp_path, padding_color='white').index_path.endswith('index_8x8_white.json')
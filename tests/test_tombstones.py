@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from src.db.numpy_manager import NumpyManager
+from src.db.tombstones import Tombstones
+
+
+class NumpyConfig:
+    """the ConfigDB fields NumpyManager reads (src.db.db_api imports the embedding model)"""
+    img_embed_dim = 8
+    collection_name = 'test'
+    numpy_dir = None
+    numpy_mmap = False
+    numpy_save_delay_s = 0
+    numpy_quantization = None
+    numpy_rerank_k = 256
+    numpy_pq_subspaces = 4
+    numpy_codec_sample = 10_000
+
+
+def numpy_config(**overrides):
+    return type('TestNumpyConfig', (NumpyConfig,), overrides)
+
+
+def unit_vectors(n, dim=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_tombstones_mask_add_remove():
+    tombstones = Tombstones(capacity=4)
+    tombstones.add([3, 10_000])
+    assert len(tombstones) == 2
+    assert 10_000 in tombstones and 4 not in tombstones
+    mask = tombstones.mask(np.array([[3, -1, 5], [10_000, 20_000, 3]]))
+    assert mask.tolist() == [[True, False, False], [True, False, True]]
+    tombstones.remove([3])
+    assert tombstones.ids().tolist() == [10_000]
+
+
+def test_numpy_delete_is_masked_then_compacted(tmp_path):
+    manager = NumpyManager(numpy_config(numpy_dir=str(tmp_path)), init=True)
+    vectors = unit_vectors(10)
+    manager.set_columns(np.arange(10), vectors)
+    manager.flush()
+
+    manager.delete([0, 1])
+    ids, _ = manager.search(vectors[:2], top_k=10)
+    assert not np.isin(ids, [0, 1]).any()
+    found, _ = manager.get_vectors([0, 2])
+    assert found.tolist() == [2]
+
+    manager.compact()
+    assert manager._size == 8 and not manager._deleted
+    ids, _ = manager.search(vectors[2:3], top_k=1)
+    assert ids.tolist() == [[2]]
+
+
+def test_numpy_delete_survives_a_restart_before_compaction(tmp_path):
+    config = numpy_config(numpy_dir=str(tmp_path))
+    manager = NumpyManager(config, init=True)
+    vectors = unit_vectors(5)
+    manager.set_columns(np.arange(5), vectors)
+    manager.flush()
+    manager.delete([3])  # no flush, no compaction
+
+    reloaded = NumpyManager(config, init=False)
+    ids, _ = reloaded.search(vectors[3:4], top_k=5)
+    assert 3 not in ids
+    assert sorted(i for i in ids[0].tolist() if i >= 0) == [0, 1, 2, 4]
+
+
+def test_reinserted_id_is_visible_again():
+    pytest.importorskip('src.v1.embed_model', exc_type=ImportError)  # needs torch and clip
+    from src.db.db_api import DBApi, ConfigDB
+    from src.v1.art_image import ArtImage, ArtBatch
+
+    config_db = ConfigDB()
+    config_db.backend, config_db.numpy_dir, config_db.img_embed_dim = 'numpy', None, 8
+    config_db.coalesce_window_ms, config_db.compact_delay_s, config_db.numpy_quantization = 0, 3600, None
+    db_api = DBApi(init=True, config_db=config_db)
+
+    vectors = unit_vectors(3)
+    arts = [ArtImage(id=i, url=f'{i}.jpg', img_name=str(i), size=(1, 1)) for i in range(3)]
+    db_api.insert_arts(ArtBatch(arts, vectors))
+    db_api.delete_arts([1])
+    assert 1 not in db_api.search_embeddings(vectors[1:2], top_k=3)[0]
+
+    db_api.insert_arts(ArtBatch(arts[1:2], vectors[1:2]))
+    assert db_api.search_embeddings(vectors[1:2], top_k=1)[0].tolist() == [[1]]
+    db_api._compact_timer.cancel()
@@ -0,0 +1,51 @@
+import threading
+import numpy as np
+from src.db.vector_cache import VectorCache, stack_vectors
+
+
+def test_lru_eviction():
+    cache = VectorCache(2, max_size=2)
+    cache.put(1, [1, 0])
+    cache.put(2, [0, 1])
+    assert list(cache.get_many([1])) == [1]  # 1 is now the most recent
+    cache.put(3, [1, 1])
+    assert 2 not in cache and 1 in cache and len(cache) == 2
+    cache.discard([1, 9])
+    assert list(cache.get_many([3, 1, 3])) == [3]
+
+
+def test_fetched_vectors_outlive_eviction():
+    cache = VectorCache(2, max_size=2)
+    fetched = {i: [i, 0] for i in range(5)}
+    cache.put_many(fetched)
+    assert len(cache) == 2
+
+    found = cache.get_many(range(5))
+    found.update(fetched)
+    ids, vectors = stack_vectors([4, 0, 7, 2, 0], found, 2)
+    assert ids.tolist() == [4, 0, 2]
+    assert vectors[:, 0].tolist() == [4, 0, 2]
+
+
+def test_concurrent_use():
+    cache = VectorCache(4, max_size=16)
+    errors = []
+
+    def work(offset):
+        try:
+            for i in range(2000):
+                art_id = (offset + i) % 40
+                cache.put(art_id, np.full(4, art_id))
+                for found_id, vector in cache.get_many([art_id, art_id + 1]).items():
+                    assert vector[0] == found_id
+                if i % 100 == 0:
+                    cache.discard([art_id])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(k * 7,)) for k in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors and len(cache) <= 16